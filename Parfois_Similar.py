@@ -1,32 +1,84 @@
+import html
+import logging
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
 import pandas as pd
 import streamlit as st
-from PIL import Image
+
+from ann_index import ANN_INDEX_NPZ, IVFIndex, catalogue_vectors, index_signature, load_or_build
+from embedding_store import EMBEDDINGS_NPY, open_embeddings
+from feedback_store import (
+    RATINGS_PATH,
+    SPOOL_PATH,
+    FeedbackCache,
+    FeedbackQueue,
+    FeedbackSpool,
+    LocalBackend,
+    PairRatings,
+    SupabaseBackend,
+    ReadOnceFile,
+    export_csv_file,
+    supabase_connector,
+)
+from image_manifest import IMAGE_DIRS, ImageManifest, build_manifest, dirs_signature
+from image_query import load_encoder, search_by_image
+from image_server import start_server
+from neighbour_graph import NeighbourGraph, load_graph
+from product_search import ProductSearchIndex
+from result_table import ResultLookup, data_version, read_result_table
+from thumbnails import STATIC_URL, image_srcset
+
+logger = logging.getLogger(__name__)
 #---------------------------------------
 # INPUT FROM THE USER
 #______________________________________
 
-from supabase import create_client
-import streamlit as st
+# Backend do feedback: "supabase" (por omissão) ou "local" (só o spool
+# SQLite, para correr offline ou em testes)
+FEEDBACK_BACKEND = os.environ.get("FEEDBACK_BACKEND", "supabase")
 
-# Ler as keys do st.secrets
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
+# Representação dos embeddings na pesquisa live: "float32" (por omissão),
+# "float16", "int8" ou "pq" (ver quantization.py)
+ANN_QUANTIZATION = os.environ.get("ANN_QUANTIZATION", "float32")
 
-# Criar o cliente Supabase
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Encoder da pesquisa por foto: "clip" (por omissão), "onnx" ou "stand-in"
+# (projeção simples, sem modelo, para testes; ver image_query.py)
+IMAGE_ENCODER = os.environ.get("IMAGE_ENCODER", "clip")
 
+# Imagens dos cartões: por omissão pela rota estática do Streamlit
+# (static/thumbs); com IMAGE_SERVER_PORT, pelo image_server.py (cache
+# imutável no browser). IMAGE_BASE_URL é o URL visto pelo browser.
+IMAGE_SERVER_PORT = os.environ.get("IMAGE_SERVER_PORT")
+IMAGE_BASE_URL = os.environ.get("IMAGE_BASE_URL")
 
-#--------
-# recebe um dicionário com os dados e faz o insert na tabela
-#--------
 
+@st.cache_resource
+def get_feedback_queue() -> FeedbackQueue:
+    """
+    Fila de escrita do feedback, partilhada por todas as sessões: as linhas
+    ficam no spool SQLite e um worker envia-as em lotes para o backend.
+
+    Criada uma vez por processo. O cliente Supabase (import do pacote e
+    ligação) só é criado no primeiro envio ou leitura, e depois reutilizado.
+    """
+    spool = FeedbackSpool(SPOOL_PATH)
+    if FEEDBACK_BACKEND == "local":
+        backend = LocalBackend(spool)
+    else:
+        # Ler as keys do st.secrets
+        connect = supabase_connector(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+        backend = SupabaseBackend(connect=connect)
+    return FeedbackQueue(spool, backend)
 
-import datetime
+
+#--------
+# recebe os dados do formulário e põe a linha na fila de escrita
+#--------
 
 def guardar_feedback(
     artigo_escolhido,
@@ -47,29 +99,85 @@ def guardar_feedback(
         "comentario": comentario,
     }
 
-    resposta = supabase.table("feedback").insert(row).execute()
-    return resposta
+    # Fica gravado localmente já; o envio para o backend é feito em segundo plano
+    # (os contadores por par já a contam a partir do spool)
+    return get_feedback_queue().submit(row)
 
+#-------------------
+# Contagens de avaliações por par (artigo escolhido, artigo recomendado)
+#-------------------
 
-    # inserir na tabela "feedback"
-    resposta = supabase.table("feedback").insert(row).execute()
-    return resposta
+@st.cache_resource
+def get_pair_ratings() -> PairRatings:
+    """
+    Espelho SQLite com os contadores Bad/Medium/Good de cada par, mais as
+    linhas do spool que ainda não chegaram ao espelho.
+    """
+    return PairRatings(RATINGS_PATH, spool=get_feedback_queue().spool)
+
+
+def ler_avaliacoes(artigo_escolhido, artigos):
+    """
+    Contagens (bad, medium, good) dos pares (artigo_escolhido, artigo) já
+    avaliados. Os contadores são atualizados com as linhas novas do
+    feedback no máximo uma vez por minuto, numa thread em segundo plano
+    (a página nunca espera pelo backend); as avaliações acabadas de
+    guardar contam logo, a partir do spool local.
+    """
+    ratings = get_pair_ratings()
+    # Na primeira execução da sessão não: a sincronização importa o pacote
+    # supabase e cria o cliente, o que fica para depois do primeiro render
+    if st.session_state.get("primeiro_render_concluido"):
+        try:
+            ratings.sync_if_stale(get_feedback_queue().backend, wait=False)
+        except Exception:
+            pass  # backend indisponível: ficam as contagens que já temos
+    return ratings.get_many(artigo_escolhido, artigos)
 
 #-------------------
 # Botão de descarregar dados de comentários
 #-------------------
 
-def carregar_feedback_df():
-    """Lê a tabela 'feedback' do Supabase e devolve um DataFrame."""
+@st.cache_resource
+def get_feedback_cache() -> FeedbackCache:
+    """
+    Cópia local (SQLite) da tabela 'feedback', partilhada por todas as
+    sessões. Só vai buscar ao backend as linhas novas, no máximo uma vez
+    por minuto, ou logo a seguir a uma entrega do spool.
+    """
+    queue = get_feedback_queue()
+    cache = FeedbackCache(queue.backend, DATA_DIR / f"feedback_cache_{FEEDBACK_BACKEND}.sqlite")
+    queue.on_delivered(lambda seqs: cache.invalidate())
+    return cache
+
+
+def exportar_feedback_csv() -> ReadOnceFile:
+    """
+    CSV da tabela 'feedback' (';' e UTF-8 com BOM), a partir da cópia local.
+
+    Só corre quando alguém carrega no botão de download. A exportação
+    escreve página a página num ficheiro temporário, que é devolvido sem
+    ser lido; o st.download_button lê-o (o ficheiro é libertado nessa
+    altura) e guarda o CSV em memória até ao download: o limite é uma
+    cópia do CSV por download, feita pelo Streamlit.
+    """
+    cache = get_feedback_cache()
     try:
-        resp = supabase.table("feedback").select("*").execute()
-        data = resp.data  # lista de dicionários
-        if not data:
-            return pd.DataFrame()
-        return pd.DataFrame(data)
-    except Exception as e:
-        st.error(f"Erro ao carregar feedback: {e}")
-        return pd.DataFrame()
+        cache.refresh_if_stale()
+    except Exception:
+        pass  # backend indisponível: exporta a última cópia
+    return export_csv_file(cache)
+
+
+def ha_feedback() -> bool:
+    """
+    Há linhas para descarregar? Vê só a cópia local e o spool; a cópia é
+    atualizada em segundo plano (depois do primeiro render da sessão).
+    """
+    cache = get_feedback_cache()
+    if st.session_state.get("primeiro_render_concluido"):
+        cache.refresh_if_stale(wait=False)
+    return cache.last_id() is not None or bool(get_feedback_queue().spool.fetch_after(None, 1))
 
 
 
@@ -79,11 +187,14 @@ def carregar_feedback_df():
 # -------------------------------------------------
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
-FILES_DIR = BASE_DIR / "Files"
-IMAGE_DIRS = [FILES_DIR / "file1", FILES_DIR / "file2", FILES_DIR / "file3"]
 LOGO_PATH = BASE_DIR / "parfois.png"
 
 RESULT_CSV = DATA_DIR / "result_df.csv"
+RESULT_PARQUET = DATA_DIR / "result_df.parquet"
+NEIGHBOURS_NPZ = DATA_DIR / "neighbours.npz"
+
+# Number of neighbours that get a rating (and go to the feedback table)
+N_RATED = 4
 
 # -------------------------------------------------
 # Streamlit page configuration
@@ -121,12 +232,11 @@ st.markdown(
 # -------------------------------------------------
 # Data helpers
 # -------------------------------------------------
-@st.cache_data
-def load_data(csv_path: Path) -> pd.DataFrame:
-    df = pd.read_csv(csv_path)
-
-    # Drop useless index column if present
-    df = df.drop(columns=["Unnamed: 0"], errors="ignore")
+@st.cache_resource
+def load_data(parquet_path: Path, csv_path: Path, version: tuple) -> pd.DataFrame:
+    # Parquet artifact (display columns precomputed), or CSV as a fallback.
+    # Shared read-only across sessions; ``version`` (file mtimes) is the cache key.
+    df = read_result_table(parquet_path, csv_path)
 
     # Ensure some important columns exist (will warn if missing)
     expected_cols = [
@@ -138,53 +248,181 @@ def load_data(csv_path: Path) -> pd.DataFrame:
     ]
     missing = [c for c in expected_cols if c not in df.columns]
     if missing:
-        st.warning(f"Warning: missing columns in result_df.csv: {missing}")
+        st.warning(f"Warning: missing columns in result_df: {missing}")
 
-    # Format PROD_REF as clean string (no .0 for integers)
-    def format_prod_ref(x):
-        if pd.isna(x):
-            return ""
-        try:
-            val = float(x)
-            if val.is_integer():
-                return str(int(val))
-            return str(val)
-        except Exception:
-            return str(x)
+    return df
 
-    df["PROD_REF_STR"] = df["PROD_REF"].apply(format_prod_ref)
 
-    # Create display label for the selector
-    def make_label(row):
-        ref = row["PROD_REF_STR"]
-        desc = str(row.get("DES_CONC", ""))
-        img = str(row["image_name"])
-        parts = [img]
-        if ref:
-            parts.append(ref)
-        if desc:
-            parts.append(desc)
-        return " | ".join(parts)
+@st.cache_resource
+def load_neighbours(npz_path: Path, version: tuple, _image_names: pd.Series) -> Optional[NeighbourGraph]:
+    """
+    Load the neighbour graph once per data version.
 
-    df["display_label"] = df.apply(make_label, axis=1)
+    Returns None if the graph was built for a different result_df.csv
+    (the page then falls back to the similar_image_k columns).
+    """
+    graph = load_graph(npz_path)
+    if not graph.matches(_image_names):
+        return None
+    return graph
 
-    return df
+
+@st.cache_resource
+def load_lookup(version: tuple, _df: pd.DataFrame) -> ResultLookup:
+    """Label / image_name -> row indexes and row codes, once per data version."""
+    return ResultLookup(_df)
+
+
+@st.cache_resource
+def load_search_index(version: tuple, _df: pd.DataFrame) -> ProductSearchIndex:
+    """Inverted index of the product picker (see product_search.py), once per data version."""
+    return ProductSearchIndex(_df)
+
+
+def get_similar_entries(
+    df: pd.DataFrame,
+    graph: Optional[NeighbourGraph],
+    lookup: ResultLookup,
+    row_pos: int,
+    k: int = N_RATED,
+) -> list:
+    """
+    Return [(neighbour_row, score), ...] for the product at ``row_pos``.
+
+    With the neighbour graph every neighbour is read by position; without
+    it the similar_image_k columns are resolved through the image_name index.
+    """
+    if graph is not None:
+        idx, scores = graph.neighbours(row_pos, k)
+        return [(df.iloc[i], float(score)) for i, score in zip(idx, scores)]
+
+    selected_row = df.iloc[row_pos]
+    similar_entries = []
+
+    for rank in range(1, k + 1):
+        img_col = f"similar_image_{rank}"
+        score_col = f"similarity_score_{rank}"
+
+        if img_col not in df.columns or score_col not in df.columns:
+            continue
+
+        similar_name = selected_row.get(img_col)
+        sim_score = selected_row.get(score_col)
+
+        if pd.isna(similar_name):
+            continue
+
+        neighbour_pos = lookup.row_of_image.get(str(similar_name))
+        if neighbour_pos is None:
+            continue
+
+        similar_entries.append((df.iloc[neighbour_pos], sim_score))
+
+    return similar_entries
+
+
+@st.cache_resource
+def load_ann_index(
+    embeddings_path: Path,
+    index_path: Path,
+    version: tuple,
+    _image_names: pd.Series,
+    quantization: str = "float32",
+):
+    """
+    Build (or load) the IVF index over the result_df rows once per data version.
+
+    ``quantization`` ("float32", "float16", "int8" or "pq") is the
+    representation the index keeps in memory (see quantization.py).
+    Returns (index, has_vector); has_vector marks the rows with an embedding
+    (the only rows in the index).
+    """
+    store = open_embeddings(embeddings_path)
+    vectors, has_vector = catalogue_vectors(store, _image_names)
+    # A saved index built from other embeddings is rebuilt (and saved again)
+    index, _ = load_or_build(
+        vectors, has_vector, index_signature(embeddings_path, _image_names), index_path, quantization
+    )
+    return index, has_vector
+
+
+def get_live_entries(
+    df: pd.DataFrame,
+    ann: IVFIndex,
+    has_vector: np.ndarray,
+    lookup: ResultLookup,
+    row_pos: int,
+    k: int,
+    same_des_conc: bool = False,
+    min_score: float = 0.0,
+    price_range: Optional[tuple] = None,
+) -> list:
+    """
+    Query the ANN index for the neighbours of the selected product.
+
+    Same exclusions as the offline engine (itself and same PROD_REF), plus
+    the optional DES_CONC / price filters chosen in the sidebar. A product
+    without an embedding has no neighbours.
+    """
+    if not has_vector[row_pos]:
+        return []
+    allowed = has_vector & (lookup.name_codes != lookup.name_codes[row_pos])
+    if lookup.prod_codes[row_pos] >= 0:
+        allowed &= lookup.prod_codes != lookup.prod_codes[row_pos]
+    if same_des_conc:
+        allowed &= lookup.group_codes == lookup.group_codes[row_pos]
+    if price_range is not None:
+        allowed &= (lookup.prices >= price_range[0]) & (lookup.prices <= price_range[1])
+
+    idx, scores = ann.search(ann.vectors[row_pos], k=k, allowed=allowed)
+    return [
+        (df.iloc[i], float(score))
+        for i, score in zip(idx, scores)
+        if score >= min_score
+    ]
+
+
+@st.cache_resource
+def load_image_manifest(signature: tuple) -> ImageManifest:
+    """Scan the image folders once; ``signature`` (folder mtimes) is the cache key."""
+    return build_manifest(IMAGE_DIRS)
 
 
 def find_image_path(image_name: str) -> Optional[Path]:
     """
-    Try to find an image file for the given image_name
-    under Files/file1, file2, file3 with common extensions.
+    Find the image file for the given image_name
+    under Files/file1, file2, file3 (see image_manifest.py).
     """
-    extensions = [".jpg", ".jpeg", ".png", ".webp", ".JPG", ".PNG"]
+    manifest = load_image_manifest(dirs_signature(IMAGE_DIRS))
+    return manifest.get(image_name)
 
-    for folder in IMAGE_DIRS:
-        for ext in extensions:
-            candidate = folder / f"{image_name}{ext}"
-            if candidate.exists():
-                return candidate
 
-    return None
+@st.cache_resource
+def get_image_base_url() -> str:
+    """
+    Base URL of the card images. Starts image_server.py once per process
+    when IMAGE_SERVER_PORT is set; otherwise, or if its port cannot be
+    bound, Streamlit's static route.
+    """
+    if IMAGE_SERVER_PORT:
+        try:
+            start_server(int(IMAGE_SERVER_PORT))
+            return IMAGE_BASE_URL or f"http://localhost:{IMAGE_SERVER_PORT}"
+        except OSError as e:
+            # As imagens continuam a aparecer (rota estática), só no log do servidor
+            logger.warning("Image server not started on port %s (%s); using %s", IMAGE_SERVER_PORT, e, STATIC_URL)
+            return STATIC_URL
+    return IMAGE_BASE_URL or STATIC_URL
+
+
+def product_image_html(img_path: Path, image_scale: float, alt: str, sizes: str) -> str:
+    """<img> with srcset variants, at most ``image_scale`` x the original width."""
+    src, srcset, width = image_srcset(img_path, get_image_base_url())
+    return (
+        f'<img src="{html.escape(src)}" srcset="{html.escape(srcset)}" sizes="{sizes}" '
+        f'alt="{html.escape(alt)}" loading="lazy" decoding="async" '
+        f'style="width:100%;max-width:{round(width * image_scale)}px;height:auto">'
+    )
 
 
 def show_product_card(
@@ -192,6 +430,7 @@ def show_product_card(
     similarity_score: Optional[float] = None,
     compact: bool = False,
     image_scale: float = 0.50,
+    ratings: Optional[tuple] = None,
 ):
     """
     Show a product card with INFO on the LEFT and IMAGE on the RIGHT.
@@ -203,6 +442,8 @@ def show_product_card(
         If False, show full information (for main product).
     image_scale : float
         Factor to resize the image (1.0 = original size).
+    ratings : tuple, optional
+        (bad, medium, good) counts of earlier feedback for this neighbour.
     """
     info_col, img_col = st.columns([1.2, 1])
 
@@ -212,10 +453,13 @@ def show_product_card(
 
         if img_path is not None:
             try:
-                image = Image.open(img_path)
-                w, h = image.size
-                image = image.resize((int(w * image_scale), int(h * image_scale)))
-                st.image(image)
+                # Referenced by URL: the browser fetches (and caches) the
+                # static variant it needs, nothing goes over the websocket
+                sizes = "(max-width: 640px) 45vw, 12vw" if compact else "(max-width: 640px) 90vw, 25vw"
+                st.markdown(
+                    product_image_html(img_path, image_scale, str(row["image_name"]), sizes),
+                    unsafe_allow_html=True,
+                )
             except Exception:
                 st.write("Image could not be opened.")
         else:
@@ -257,6 +501,10 @@ def show_product_card(
             else:
                 st.write(f"**Similarity:** {similarity_score:.3f}")
 
+        if ratings is not None:
+            bad, medium, good = ratings
+            st.caption(f"Rated: Bad {bad} · Medium {medium} · Good {good}")
+
 
 # -------------------------------------------------
 # HEADER (logo + subtitle + section title)
@@ -300,80 +548,60 @@ st.markdown(
 # -------------------------------------------------
 # Load data
 # -------------------------------------------------
-if not RESULT_CSV.exists():
+if not RESULT_PARQUET.exists() and not RESULT_CSV.exists():
     st.error(f"result_df.csv not found at: {RESULT_CSV}")
     st.stop()
 
-df = load_data(RESULT_CSV)
-
-# -------------------------------------------------
-# Layout: selector (left) + original product preview (right)
-# -------------------------------------------------
-left_col, right_col = st.columns([2, 2])
-
-with left_col:
-    st.subheader("1. Choose a product")
-
-    labels = df["display_label"].sort_values().tolist()
+data_key = data_version(RESULT_PARQUET, RESULT_CSV)
+df = load_data(RESULT_PARQUET, RESULT_CSV, data_key)
+lookup = load_lookup(data_key, df)
+search_index = load_search_index(data_key, df)
 
-    selected_label = st.selectbox(
-        "Search or select by image ID, PROD_REF or description:",
-        options=labels,
-        index=0 if labels else None
-    )
-
-with right_col:
-    st.subheader("2. Original product")
-
-    if selected_label:
-        selected_row = df.loc[df["display_label"] == selected_label].iloc[0]
-        # Original product: full info, normal size
-        show_product_card(selected_row, compact=False, image_scale=0.70)
-
-st.markdown("---")
-st.subheader("3. Top 4 similar products")
+graph = None
+if NEIGHBOURS_NPZ.exists():
+    graph = load_neighbours(NEIGHBOURS_NPZ, data_key + data_version(NEIGHBOURS_NPZ), df["image_name"])
+    if graph is None:
+        st.warning("neighbours.npz does not match result_df.csv – using the similar_image columns.")
 
 # -------------------------------------------------
-# Show neighbours + preparar dados para feedback
+# Vizinhos + formulário de feedback (fragmento)
 # -------------------------------------------------
-if selected_label:
-    selected_row = df.loc[df["display_label"] == selected_label].iloc[0]
-
-    # Vamos usar o image_name do produto selecionado como "artigo_escolhido"
-    artigo_escolhido = selected_row["image_name"]
-
-    similar_entries = []
-
-    for k in range(1, 5):
-        img_col = f"similar_image_{k}"
-        score_col = f"similarity_score_{k}"
-
-        if img_col not in df.columns or score_col not in df.columns:
-            continue
-
-        similar_name = selected_row.get(img_col)
-        sim_score = selected_row.get(score_col)
-
-        if pd.isna(similar_name):
-            continue
+def guardar_formulario(artigo_escolhido, artigos_recomendados, chaves_avaliacao, chave_comentario):
+    """Callback do "Save your input": lê o formulário do session_state e guarda."""
+    try:
+        guardar_feedback(
+            artigo_escolhido=artigo_escolhido,
+            artigos_recomendados=artigos_recomendados,
+            avaliacoes=[st.session_state[chave] for chave in chaves_avaliacao],
+            comentario=st.session_state.get(chave_comentario, ""),
+        )
+        st.session_state["feedback_resultado"] = "ok"
+    except Exception as e:
+        st.session_state["feedback_resultado"] = str(e)
 
-        neighbour_rows = df.loc[df["image_name"] == similar_name]
-        if neighbour_rows.empty:
-            continue
 
-        neighbour_row = neighbour_rows.iloc[0]
-        similar_entries.append((neighbour_row, sim_score))
+@st.fragment
+def mostrar_vizinhos_e_feedback(artigo_escolhido, similar_entries):
+    """
+    Cartões dos vizinhos com as avaliações e o comentário num formulário:
+    mudar uma avaliação ou escrever o comentário não corre nada no
+    servidor. "Save your input" só volta a correr este fragmento, não a
+    página inteira (dados, seletor, produto original).
+    """
+    # Avaliações anteriores de cada vizinho (uma leitura indexada por par)
+    past_ratings = ler_avaliacoes(
+        artigo_escolhido, [row["image_name"] for row, _ in similar_entries]
+    )
 
-    if not similar_entries:
-        st.info("No similar products found for this item.")
-    else:
-        cols = st.columns(4)
+    with st.form(key=f"feedback_{artigo_escolhido}", border=False):
+        cols = st.columns(N_RATED)
 
         # Listas onde vamos guardar os IDs dos artigos recomendados e as avaliações
         artigos_recomendados = []
         avaliacoes = []
+        chaves_avaliacao = []
 
-        for idx, (col, (row, score)) in enumerate(zip(cols, similar_entries)):
+        for idx, (col, (row, score)) in enumerate(zip(cols, similar_entries[:N_RATED])):
             with col:
                 # Neighbours: very compact info, slightly larger image
                 show_product_card(
@@ -381,6 +609,7 @@ if selected_label:
                     similarity_score=score,
                     compact=True,
                     image_scale=0.65,  # bigger images for neighbours
+                    ratings=past_ratings.get(str(row["image_name"])),
                 )
 
                 # Usamos o image_name como identificador do artigo recomendado
@@ -388,56 +617,293 @@ if selected_label:
                 artigos_recomendados.append(artigo_id)
 
                 # Radio para avaliação deste artigo
+                chave = f"avaliacao_{artigo_escolhido}_{artigo_id}_{idx}"
                 avaliacao = st.radio(
                     "Rating",
                     ["Bad", "Medium", "Good"],
-                    key=f"avaliacao_{artigo_escolhido}_{artigo_id}_{idx}"
+                    key=chave
                 )
                 avaliacoes.append(avaliacao)
+                chaves_avaliacao.append(chave)
+
+        # Extra neighbours (no rating), in rows of 4
+        extra_entries = similar_entries[N_RATED:]
+        for start in range(0, len(extra_entries), N_RATED):
+            cols = st.columns(N_RATED)
+            for col, (row, score) in zip(cols, extra_entries[start:start + N_RATED]):
+                with col:
+                    show_product_card(
+                        row, similarity_score=score, compact=True, image_scale=0.65,
+                        ratings=past_ratings.get(str(row["image_name"])),
+                    )
 
         # Caixa de comentários do utilizador (opcional)
-        comentario = st.text_area(
+        chave_comentario = f"comentario_{artigo_escolhido}"
+        st.text_area(
             "User comments (optional)",
             value="",
-            placeholder="Write here your comments or observations..."
+            placeholder="Write here your comments or observations...",
+            key=chave_comentario,
         )
 
-        # Load feedback for CSV download
-        feedback_df = carregar_feedback_df()
-
-        # ---- Buttons row: Save input (left) + Download CSV (right) ----
-        col_save, col_dl = st.columns([1, 1])
+        # ---- Buttons row: Save input (left) + Download CSV (right, below) ----
+        col_save, _ = st.columns([1, 1])
 
         # LEFT: 5. Save your input
         with col_save:
-            if len(artigos_recomendados) == 4 and len(avaliacoes) == 4:
-                if st.button("5. Save your input"):
-                    try:
-                        guardar_feedback(
-                            artigo_escolhido=artigo_escolhido,
-                            artigos_recomendados=artigos_recomendados,
-                            avaliacoes=avaliacoes,
-                            comentario=comentario
-                        )
-                        st.success("Successfully saved. Thanks!")
-                    except Exception as e:
-                        st.error(f"Error while saving: {e}")
-            else:
+            pode_guardar = len(artigos_recomendados) == N_RATED and len(avaliacoes) == N_RATED
+            # Guardado no callback, antes de o fragmento voltar a correr: as
+            # contagens "Rated" dos cartões já incluem esta avaliação
+            st.form_submit_button(
+                "5. Save your input",
+                disabled=not pode_guardar,
+                on_click=guardar_formulario,
+                args=(artigo_escolhido, artigos_recomendados, chaves_avaliacao, chave_comentario),
+            )
+            if not pode_guardar:
                 st.warning("It was not possible to prepare the recommended 4 articles.")
-
-        # RIGHT: 4. Download CSV feedback
-        with col_dl:
-            if feedback_df.empty:
-                st.write("No feedback to download yet.")
             else:
-                csv_bytes = feedback_df.to_csv(index=False, sep=";").encode("utf-8-sig")
-                st.download_button(
-                    label="4. Download CSV feedback",
-                    data=csv_bytes,
-                    file_name="feedback_parfois.csv",
-                    mime="text/csv",
-                    key="download_feedback_csv",
-                )
+                resultado = st.session_state.pop("feedback_resultado", None)
+                if resultado == "ok":
+                    st.success("Successfully saved. Thanks!")
+                elif resultado is not None:
+                    st.error(f"Error while saving: {resultado}")
+
+    # RIGHT: 4. Download CSV feedback (not allowed inside a form)
+    # (the feedback table is only exported when the button is clicked)
+    _, col_dl = st.columns([1, 1])
+    with col_dl:
+        if not ha_feedback():
+            st.write("No feedback to download yet.")
+        else:
+            st.download_button(
+                label="4. Download CSV feedback",
+                data=exportar_feedback_csv,
+                file_name="feedback_parfois.csv",
+                mime="text/csv",
+                key="download_feedback_csv",
+                on_click="ignore",
+            )
+
+
+# -------------------------------------------------
+# Pesquisa por foto (fragmento)
+# -------------------------------------------------
+@st.cache_resource
+def get_image_encoder(name: str) -> Future:
+    """
+    Encoder carregado e aquecido uma vez por processo (ver image_query.py),
+    num thread de fundo: a página não espera pelo modelo, e a primeira
+    pesquisa por foto só espera pelo que faltar do carregamento.
+    """
+    def carregar():
+        options = {"dim": open_embeddings(EMBEDDINGS_NPY).dim} if name == "stand-in" else {}
+        return load_encoder(name, **options)
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-encoder")
+    encoder = executor.submit(carregar)
+    executor.shutdown(wait=False)
+    return encoder
+
+
+def aquecer_encoder(name: str) -> Future:
+    """
+    O carregamento do encoder (a começar, a correr ou pronto). Um
+    carregamento que falhou não fica em cache: volta a ser tentado.
+    """
+    encoder = get_image_encoder(name)
+    if encoder.done() and encoder.exception() is not None:
+        get_image_encoder.clear(name)
+        encoder = get_image_encoder(name)
+    return encoder
+
+
+@st.fragment
+def pesquisa_por_foto(k: int):
+    """
+    Upload de uma foto -> embedding -> top-k do catálogo. Só este fragmento
+    volta a correr quando a foto muda.
+    """
+    foto = st.file_uploader(
+        "Upload a product photo", type=["jpg", "jpeg", "png", "webp"], key="query_photo"
+    )
+    if foto is None:
+        return
+
+    index, has_vector = load_ann_index(
+        EMBEDDINGS_NPY, ANN_INDEX_NPZ,
+        data_key + data_version(EMBEDDINGS_NPY, ANN_INDEX_NPZ),
+        df["image_name"],
+        ANN_QUANTIZATION,
+    )
+    try:
+        encoder = aquecer_encoder(IMAGE_ENCODER).result()
+        rows, scores, timings = search_by_image(
+            encoder, foto.getvalue(), index.vectors, k=k, allowed=has_vector, index=index
+        )
+    except Exception as e:
+        st.error(f"Photo search is not available: {e}")
+        return
+
+    st.caption(
+        f"Encoder: {IMAGE_ENCODER} · "
+        + " · ".join(f"{stage} {ms:.1f} ms" for stage, ms in timings.items())
+    )
+    col_photo, col_results = st.columns([1, 4])
+    with col_photo:
+        st.image(foto.getvalue(), caption="Your photo")
+    with col_results:
+        entries = list(zip(rows, scores))
+        for start in range(0, len(entries), N_RATED):
+            cols = st.columns(N_RATED)
+            for col, (row, score) in zip(cols, entries[start:start + N_RATED]):
+                with col:
+                    show_product_card(
+                        df.iloc[row], similarity_score=float(score), compact=True, image_scale=0.65
+                    )
+
+
+# -------------------------------------------------
+# Sidebar: live similarity search (needs data/embeddings.npy)
+# -------------------------------------------------
+ann, has_vector = None, None
+with st.sidebar:
+    st.markdown("### Live similarity search")
+    if EMBEDDINGS_NPY.exists():
+        live_search = st.checkbox(
+            "Compute neighbours live",
+            value=False,
+            help="Search the embeddings instead of using the precomputed neighbours.",
+        )
+    else:
+        live_search = False
+        st.caption("Not available: data/embeddings.npy not found.")
+
+    if live_search:
+        ann, has_vector = load_ann_index(
+            EMBEDDINGS_NPY, ANN_INDEX_NPZ,
+            data_key + data_version(EMBEDDINGS_NPY, ANN_INDEX_NPZ),
+            df["image_name"],
+            ANN_QUANTIZATION,
+        )
+        same_des_conc = st.checkbox("Only same DES_CONC", value=True)
+        min_score = st.slider("Minimum similarity", 0.0, 1.0, 0.0, 0.05)
+
+        price_range = None
+        prices = lookup.prices[~np.isnan(lookup.prices)]
+        if len(prices) and prices.min() < prices.max():
+            lo, hi = float(prices.min()), float(prices.max())
+            chosen = st.slider("Price (€)", lo, hi, (lo, hi))
+            if chosen != (lo, hi):
+                price_range = chosen
+
+    # Write-behind feedback queue (see feedback_store.py)
+    st.markdown("### Feedback queue")
+    queue_stats = get_feedback_queue().stats()
+    latency = queue_stats["last_flush_latency"]
+    st.caption(
+        f"Backend: {FEEDBACK_BACKEND} · waiting: {queue_stats['queue_depth']} · "
+        f"last flush latency: {f'{latency:.1f} s' if latency is not None else '–'}"
+    )
+    if queue_stats["last_error"]:
+        st.caption(f"Retrying ({queue_stats['failures']} failures): {queue_stats['last_error']}")
+
+# -------------------------------------------------
+# Layout: selector (left) + original product preview (right)
+# -------------------------------------------------
+left_col, right_col = st.columns([2, 2])
+
+with left_col:
+    st.subheader("1. Choose a product")
+
+    # Server-side search: only the best matches are sent to the browser
+    query = st.text_input(
+        "Search by image ID, PROD_REF or description:",
+        key="product_query",
+        placeholder="e.g. 140486, 140486 BM, Bags_B",
+    )
+    start = time.perf_counter()
+    match_rows, n_matches = search_index.search(query)
+    search_ms = 1000 * (time.perf_counter() - start)
+    labels = list(dict.fromkeys(search_index.labels[match_rows]))
+
+    selected_label = st.selectbox(
+        "Select a product:",
+        options=labels,
+        index=0 if labels else None
+    )
+    st.caption(
+        f"{n_matches} match{'' if n_matches == 1 else 'es'}"
+        + (f" (showing the first {len(labels)})" if n_matches > len(labels) else "")
+        + f" · {search_ms:.1f} ms"
+    )
+
+with right_col:
+    st.subheader("2. Original product")
+
+    if selected_label:
+        selected_pos = lookup.row_of_label[selected_label]
+        selected_row = df.iloc[selected_pos]
+        # Original product: full info, normal size
+        show_product_card(selected_row, compact=False, image_scale=0.70)
+
+st.markdown("---")
+
+col_sub, col_top = st.columns([3, 2])
+with col_sub:
+    # Filled in below the radio, with the chosen count
+    subheader_slot = st.empty()
+with col_top:
+    # Live search and the neighbour graph can show more than the 4 rated neighbours
+    top_options = [N_RATED]
+    if ann is not None:
+        top_options += [8, 12, 20, 50]
+    elif graph is not None:
+        top_options += [k for k in (8, 12, 20, 50) if k <= graph.k]
+    n_similar = st.radio(
+        "Similar products to show",
+        top_options,
+        horizontal=True,
+        disabled=len(top_options) == 1,
+    )
+subheader_slot.subheader(f"3. Top {n_similar} similar products")
+
+# -------------------------------------------------
+# Show neighbours + preparar dados para feedback
+# -------------------------------------------------
+if selected_label:
+    # Vamos usar o image_name do produto selecionado como "artigo_escolhido"
+    artigo_escolhido = selected_row["image_name"]
+
+    if ann is not None:
+        start = time.perf_counter()
+        similar_entries = get_live_entries(
+            df, ann, has_vector, lookup, selected_pos, k=n_similar,
+            same_des_conc=same_des_conc, min_score=min_score, price_range=price_range,
+        )
+        st.caption(f"Live search: {1000 * (time.perf_counter() - start):.1f} ms")
+    else:
+        similar_entries = get_similar_entries(df, graph, lookup, selected_pos, k=n_similar)
+
+    if not similar_entries:
+        st.info("No similar products found for this item.")
+    else:
+        mostrar_vizinhos_e_feedback(artigo_escolhido, similar_entries)
 
 else:
     st.info("Select a product above to see its similar neighbours.")
+
+# -------------------------------------------------
+# 6. Search by photo (needs data/embeddings.npy and an image encoder)
+# -------------------------------------------------
+if EMBEDDINGS_NPY.exists():
+    st.markdown("---")
+    # Só corre com o expander aberto; o encoder começa a carregar ao abrir
+    pesquisa = st.expander("6. Search by photo", key="photo_search", on_change="rerun")
+    if pesquisa.open:
+        aquecer_encoder(IMAGE_ENCODER)
+        with pesquisa:
+            pesquisa_por_foto(n_similar)
+
+# Fim da primeira execução desta sessão (ver ler_avaliacoes)
+st.session_state["primeiro_render_concluido"] = True
@@ -0,0 +1,409 @@
+"""
+Approximate nearest-neighbour search over the CLIP embeddings (pure NumPy).
+
+The index is an IVF ("inverted file"): the L2-normalised vectors are
+clustered with spherical k-means and every vector is stored in the list of
+its closest centroid. A query only scores the vectors of the ``n_probe``
+lists whose centroids are most similar to it. Filters (same ``DES_CONC``,
+price range, ...) are boolean masks over the rows; when a filter leaves too
+few candidates in the probed lists, more lists are probed.
+
+The index rows are the rows of ``result_df.csv`` (see
+``catalogue_vectors``), so row numbers and filters line up with the app.
+Rows without an embedding are left out of the lists (and of the k-means
+training), so they are never returned. The saved index records what it
+was built from (``index_signature``: mtime and size of the embedding
+store, as in the app's ``data_version`` keys, and the row names); ``load``
+refuses an index whose inputs have changed since, even when the row count
+is the same.
+
+Usage
+-----
+    python ann_index.py --embeddings data/embeddings.npy --result-csv data/result_df.csv
+"""
+import argparse
+import hashlib
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from embedding_store import EMBEDDINGS_NPY, EmbeddingStore, names_path, open_embeddings
+from quantization import QUANTIZATION_MODES, QuantizedMatrix, quantize
+from result_table import data_version
+
+BASE_DIR = Path(__file__).resolve().parent
+ANN_INDEX_NPZ = BASE_DIR / "data" / "ann_index.npz"
+RESULT_CSV = BASE_DIR / "data" / "result_df.csv"
+
+N_PROBE = 8
+
+
+def catalogue_vectors(store: EmbeddingStore, image_names) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    float32 vectors aligned with ``image_names`` (the result_df rows).
+
+    Returns the (n, d) matrix and a boolean mask of the rows that have an
+    embedding; rows without one get a zero vector and must be filtered out.
+    """
+    rows = np.array([store.row_of.get(name, -1) for name in image_names], dtype=np.int64)
+    has_vector = rows >= 0
+
+    vectors = np.zeros((len(rows), store.dim), dtype=np.float32)
+    vectors[has_vector] = store.vectors[rows[has_vector]]
+    return vectors, has_vector
+
+
+def index_signature(embeddings_path: Path, image_names) -> str:
+    """
+    What an index over ``catalogue_vectors(open_embeddings(embeddings_path),
+    image_names)`` was built from: name, mtime and size of the embedding
+    store files (``data_version``) and the SHA-1 of the row names. Cheap
+    to compute, unlike a hash of the vectors.
+    """
+    files = [
+        (Path(path).name, mtime_ns, size)
+        for path, mtime_ns, size in data_version(embeddings_path, names_path(embeddings_path))
+    ]
+    names = hashlib.sha1("\n".join(map(str, image_names)).encode("utf-8")).hexdigest()
+    return f"{files} {names}"
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the ``k`` largest scores, best first."""
+    if k < len(scores):
+        top = np.argpartition(-scores, kth=k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def exact_search(
+    vectors: np.ndarray,
+    query: np.ndarray,
+    k: int = 4,
+    allowed: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute-force top-k rows by cosine similarity (vectors must be normalised)."""
+    scores = vectors @ query
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+    top = _top_k(scores, k)
+    top = top[np.isfinite(scores[top])]
+    return top, scores[top]
+
+
+def _spherical_kmeans(
+    vectors: np.ndarray,
+    n_lists: int,
+    n_iter: int,
+    rng: np.random.Generator,
+    block_size: int = 4096,
+) -> np.ndarray:
+    """Unit-norm centroids maximising the cosine similarity to their members."""
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = _assign(vectors, centroids, block_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_lists)
+
+        # Re-seed empty lists with random vectors
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.clip(norms, 1e-9, None)
+    return centroids
+
+
+def _assign(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_size: int = 4096,
+    rows: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Closest centroid of every vector (or of ``rows``), computed in row blocks."""
+    n = len(vectors) if rows is None else len(rows)
+    assign = np.empty(n, dtype=np.int64)
+    for start in range(0, n, block_size):
+        block = (
+            vectors[start:start + block_size] if rows is None
+            else vectors[rows[start:start + block_size]]
+        )
+        block = np.asarray(block, dtype=np.float32)
+        assign[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalised float32 vectors.
+
+    ``list_rows[list_offsets[c]:list_offsets[c + 1]]`` are the rows stored
+    in list ``c``; ``list_vectors`` holds their vectors in the same order so
+    a probed list is scored with one contiguous matrix product. With a
+    ``QuantizedMatrix`` (see ``quantization.py``) the lists keep the codes
+    and are scored without decoding them. Rows in no list (no embedding)
+    are never returned; ``indexed`` marks the others.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        centroids: np.ndarray,
+        list_rows: np.ndarray,
+        list_offsets: np.ndarray,
+    ):
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        if isinstance(vectors, QuantizedMatrix):
+            self.vectors = vectors
+            self.list_vectors = vectors.take(list_rows)
+        else:
+            self.vectors = np.asarray(vectors, dtype=np.float32)
+            self.list_vectors = self.vectors[list_rows]
+        self.indexed = np.zeros(len(self.vectors), dtype=bool)
+        self.indexed[list_rows] = True
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_iter: int = 10,
+        train_size: int = 50_000,
+        seed: int = 0,
+        has_vector: Optional[np.ndarray] = None,
+    ) -> "IVFIndex":
+        """
+        Cluster ``vectors`` and build the lists.
+
+        Only the rows of ``has_vector`` (default: all) are indexed; the
+        others (zero vectors, see ``catalogue_vectors``) are neither used
+        for training nor put in a list. ``n_lists`` defaults to sqrt(n);
+        k-means is trained on at most ``train_size`` random vectors
+        (decoded, for a ``QuantizedMatrix``).
+        """
+        rows = np.arange(len(vectors)) if has_vector is None else np.flatnonzero(has_vector)
+        n = len(rows)
+        if n == 0:
+            centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            return cls(vectors, centroids, rows, np.zeros(1, dtype=np.int64))
+        if n_lists is None:
+            n_lists = max(1, int(round(np.sqrt(n))))
+        n_lists = min(n_lists, n)
+
+        rng = np.random.default_rng(seed)
+        sample = rows
+        if n > train_size:
+            sample = np.sort(rng.choice(rows, train_size, replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+        centroids = _spherical_kmeans(train, n_lists, n_iter, rng)
+
+        assign = _assign(vectors, centroids, rows=rows)
+        order = np.argsort(assign, kind="stable")
+        list_rows = rows[order]
+        list_offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        return cls(vectors, centroids, list_rows, list_offsets)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 4,
+        n_probe: int = N_PROBE,
+        allowed: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k rows for one normalised query vector.
+
+        ``allowed`` is an optional boolean mask over the rows (filters and
+        exclusions). Lists are probed best-centroid first, ``n_probe`` at a
+        time, until ``k`` allowed candidates were seen or no list is left.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        list_order = np.argsort(-(self.centroids @ query))
+
+        rows_parts, score_parts = [], []
+        n_found = 0
+        for start in range(0, self.n_lists, n_probe):
+            for c in list_order[start:start + n_probe]:
+                lo, hi = self.list_offsets[c], self.list_offsets[c + 1]
+                rows = self.list_rows[lo:hi]
+                scores = self.list_vectors[lo:hi] @ query
+                if allowed is not None:
+                    keep = allowed[rows]
+                    rows, scores = rows[keep], scores[keep]
+                rows_parts.append(rows)
+                score_parts.append(scores)
+                n_found += len(rows)
+            if n_found >= k:
+                break
+
+        if not rows_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(rows_parts)
+        scores = np.concatenate(score_parts)
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+    def save(self, npz_path: Path = ANN_INDEX_NPZ, signature: str = "") -> Path:
+        """
+        Save the centroids and lists (the vectors stay in the embedding
+        store) with the ``index_signature`` of the inputs.
+        """
+        npz_path = Path(npz_path)
+        npz_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            npz_path,
+            centroids=self.centroids,
+            list_rows=self.list_rows,
+            list_offsets=self.list_offsets,
+            n_rows=np.array(len(self)),
+            signature=np.array(signature),
+        )
+        return npz_path
+
+    @classmethod
+    def load(cls, npz_path: Path, vectors: np.ndarray, signature: Optional[str] = None) -> "IVFIndex":
+        """
+        Load a saved index over ``vectors``. Raises ValueError when it was
+        built from other vectors: another row count, or a ``signature``
+        (see ``index_signature``) different from the saved one.
+        """
+        with np.load(npz_path) as data:
+            n_rows = int(data["n_rows"]) if "n_rows" in data.files else len(data["list_rows"])
+            if n_rows != len(vectors):
+                raise ValueError(f"{npz_path} indexes {n_rows} vectors, got {len(vectors)}")
+            saved = str(data["signature"]) if "signature" in data.files else ""
+            if signature is not None and saved != signature:
+                raise ValueError(f"{npz_path} was built from other embeddings")
+            return cls(vectors, data["centroids"], data["list_rows"], data["list_offsets"])
+
+
+def load_or_build(
+    vectors: np.ndarray,
+    has_vector: np.ndarray,
+    signature: str,
+    npz_path: Path = ANN_INDEX_NPZ,
+    quantization: str = "float32",
+    save: bool = True,
+) -> Tuple[IVFIndex, bool]:
+    """
+    Index over the rows of the float32 ``vectors`` that have an embedding
+    (stored as ``quantization``): the saved one when its ``signature``
+    (see ``index_signature``) matches, otherwise a new one, saved to
+    ``npz_path`` when ``save`` (and writable). Returns (index, rebuilt).
+    """
+    stored = quantize(vectors, quantization, train_rows=has_vector)
+    if Path(npz_path).exists():
+        try:
+            return IVFIndex.load(npz_path, stored, signature), False
+        except ValueError:
+            pass
+    index = IVFIndex.build(stored, has_vector=has_vector)
+    if save:
+        try:
+            index.save(npz_path, signature)
+        except OSError as e:
+            print(f"Warning: {npz_path} not written ({e})")
+    return index, True
+
+
+def measure_recall(
+    index: IVFIndex,
+    k: int = 4,
+    n_probe: int = N_PROBE,
+    n_queries: int = 500,
+    seed: int = 0,
+    exact_vectors: Optional[np.ndarray] = None,
+) -> dict:
+    """
+    Recall@k of the index against exact search, using random indexed
+    vectors as queries (each query excludes itself). ``exact_vectors``
+    (default: the index's own vectors) are the float32 vectors of the
+    reference search and of the queries, for a quantized index.
+
+    Returns recall and mean per-query latency of both searches in ms.
+    """
+    if exact_vectors is None:
+        exact_vectors = index.vectors
+    rng = np.random.default_rng(seed)
+    rows = np.flatnonzero(index.indexed)
+    queries = rng.choice(rows, min(n_queries, len(rows)), replace=False)
+    allowed = index.indexed.copy()
+
+    hits = 0
+    ann_time = exact_time = 0.0
+    for row in queries:
+        allowed[row] = False
+        query = exact_vectors[row]
+
+        start = time.perf_counter()
+        approx, _ = index.search(query, k=k, n_probe=n_probe, allowed=allowed)
+        ann_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        exact, _ = exact_search(exact_vectors, query, k=k, allowed=allowed)
+        exact_time += time.perf_counter() - start
+
+        hits += len(np.intersect1d(approx, exact))
+        allowed[row] = True
+
+    return {
+        "recall": hits / (k * len(queries)),
+        "ann_ms": 1000 * ann_time / len(queries),
+        "exact_ms": 1000 * exact_time / len(queries),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the IVF index and report recall against exact search.")
+    parser.add_argument("--embeddings", type=Path, default=EMBEDDINGS_NPY, help="Embedding store (.npy).")
+    parser.add_argument("--result-csv", type=Path, default=RESULT_CSV,
+                        help="result_df.csv whose rows the index follows.")
+    parser.add_argument("--out", type=Path, default=ANN_INDEX_NPZ, help="Output index file.")
+    parser.add_argument("--n-lists", type=int, default=None, help="Number of lists (default: sqrt(n)).")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, N_PROBE, 16],
+                        help="n_probe values to evaluate.")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="float32",
+                        help="Representation of the indexed vectors (see quantization.py).")
+    args = parser.parse_args(argv)
+
+    store = open_embeddings(args.embeddings)
+    image_names = pd.read_csv(args.result_csv, usecols=["image_name"], dtype=str)["image_name"]
+    vectors, has_vector = catalogue_vectors(store, image_names)
+    if not has_vector.all():
+        print(f"Warning: {(~has_vector).sum()} rows of {args.result_csv} have no embedding")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(
+        quantize(vectors, args.quantize, train_rows=has_vector), n_lists=args.n_lists, has_vector=has_vector
+    )
+    print(f"Built {index.n_lists} lists over {has_vector.sum()} vectors in {time.perf_counter() - start:.1f}s")
+    index.save(args.out, index_signature(args.embeddings, image_names))
+
+    for n_probe in args.n_probe:
+        report = measure_recall(index, k=args.k, n_probe=n_probe, n_queries=args.queries,
+                                exact_vectors=vectors)
+        print(
+            f"n_probe={n_probe:>3}  recall@{args.k}={report['recall']:.3f}  "
+            f"ann={report['ann_ms']:.2f} ms  exact={report['exact_ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
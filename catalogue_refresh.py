@@ -0,0 +1,487 @@
+"""
+Incremental, resumable refresh of the embeddings and the neighbours.
+
+A full rebuild embeds every image and recomputes every group. This script
+only does the work a catalogue change needs:
+
+1. **Embeddings.** ``<store>.hashes.csv`` keeps the SHA-1 of the file every
+   stored embedding was computed from. Images that are new or whose hash
+   changed are embedded (``clip_embeddings.py``) in chunks of
+   ``--chunk-size``; every chunk is saved under ``data/.refresh/`` as soon
+   as it is done, so an interrupted run resumes from the last finished
+   chunk. The chunks are then merged into the store with the unchanged rows.
+
+2. **Neighbours.** Only the affected rows of the neighbour graph are
+   recomputed (with the rules of ``similarity_engine.py``):
+
+   - new and changed items (embedding, ``DES_CONC`` or ``PROD_REF``);
+   - items that had a changed or removed item among their neighbours;
+   - items for which a changed item scores at least as high as their
+     current last (K-th) neighbour, so it could enter their list;
+   - items that needed the global fallback and have a changed item in
+     their ``DES_CONC`` group.
+
+   The other rows keep their neighbours, renumbered to the new rows.
+
+   The re-embedded names are written to ``<store>.pending.txt`` before
+   the store is saved, and the file is only removed once the result table
+   and the graph are written: a run interrupted in between recomputes
+   their neighbours next time, although their hashes are already current.
+
+The result table and the graph are rewritten as ``similarity_engine.py``
+does. Use the same ``--threshold`` as the run that built the graph. An
+existing ANN index (``ann_index.py``) is rebuilt when the embedding store
+or the rows of the result table changed.
+
+Usage
+-----
+    python catalogue_refresh.py                    # embed new images, update neighbours
+    python catalogue_refresh.py --full             # recompute every neighbour
+"""
+import argparse
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ann_index import ANN_INDEX_NPZ, catalogue_vectors, index_signature, load_or_build
+from embedding_store import EMBEDDINGS_NPY, STORE_DTYPES, names_path, open_embeddings, save_embeddings
+from image_manifest import IMAGE_DIRS, build_manifest
+from neighbour_graph import MAX_GRAPH_K, NEIGHBOURS_NPZ, load_graph
+from result_table import RESULT_CSV, RESULT_PARQUET, format_prod_ref, read_result_table
+from similarity_engine import (
+    BLOCK_SIZE,
+    BYTES_PER_PAIR,
+    FALLBACK_BLOCK_SIZE,
+    GRAPH_K,
+    MEMORY_BUDGET_MB,
+    PRODUCTS_CSV,
+    SALES_CSV,
+    SIMILARITY_THRESHOLD,
+    TOP_K,
+    assemble_result_df,
+    build_catalogue,
+    compute_neighbours,
+    normalize_rows,
+    read_unit_prices,
+    write_outputs,
+)
+from thumbnails import file_hash
+
+BASE_DIR = Path(__file__).resolve().parent
+CHECKPOINT_DIR = BASE_DIR / "data" / ".refresh"
+CHUNK_SIZE = 512
+
+# Scores in the graph are float16: compare with some slack
+SCORE_SLACK = 1e-3
+
+
+# -------------------------------------------------
+# Content hashes
+# -------------------------------------------------
+def hashes_path(npy_path: Path) -> Path:
+    """Path of the content-hash manifest that goes with ``npy_path``."""
+    npy_path = Path(npy_path)
+    return npy_path.with_name(npy_path.stem + ".hashes.csv")
+
+
+def pending_path(npy_path: Path) -> Path:
+    """Names whose neighbours still have to be recomputed after an embeddings update."""
+    npy_path = Path(npy_path)
+    return npy_path.with_name(npy_path.stem + ".pending.txt")
+
+
+def read_pending(npy_path: Path) -> Set[str]:
+    path = pending_path(npy_path)
+    if not path.exists():
+        return set()
+    return set(path.read_text(encoding="utf-8").splitlines())
+
+
+def write_pending(npy_path: Path, names: Set[str]):
+    """Replace the pending names (atomically); no names removes the file."""
+    path = pending_path(npy_path)
+    if not names:
+        path.unlink(missing_ok=True)
+        return
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text("\n".join(sorted(names)) + "\n", encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def read_hashes(npy_path: Path) -> pd.DataFrame:
+    """image_name, sha1, size, mtime_ns of the stored embeddings (empty if none)."""
+    path = hashes_path(npy_path)
+    if not path.exists() or not Path(npy_path).exists():
+        return pd.DataFrame(columns=["image_name", "sha1", "size", "mtime_ns"])
+    return pd.read_csv(path, dtype={"image_name": str, "sha1": str})
+
+
+def scan_images(dirs: Sequence[Path], previous: pd.DataFrame) -> pd.DataFrame:
+    """
+    image_name, path, sha1, size, mtime_ns of every image in ``dirs``.
+
+    Files whose size and mtime did not change keep their previous hash
+    instead of being read again.
+    """
+    known = {
+        row.image_name: (row.sha1, row.size, row.mtime_ns)
+        for row in previous.itertuples(index=False)
+    }
+    records = []
+    for name, path in build_manifest(dirs).paths.items():
+        stat = path.stat()
+        sha1, size, mtime_ns = known.get(name, (None, None, None))
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            sha1 = file_hash(path)
+        records.append((name, path, sha1, stat.st_size, stat.st_mtime_ns))
+    images = pd.DataFrame(records, columns=["image_name", "path", "sha1", "size", "mtime_ns"])
+    return images.sort_values("image_name", ignore_index=True)
+
+
+# -------------------------------------------------
+# Embeddings
+# -------------------------------------------------
+def embed_with_checkpoints(
+    todo: pd.DataFrame,
+    checkpoint_dir: Path = CHECKPOINT_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    **embed_options,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embed the ``todo`` images chunk by chunk, keeping every finished chunk
+    on disk. A previous run with the same plan (names and hashes) is
+    resumed; any other plan starts from scratch.
+
+    Returns the names and float32 vectors of the embedded images.
+    """
+    from clip_embeddings import CLIP_MODEL, embed_images, load_clip
+
+    checkpoint_dir = Path(checkpoint_dir)
+    plan_path = checkpoint_dir / "plan.csv"
+    plan = todo[["image_name", "sha1"]].reset_index(drop=True)
+    if plan_path.exists():
+        previous_plan = pd.read_csv(plan_path, dtype=str)
+        if not previous_plan.equals(plan.astype(str)):
+            shutil.rmtree(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    plan.to_csv(plan_path, index=False)
+
+    model = None
+    chunk_paths = []
+    for i, start in enumerate(range(0, len(todo), chunk_size)):
+        chunk = todo.iloc[start:start + chunk_size]
+        chunk_path = checkpoint_dir / f"chunk_{i:05d}.npy"
+        chunk_paths.append(chunk_path)
+        if chunk_path.exists() and names_path(chunk_path).exists():
+            print(f"Chunk {i}: already done, skipped")
+            continue
+        if model is None:
+            model = load_clip(embed_options.get("model_name", CLIP_MODEL))
+        n, failed = embed_images(
+            chunk["path"].tolist(), chunk_path, chunk["image_name"].tolist(),
+            model=model, **embed_options,
+        )
+        print(f"Chunk {i}: {n} images embedded ({len(failed)} failed)")
+
+    names, vectors = [], []
+    for chunk_path in chunk_paths:
+        store = open_embeddings(chunk_path, mmap=False)
+        names.append(store.names)
+        vectors.append(np.asarray(store.vectors, dtype=np.float32))
+    if not names:
+        return np.array([], dtype=object), np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(names), np.concatenate(vectors)
+
+
+def refresh_embeddings(
+    npy_path: Path = EMBEDDINGS_NPY,
+    image_dirs: Sequence[Path] = IMAGE_DIRS,
+    checkpoint_dir: Path = CHECKPOINT_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    dtype: Optional[str] = None,
+    **embed_options,
+) -> Tuple[Set[str], Set[str]]:
+    """
+    Bring the embedding store in line with the image folders.
+
+    Returns the names that were (re-)embedded and the names that were
+    dropped because their image is gone.
+    """
+    npy_path = Path(npy_path)
+    previous = read_hashes(npy_path)
+    images = scan_images(image_dirs, previous)
+
+    old_sha1 = dict(zip(previous["image_name"], previous["sha1"]))
+    todo = images[[old_sha1.get(name) != sha1 for name, sha1 in zip(images["image_name"], images["sha1"])]]
+    removed = set(old_sha1) - set(images["image_name"])
+    print(f"{len(images)} images: {len(todo)} new or changed, {len(removed)} removed")
+    if todo.empty and not removed:
+        return set(), set()
+
+    new_names, new_vectors = embed_with_checkpoints(todo, checkpoint_dir, chunk_size, **embed_options)
+
+    # Unchanged rows of the current store + the new chunks
+    names, vectors = new_names, new_vectors
+    if npy_path.exists():
+        store = open_embeddings(npy_path)
+        dtype = dtype or str(store.vectors.dtype)
+        drop = set(todo["image_name"]) | removed
+        keep = np.array([name not in drop for name in store.names], dtype=bool)
+        if keep.any():
+            names = np.concatenate([store.names[keep], new_names])
+            old_vectors = np.asarray(store.vectors[np.flatnonzero(keep)], dtype=np.float32)
+            vectors = np.concatenate([old_vectors, new_vectors]) if len(new_names) else old_vectors
+
+    # Before the store: until the neighbours are written, these stay to do
+    write_pending(npy_path, read_pending(npy_path) | set(new_names))
+
+    order = np.argsort(names, kind="stable")
+    save_embeddings(npy_path, names[order], vectors[order], dtype=dtype or "float32")
+
+    # Hashes last: a crash before this line only means re-embedding next time
+    stored = images[images["image_name"].isin(set(names))]
+    stored[["image_name", "sha1", "size", "mtime_ns"]].to_csv(hashes_path(npy_path), index=False)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    embedded = set(new_names)
+    return embedded, removed | (set(todo["image_name"]) - embedded)
+
+
+# -------------------------------------------------
+# Neighbours
+# -------------------------------------------------
+def _affected_rows(
+    embeddings: np.ndarray,
+    group_codes: np.ndarray,
+    is_changed: np.ndarray,
+    neighbour_idx: np.ndarray,
+    neighbour_scores: np.ndarray,
+    lost: np.ndarray,
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+) -> np.ndarray:
+    """
+    Rows whose neighbours may differ after the ``is_changed`` items changed.
+
+    ``neighbour_idx`` / ``neighbour_scores`` are the previous neighbours,
+    renumbered to the current rows; ``lost`` marks rows that had a
+    neighbour which no longer exists.
+    """
+    n, k = neighbour_idx.shape
+    valid = neighbour_idx >= 0
+    safe_idx = np.where(valid, neighbour_idx, 0)
+
+    affected = is_changed | lost
+    affected |= (is_changed[safe_idx] & valid).any(axis=1)
+
+    # A changed item enters a list if it beats the current K-th neighbour
+    full = valid.sum(axis=1) == k
+    floor = np.where(full, np.nan_to_num(neighbour_scores[:, -1], nan=-np.inf) - SCORE_SLACK, -np.inf)
+    changed_rows = np.flatnonzero(is_changed)
+    block_size = max(1, int(memory_budget_mb * 1e6) // (n * BYTES_PER_PAIR))
+    for start in range(0, len(changed_rows), block_size):
+        sims = embeddings[changed_rows[start:start + block_size]] @ embeddings.T
+        affected |= (sims >= floor[None, :]).any(axis=0)
+
+    # Rows filled by the global fallback get in-group candidates first
+    used_fallback = ((group_codes[safe_idx] != group_codes[:, None]) & valid).any(axis=1) | ~full
+    changed_groups = np.unique(group_codes[is_changed])
+    affected |= used_fallback & np.isin(group_codes, changed_groups)
+    return np.flatnonzero(affected)
+
+
+def _pair_scores(
+    embeddings: np.ndarray,
+    neighbour_idx: np.ndarray,
+    rows: np.ndarray,
+    block_size: int = BLOCK_SIZE,
+) -> np.ndarray:
+    """
+    float32 similarity of every ``rows`` item with its neighbours in
+    ``neighbour_idx`` (same length as ``rows``; -1 = none, scored NaN).
+    """
+    scores = np.full(neighbour_idx.shape, np.nan, dtype=np.float32)
+    for start in range(0, len(rows), block_size):
+        idx = neighbour_idx[start:start + block_size]
+        valid = idx >= 0
+        sims = np.einsum(
+            "id,ijd->ij", embeddings[rows[start:start + block_size]], embeddings[np.where(valid, idx, 0)]
+        )
+        scores[start:start + block_size] = np.where(valid, sims, np.nan)
+    return scores
+
+
+def refresh_neighbours(
+    npy_path: Path = EMBEDDINGS_NPY,
+    products_csv: Path = PRODUCTS_CSV,
+    sales_csv: Path = SALES_CSV,
+    changed_names: Set[str] = frozenset(),
+    graph_path: Optional[Path] = NEIGHBOURS_NPZ,
+    result_csv: Path = RESULT_CSV,
+    result_parquet: Path = RESULT_PARQUET,
+    threshold: float = SIMILARITY_THRESHOLD,
+    top_k: int = TOP_K,
+    graph_k: int = GRAPH_K,
+    block_size: int = BLOCK_SIZE,
+    fallback_block_size: int = FALLBACK_BLOCK_SIZE,
+    workers: int = 1,
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, int]:
+    """
+    Update the neighbour graph for the current store and catalogue.
+
+    Falls back to a full computation when there is no usable previous graph
+    (``graph_path`` None or missing, or not matching the result table).
+    Returns the result table, the (n, K) neighbour arrays and the number of
+    recomputed rows.
+    """
+    store = open_embeddings(npy_path)
+    df_product = pd.read_csv(products_csv)
+    unit_prices = read_unit_prices(sales_csv)
+
+    catalogue = build_catalogue(store.names, df_product)
+    embeddings = normalize_rows(store.vectors)[catalogue["emb_row"].to_numpy()]
+    names = catalogue["image_name"].astype(str).to_numpy()
+    n = len(catalogue)
+    neighbour_options = dict(
+        threshold=threshold, block_size=block_size, fallback_block_size=fallback_block_size,
+        workers=workers, memory_budget_mb=memory_budget_mb,
+    )
+
+    previous = None
+    if graph_path is not None and Path(graph_path).exists() and not pd.Series(names).duplicated().any():
+        graph = load_graph(graph_path)
+        old = read_result_table(result_parquet, result_csv, columns=["image_name", "PROD_REF", "DES_CONC"])
+        if graph.matches(old["image_name"].astype(str)):
+            previous = graph, old
+
+    if previous is None:
+        graph_k = min(max(graph_k, top_k), MAX_GRAPH_K)
+        neighbour_idx, neighbour_scores = compute_neighbours(
+            embeddings, catalogue["DES_CONC"], catalogue["PROD_REF"], catalogue["image_name"],
+            top_k=graph_k, max_neighbours=graph_k, **neighbour_options,
+        )
+        recomputed = n
+    else:
+        graph, old = previous
+        k = graph.k
+        old_row = pd.Series(np.arange(len(old)), index=old["image_name"].astype(str))
+        old_pos = old_row.reindex(names).fillna(-1).to_numpy(dtype=np.int64)
+
+        # Old row -> new row (-1: removed)
+        old_to_new = np.full(len(old), -1, dtype=np.int64)
+        old_to_new[old_pos[old_pos >= 0]] = np.flatnonzero(old_pos >= 0)
+
+        is_changed = (old_pos < 0) | np.isin(names, list(changed_names))
+        seen = old_pos >= 0
+        is_changed[seen] |= (
+            old["DES_CONC"].astype(str).to_numpy()[old_pos[seen]]
+            != catalogue["DES_CONC"].astype(str).to_numpy()[seen]
+        )
+        is_changed[seen] |= (
+            format_prod_ref(old["PROD_REF"]).to_numpy()[old_pos[seen]]
+            != format_prod_ref(catalogue["PROD_REF"]).to_numpy()[seen]
+        )
+
+        # Previous neighbours of every current row, renumbered
+        neighbour_idx = np.full((n, k), -1, dtype=np.int64)
+        neighbour_scores = np.full((n, k), np.nan, dtype=np.float32)
+        old_idx = graph.indices[old_pos[seen]].astype(np.int64)
+        neighbour_idx[seen] = np.where(old_idx >= 0, old_to_new[old_idx], -1)
+        # The graph stores float16 scores: rescore in float32, so the prices'
+        # threshold test and the written scores match a full rebuild
+        neighbour_scores[seen] = _pair_scores(embeddings, neighbour_idx[seen], np.flatnonzero(seen), block_size)
+        lost = np.zeros(n, dtype=bool)
+        lost[seen] = ((old_idx >= 0) & (neighbour_idx[seen] < 0)).any(axis=1)
+
+        group_codes, _ = pd.factorize(catalogue["DES_CONC"])
+        rows = _affected_rows(
+            embeddings, group_codes, is_changed, neighbour_idx, neighbour_scores, lost, memory_budget_mb
+        )
+        new_idx, new_scores = compute_neighbours(
+            embeddings, catalogue["DES_CONC"], catalogue["PROD_REF"], catalogue["image_name"],
+            top_k=k, max_neighbours=k, rows=rows, **neighbour_options,
+        )
+        width = new_idx.shape[1]
+        neighbour_idx[rows] = -1
+        neighbour_scores[rows] = np.nan
+        neighbour_idx[rows, :width] = new_idx
+        neighbour_scores[rows, :width] = new_scores
+        recomputed = len(rows)
+
+    result_df = assemble_result_df(
+        catalogue, neighbour_idx, neighbour_scores, df_product, unit_prices, top_k, threshold
+    )
+    return result_df, neighbour_idx, neighbour_scores, recomputed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed new images and update only the affected neighbours.")
+    parser.add_argument("--image-dirs", type=Path, nargs="+", default=IMAGE_DIRS)
+    parser.add_argument("--embeddings", type=Path, default=EMBEDDINGS_NPY, help="Embedding store (.npy).")
+    parser.add_argument("--products", type=Path, default=PRODUCTS_CSV, help="df_product.csv")
+    parser.add_argument("--sales", type=Path, default=SALES_CSV, help="df_sales.csv")
+    parser.add_argument("--out", type=Path, default=RESULT_CSV, help="Output CSV.")
+    parser.add_argument("--parquet-out", type=Path, default=RESULT_PARQUET)
+    parser.add_argument("--graph-out", type=Path, default=NEIGHBOURS_NPZ)
+    parser.add_argument("--ann-index", type=Path, default=ANN_INDEX_NPZ,
+                        help="ANN index to rebuild if stale (only if it exists).")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--graph-k", type=int, default=GRAPH_K, help="K of a full computation.")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--fallback-block-size", type=int, default=FALLBACK_BLOCK_SIZE)
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB)
+    parser.add_argument("--neighbour-workers", type=int, default=1,
+                        help="Processes for the in-group neighbour stage.")
+    parser.add_argument("--full", action="store_true", help="Recompute every neighbour.")
+    parser.add_argument("--skip-embeddings", action="store_true", help="Only update the neighbours.")
+    parser.add_argument("--checkpoint-dir", type=Path, default=CHECKPOINT_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Images per checkpoint.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--dtype", choices=STORE_DTYPES, default=None,
+                        help="Store dtype (default: the one of the current store).")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if not args.skip_embeddings:
+        refresh_embeddings(
+            args.embeddings, args.image_dirs, args.checkpoint_dir, args.chunk_size, args.dtype,
+            batch_size=args.batch_size, workers=args.workers,
+        )
+    # Embedded by this run or by an interrupted one
+    changed = read_pending(args.embeddings)
+
+    result_df, neighbour_idx, neighbour_scores, recomputed = refresh_neighbours(
+        args.embeddings, args.products, args.sales, changed,
+        graph_path=None if args.full else args.graph_out,
+        result_csv=args.out,
+        result_parquet=args.parquet_out,
+        threshold=args.threshold,
+        top_k=args.top_k,
+        graph_k=args.graph_k,
+        block_size=args.block_size,
+        fallback_block_size=args.fallback_block_size,
+        workers=args.neighbour_workers,
+        memory_budget_mb=args.memory_budget_mb,
+    )
+    write_outputs(
+        result_df, neighbour_idx, neighbour_scores, args.out, args.parquet_out, args.graph_out
+    )
+    write_pending(args.embeddings, set())
+    print(f"Recomputed the neighbours of {recomputed} of {len(result_df)} rows; "
+          f"saved {args.out} and {args.graph_out} in {time.perf_counter() - start:.1f}s")
+
+    if args.ann_index.exists():
+        vectors, has_vector = catalogue_vectors(open_embeddings(args.embeddings), result_df["image_name"])
+        signature = index_signature(args.embeddings, result_df["image_name"])
+        _, rebuilt = load_or_build(vectors, has_vector, signature, args.ann_index)
+        print(f"{'Rebuilt' if rebuilt else 'Kept'} {args.ann_index}")
+
+
+if __name__ == "__main__":
+    main()
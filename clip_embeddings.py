@@ -0,0 +1,192 @@
+"""
+Batched CLIP image embeddings, written straight into an embedding store.
+
+The notebook embeds one image at a time: decode, preprocess, then a
+batch-of-1 ``encode_image`` in the same loop. Here a ``DataLoader`` with
+``--workers`` processes decodes and preprocesses the images in parallel
+while the main process runs ``--batch-size`` images at a time through the
+model. Every batch is L2-normalised and written into a memory-mapped
+``.npy`` (see ``embedding_store.py``), so the embeddings never go through a
+CSV.
+
+Needs ``torch`` and OpenAI's ``clip`` package (see the notebook), which are
+not part of the app requirements.
+
+Usage
+-----
+    python clip_embeddings.py --workers 4 --batch-size 64
+    python clip_embeddings.py --limit 2000 --batch-size 32   # quick benchmark
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from embedding_store import EMBEDDINGS_NPY, STORE_DTYPES, names_path
+from image_manifest import IMAGE_DIRS, build_manifest
+
+CLIP_MODEL = "ViT-B/32"
+BATCH_SIZE = 64
+
+
+class ImageDataset:
+    """Map-style dataset: (index, preprocessed tensor), or None if the image cannot be read."""
+
+    def __init__(self, paths: Sequence[Path], preprocess):
+        self.paths = list(paths)
+        self.preprocess = preprocess
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, i: int):
+        try:
+            with Image.open(self.paths[i]) as image:
+                return i, self.preprocess(image.convert("RGB"))
+        except Exception as e:
+            print(f"Error with image {self.paths[i]}: {e}")
+            return None
+
+
+def _collate(items):
+    """Stack the readable images of a batch; returns (indices, tensor)."""
+    import torch
+
+    items = [item for item in items if item is not None]
+    if not items:
+        return [], None
+    indices, tensors = zip(*items)
+    return list(indices), torch.stack(tensors)
+
+
+def _init_worker(worker_id: int):
+    import torch
+
+    # The workers only decode / resize: keep them off the model's threads
+    torch.set_num_threads(1)
+
+
+def load_clip(model_name: str = CLIP_MODEL, device: str = "cpu"):
+    """(model, preprocess) of a CLIP checkpoint, in eval mode."""
+    import clip
+
+    model, preprocess = clip.load(model_name, device=device)
+    model.eval()
+    return model, preprocess
+
+
+def embed_images(
+    paths: Sequence[Path],
+    npy_path: Path = EMBEDDINGS_NPY,
+    image_names: Optional[Sequence[str]] = None,
+    model_name: str = CLIP_MODEL,
+    batch_size: int = BATCH_SIZE,
+    workers: int = 0,
+    threads: Optional[int] = None,
+    dtype: str = "float32",
+    device: str = "cpu",
+    model=None,
+) -> Tuple[int, List[Path]]:
+    """
+    Embed ``paths`` with CLIP and save them as an embedding store.
+
+    ``image_names`` defaults to the file stems. Rows are written in
+    ``paths`` order; unreadable images are left out. ``model`` is a
+    ``(model, preprocess)`` pair from ``load_clip``, to reuse a loaded model
+    across calls. Returns the number of stored embeddings and the paths
+    that failed.
+    """
+    import torch
+    from torch.utils.data import DataLoader
+
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"dtype must be one of {STORE_DTYPES}, got {dtype!r}")
+    paths = [Path(p) for p in paths]
+    if image_names is None:
+        image_names = [p.stem for p in paths]
+
+    # Main process: matmuls; the loader workers get the remaining cores
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) - workers)
+    torch.set_num_threads(threads)
+
+    model, preprocess = model or load_clip(model_name, device)
+    loader = DataLoader(
+        ImageDataset(paths, preprocess),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=_collate,
+        worker_init_fn=_init_worker if workers else None,
+        prefetch_factor=4 if workers else None,
+        persistent_workers=False,
+    )
+
+    npy_path = Path(npy_path)
+    npy_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = npy_path.with_name(npy_path.stem + ".tmp.npy")
+    dim = model.visual.output_dim
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(len(paths), dim))
+
+    stored = []
+    with torch.inference_mode():
+        for indices, batch in loader:
+            if not indices:
+                continue
+            emb = model.encode_image(batch.to(device)).float().cpu().numpy()
+            emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-9, None)
+            out[len(stored):len(stored) + len(indices)] = emb
+            stored.extend(indices)
+
+    out.flush()
+    if len(stored) == len(paths):
+        del out
+        os.replace(tmp_path, npy_path)
+    else:
+        np.save(npy_path, out[:len(stored)])
+        del out
+        tmp_path.unlink()
+    names_path(npy_path).write_text(
+        "".join(f"{image_names[i]}\n" for i in stored), encoding="utf-8"
+    )
+
+    stored_set = set(stored)
+    failed = [p for i, p in enumerate(paths) if i not in stored_set]
+    return len(stored), failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute CLIP embeddings of the product images in batches.")
+    parser.add_argument("--image-dirs", type=Path, nargs="+", default=IMAGE_DIRS)
+    parser.add_argument("--out", type=Path, default=EMBEDDINGS_NPY)
+    parser.add_argument("--model", default=CLIP_MODEL)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Decode / preprocess processes (0 = in the main process).")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads for the model (default: cores - workers).")
+    parser.add_argument("--dtype", choices=STORE_DTYPES, default="float32")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N images (benchmarks).")
+    args = parser.parse_args(argv)
+
+    manifest = build_manifest(args.image_dirs)
+    names = sorted(manifest.paths)[:args.limit]
+    paths = [manifest.paths[name] for name in names]
+
+    start = time.perf_counter()
+    n, failed = embed_images(
+        paths, args.out, names, args.model, args.batch_size, args.workers, args.threads, args.dtype
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Embedded {n} images ({len(failed)} failed) in {elapsed:.1f}s – "
+        f"{n / max(elapsed, 1e-9):.1f} images/s "
+        f"(batch {args.batch_size}, {args.workers} workers) -> {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
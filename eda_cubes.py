@@ -0,0 +1,184 @@
+"""
+Small aggregate tables ("cubes") behind the EDA page.
+
+The page never touches ``df_sales.csv`` or the product catalogue: this
+offline step reduces them, together with the result table, to a few
+tables whose size depends on the number of ``DES_CONC`` groups and
+histogram bins, not on the number of products:
+
+- ``sales_by_group``: sales quantity, amount and mean unit price per group;
+- ``group_sizes``: images, PROD_REFs and priced images per group;
+- ``price_hist``: price histogram, for the whole catalogue and per group;
+- ``similarity_hist``: histogram of the neighbour scores per rank.
+
+They are written as Parquet files in ``data/eda/``.
+
+Usage
+-----
+    python eda_cubes.py
+    python eda_cubes.py --result-csv data/result_df.csv --sales data/df_sales.csv
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from result_table import RESULT_CSV, RESULT_PARQUET, read_result_table
+from similarity_engine import PRODUCTS_CSV, SALES_CHUNK_ROWS, SALES_CSV, SALES_DTYPES
+
+BASE_DIR = Path(__file__).resolve().parent
+EDA_DIR = BASE_DIR / "data" / "eda"
+
+CUBES = ("sales_by_group", "group_sizes", "price_hist", "similarity_hist")
+PRICE_BINS = 40
+SCORE_BINS = 50
+ALL_GROUPS = "All"
+
+
+def cube_path(name: str, cube_dir: Path = EDA_DIR) -> Path:
+    return Path(cube_dir) / f"{name}.parquet"
+
+
+def _product_groups(df_product: pd.DataFrame) -> pd.Series:
+    """PROD_CLR_EQUIV -> DES_CONC (first product row), as in build_catalogue."""
+    groups = (
+        df_product["L3_DES"].fillna("Other").astype(str) + "_"
+        + df_product["L4_DES"].fillna("Other").astype(str)
+    )
+    by_code = pd.Series(groups.to_numpy(), index=df_product["PROD_CLR_EQUIV"].to_numpy())
+    return by_code[~by_code.index.duplicated()]
+
+
+def sales_by_group(
+    sales_csv: Path,
+    df_product: pd.DataFrame,
+    chunk_rows: int = SALES_CHUNK_ROWS,
+) -> pd.DataFrame:
+    """
+    Sales quantity / amount, mean unit price and number of sold
+    PROD_CLR_EQUIVs per DES_CONC, streamed over the sales table.
+    """
+    parts = []
+    for chunk in pd.read_csv(sales_csv, usecols=list(SALES_DTYPES), dtype=SALES_DTYPES, chunksize=chunk_rows):
+        chunk["price"] = chunk["SALES_AMT_FX_RATE"] / chunk["SALES_QTY"]
+        parts.append(chunk.groupby("PROD_CLR_EQUIV").agg(
+            qty=("SALES_QTY", "sum"),
+            amount=("SALES_AMT_FX_RATE", "sum"),
+            price_sum=("price", "sum"),
+            price_count=("price", "count"),
+        ))
+    per_code = pd.concat(parts).groupby(level=0).sum()
+    per_code["DES_CONC"] = per_code.index.map(_product_groups(df_product)).fillna("Other_Other")
+
+    cube = per_code.groupby("DES_CONC").agg(
+        n_codes=("qty", "size"),
+        sales_qty=("qty", "sum"),
+        sales_amount=("amount", "sum"),
+        price_sum=("price_sum", "sum"),
+        price_count=("price_count", "sum"),
+    )
+    cube["mean_price"] = cube["price_sum"] / cube["price_count"].where(cube["price_count"] > 0)
+    cube = cube.drop(columns=["price_sum", "price_count"])
+    return cube.sort_values("sales_amount", ascending=False).reset_index()
+
+
+def group_sizes(result_df: pd.DataFrame) -> pd.DataFrame:
+    """Images, distinct PROD_REFs and images with a price per DES_CONC."""
+    cube = result_df.groupby("DES_CONC", observed=True).agg(
+        n_images=("image_name", "size"),
+        n_prod_refs=("PROD_REF", "nunique"),
+        n_priced=("Price", "count"),
+        median_price=("Price", "median"),
+    )
+    return cube.sort_values("n_images", ascending=False).reset_index()
+
+
+def price_histogram(result_df: pd.DataFrame, n_bins: int = PRICE_BINS) -> pd.DataFrame:
+    """
+    Price histogram on ``n_bins`` shared bins (0 .. 99.5th percentile, the
+    last bin also counts the tail), for ``ALL_GROUPS`` and every DES_CONC.
+    """
+    price = pd.to_numeric(result_df["Price"], errors="coerce")
+    valid = np.isfinite(price.to_numpy(dtype=float))
+    price, groups = price[valid], result_df["DES_CONC"].astype(str)[valid]
+    upper = float(np.percentile(price, 99.5)) if len(price) else 1.0
+    edges = np.linspace(0.0, max(upper, 1e-9), n_bins + 1)
+    bins = np.clip(np.searchsorted(edges, price, side="right") - 1, 0, n_bins - 1)
+
+    counts = pd.crosstab(groups.to_numpy(), bins).reindex(columns=range(n_bins), fill_value=0)
+    counts.loc[ALL_GROUPS] = counts.sum(axis=0)
+    cube = counts.stack().rename("count").reset_index()
+    cube.columns = ["DES_CONC", "bin", "count"]
+    cube["price_from"] = edges[cube["bin"]]
+    cube["price_to"] = edges[cube["bin"] + 1]
+    return cube[["DES_CONC", "price_from", "price_to", "count"]]
+
+
+def similarity_histogram(result_df: pd.DataFrame, n_bins: int = SCORE_BINS) -> pd.DataFrame:
+    """Histogram of ``similarity_score_k`` for every rank k, on bins over [0, 1]."""
+    edges = np.linspace(0.0, 1.0, n_bins + 1)
+    rows = []
+    rank = 1
+    while f"similarity_score_{rank}" in result_df.columns:
+        scores = pd.to_numeric(result_df[f"similarity_score_{rank}"], errors="coerce").dropna()
+        counts, _ = np.histogram(np.clip(scores, 0.0, 1.0), bins=edges)
+        rows.append(pd.DataFrame({
+            "rank": rank, "score_from": edges[:-1], "score_to": edges[1:], "count": counts,
+        }))
+        rank += 1
+    if not rows:
+        return pd.DataFrame(columns=["rank", "score_from", "score_to", "count"])
+    return pd.concat(rows, ignore_index=True)
+
+
+def build_cubes(
+    result_df: pd.DataFrame,
+    df_product: pd.DataFrame,
+    sales_csv: Path,
+    cube_dir: Path = EDA_DIR,
+) -> Dict[str, Path]:
+    """Compute every cube and write it to ``cube_dir``; returns name -> path."""
+    cubes = {
+        "sales_by_group": sales_by_group(sales_csv, df_product),
+        "group_sizes": group_sizes(result_df),
+        "price_hist": price_histogram(result_df),
+        "similarity_hist": similarity_histogram(result_df),
+    }
+    Path(cube_dir).mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for name, cube in cubes.items():
+        paths[name] = cube_path(name, cube_dir)
+        cube.to_parquet(paths[name], index=False)
+    return paths
+
+
+def read_cubes(cube_dir: Path = EDA_DIR) -> Dict[str, pd.DataFrame]:
+    """The cubes that exist in ``cube_dir``."""
+    return {
+        name: pd.read_parquet(cube_path(name, cube_dir))
+        for name in CUBES
+        if cube_path(name, cube_dir).exists()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the aggregate tables of the EDA page.")
+    parser.add_argument("--result-parquet", type=Path, default=RESULT_PARQUET)
+    parser.add_argument("--result-csv", type=Path, default=RESULT_CSV)
+    parser.add_argument("--products", type=Path, default=PRODUCTS_CSV, help="df_product.csv")
+    parser.add_argument("--sales", type=Path, default=SALES_CSV, help="df_sales.csv")
+    parser.add_argument("--out", type=Path, default=EDA_DIR, help="Output directory.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    result_df = read_result_table(args.result_parquet, args.result_csv)
+    paths = build_cubes(result_df, pd.read_csv(args.products), args.sales, args.out)
+    sizes = ", ".join(f"{name} {len(pd.read_parquet(path))} rows" for name, path in paths.items())
+    print(f"Wrote {sizes} to {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
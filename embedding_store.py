@@ -0,0 +1,142 @@
+"""
+Binary store for the CLIP image embeddings.
+
+An embedding store is two files next to each other:
+
+- ``<name>.npy``        – (n, 512) float32 or float16 matrix, L2-normalised;
+- ``<name>.names.txt``  – the ``image_name`` of every row, one per line.
+
+The matrix is opened with ``np.load(mmap_mode="r")``, so the similarity
+engine and the app read it without parsing or copying anything.
+
+Usage
+-----
+    python embedding_store.py clip_embeddings.csv data/embeddings.npy --dtype float16
+"""
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent
+EMBEDDINGS_NPY = BASE_DIR / "data" / "embeddings.npy"
+
+STORE_DTYPES = ("float32", "float16")
+
+
+def names_path(npy_path: Path) -> Path:
+    """Path of the name index that goes with ``npy_path``."""
+    npy_path = Path(npy_path)
+    return npy_path.with_name(npy_path.stem + ".names.txt")
+
+
+class EmbeddingStore:
+    """
+    Read-only view of an embedding store.
+
+    ``vectors`` is the (memory-mapped) matrix and ``names`` the image name of
+    every row; ``row_of`` maps an image name to its row.
+    """
+
+    def __init__(self, names: np.ndarray, vectors: np.ndarray):
+        if len(names) != len(vectors):
+            raise ValueError(
+                f"Embedding store is inconsistent: {len(names)} names for {len(vectors)} vectors"
+            )
+        self.names = names
+        self.vectors = vectors
+        self._row_of: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def row_of(self) -> Dict[str, int]:
+        if self._row_of is None:
+            self._row_of = {name: i for i, name in enumerate(self.names)}
+        return self._row_of
+
+    def get(self, image_names: Iterable[str]) -> np.ndarray:
+        """float32 vectors of the given images (KeyError if one is missing)."""
+        rows = [self.row_of[name] for name in image_names]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+
+def save_embeddings(
+    npy_path: Path,
+    image_names,
+    matrix: np.ndarray,
+    dtype: str = "float32",
+    normalize: bool = True,
+) -> Path:
+    """Write ``matrix`` (one row per name) as an embedding store."""
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"dtype must be one of {STORE_DTYPES}, got {dtype!r}")
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if normalize:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.clip(norms, 1e-9, None)
+
+    npy_path = Path(npy_path)
+    npy_path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(npy_path, matrix.astype(dtype))
+    names_path(npy_path).write_text(
+        "".join(f"{name}\n" for name in image_names), encoding="utf-8"
+    )
+    return npy_path
+
+
+def open_embeddings(npy_path: Path = EMBEDDINGS_NPY, mmap: bool = True) -> EmbeddingStore:
+    """Open an embedding store, memory-mapped by default."""
+    npy_path = Path(npy_path)
+    vectors = np.load(npy_path, mmap_mode="r" if mmap else None)
+    names = np.array(
+        names_path(npy_path).read_text(encoding="utf-8").splitlines(), dtype=object
+    )
+    return EmbeddingStore(names, vectors)
+
+
+def read_embeddings_csv(csv_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read a CSV written by the notebook's CLIP cell (``image_name`` + ``0``..``511``).
+
+    Returns the image names and a float32 matrix with one row per name.
+    Duplicated names keep their last row, like ``emb_dict`` in the notebook.
+    """
+    emb_df = pd.read_csv(csv_path, dtype={"image_name": str})
+    emb_df = emb_df.drop_duplicates(subset="image_name", keep="last")
+
+    embedding_cols = [c for c in emb_df.columns if c != "image_name"]
+    names = emb_df["image_name"].to_numpy(dtype=object)
+    matrix = emb_df[embedding_cols].to_numpy(dtype=np.float32)
+    return names, matrix
+
+
+def convert_csv(csv_path: Path, npy_path: Path, dtype: str = "float32") -> EmbeddingStore:
+    """Convert a notebook embeddings CSV into an embedding store."""
+    names, matrix = read_embeddings_csv(csv_path)
+    save_embeddings(npy_path, names, matrix, dtype=dtype)
+    return open_embeddings(npy_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a CLIP embeddings CSV into a binary embedding store.")
+    parser.add_argument("csv", type=Path, help="CSV with image_name + embedding columns.")
+    parser.add_argument("out", type=Path, nargs="?", default=EMBEDDINGS_NPY, help="Output .npy file.")
+    parser.add_argument("--dtype", choices=STORE_DTYPES, default="float32")
+    args = parser.parse_args(argv)
+
+    store = convert_csv(args.csv, args.out, dtype=args.dtype)
+    size_mb = (args.out.stat().st_size + names_path(args.out).stat().st_size) / 1e6
+    print(f"Saved {len(store)} embeddings ({store.dim} dims, {args.dtype}) to {args.out} – {size_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
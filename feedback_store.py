@@ -0,0 +1,731 @@
+"""
+Storage of the user feedback (ratings of the recommended products).
+
+Writes never wait on the network: ``FeedbackQueue.submit`` appends the row
+to a local SQLite spool and returns. A background ``SpoolWorker`` sends the
+pending rows to the backend in multi-row inserts, retrying with
+exponential backoff while the backend is unreachable. Rows that were not
+sent yet survive a restart and are sent by the next worker (delivery is at
+least once).
+
+Backends:
+
+- ``SupabaseBackend`` – the ``feedback`` table in Supabase (client created
+  on first use);
+- ``LocalBackend``    – the spool itself is the store (offline / tests).
+
+``FeedbackCache`` is a local SQLite copy of the table for the CSV
+download. It is only filled when someone asks for it, it is reused for
+``ttl`` seconds, and a refresh reads only the rows with an ``id`` greater
+than the last cached one, in pages. ``export_csv`` streams the table (or
+the copy) to a CSV file page by page; ``export_csv_file`` does it into a
+temporary file that is freed once read. ``PairRatings`` is a local SQLite mirror with Bad / Medium
+/ Good counters per (chosen article, recommended article); it is updated
+incrementally from the rows with an ``id`` greater than the last one
+counted, and a pair is read with one primary-key lookup.
+"""
+import codecs
+import io
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from collections import Counter
+from typing import BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent
+SPOOL_PATH = BASE_DIR / "data" / "feedback_spool.sqlite"
+RATINGS_PATH = BASE_DIR / "data" / "feedback_ratings.sqlite"
+CACHE_PATH = BASE_DIR / "data" / "feedback_cache.sqlite"
+
+FEEDBACK_TABLE = "feedback"
+ID_COLUMN = "id"
+PAGE_SIZE = 1000
+CSV_SEPARATOR = ";"
+
+FEEDBACK_TTL = 60  # seconds a refreshed FeedbackCache is reused
+
+RATINGS_TTL = 60  # seconds between syncs of the rating counters
+
+# Rating given in the app (and older Portuguese values) -> counter column
+RATING_COLUMNS = {
+    "Bad": "bad", "Medium": "medium", "Good": "good",
+    "mau": "bad", "razoável": "medium", "bom": "good",
+}
+N_RATED = 4  # artigo_1..4 / avaliacao_1..4
+
+# Columns of a feedback row written by the app (the CSV header starts with them)
+FEEDBACK_COLUMNS = [ID_COLUMN, "artigo_escolhido"] + [
+    column for j in range(1, N_RATED + 1) for column in (f"artigo_{j}", f"avaliacao_{j}")
+] + ["comentario"]
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 2.0  # seconds between flushes when idle
+MAX_BACKOFF = 60.0
+
+
+# -------------------------------------------------
+# Backends
+# -------------------------------------------------
+class SupabaseBackend:
+    """
+    The feedback table in Supabase.
+
+    Takes a client, or ``connect``, a function that creates one (see
+    ``supabase_connector``): the client is then created on first use, once,
+    and reused for every request.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        table: str = FEEDBACK_TABLE,
+        connect: Optional[Callable[[], object]] = None,
+    ):
+        if client is None and connect is None:
+            raise ValueError("SupabaseBackend needs a client or a connect function")
+        self._client = client
+        self._connect = connect
+        self._lock = threading.Lock()
+        self.table = table
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    def insert_many(self, rows: List[dict]):
+        self.client.table(self.table).insert(rows).execute()
+
+    def fetch_after(self, after_id, limit: int) -> List[dict]:
+        query = self.client.table(self.table).select("*").order(ID_COLUMN)
+        if after_id is not None:
+            query = query.gt(ID_COLUMN, after_id)
+        return query.limit(limit).execute().data or []
+
+
+def supabase_connector(url: str, key: str) -> Callable[[], object]:
+    """``connect`` function for ``SupabaseBackend``; imports ``supabase`` only when called."""
+
+    def connect():
+        from supabase import create_client
+
+        return create_client(url, key)
+
+    return connect
+
+
+class FeedbackSpool:
+    """
+    Durable local queue of feedback rows (SQLite).
+
+    Every row gets an increasing ``seq``; ``flushed_at`` is set once the
+    row was delivered to the backend. ``chosen`` (the row's
+    ``artigo_escolhido``) is indexed, so the rows of one chosen article
+    are read without scanning the spool.
+    """
+
+    def __init__(self, path: Path = SPOOL_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS spool (
+                    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload    TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    flushed_at REAL,
+                    chosen     TEXT
+                )
+                """
+            )
+            # Spools created before the chosen column: add and fill it
+            columns = [info[1] for info in conn.execute("PRAGMA table_info(spool)")]
+            if "chosen" not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN chosen TEXT")
+                conn.execute("UPDATE spool SET chosen = json_extract(payload, '$.artigo_escolhido')")
+            conn.execute("CREATE INDEX IF NOT EXISTS spool_pending ON spool (flushed_at, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS spool_chosen ON spool (chosen, seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def put(self, row: dict) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO spool (payload, created_at, chosen) VALUES (?, ?, ?)",
+                (json.dumps(row, ensure_ascii=False), time.time(), _chosen(row)),
+            )
+            return cur.lastrowid
+
+    def pending(self, limit: int) -> list:
+        """Oldest undelivered rows as (seq, created_at, row)."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, created_at, payload FROM spool "
+                "WHERE flushed_at IS NULL ORDER BY seq LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(seq, created_at, json.loads(payload)) for seq, created_at, payload in rows]
+
+    def mark_flushed(self, seqs: List[int]):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE spool SET flushed_at = ? WHERE seq = ?",
+                [(time.time(), seq) for seq in seqs],
+            )
+
+    def purge_delivered(self, up_to_seq: int) -> int:
+        """Delete the delivered rows with seq <= ``up_to_seq``; returns how many."""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM spool WHERE flushed_at IS NOT NULL AND seq <= ?", (up_to_seq,)
+            ).rowcount
+
+    def depth(self) -> int:
+        """Number of rows waiting to be delivered."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM spool WHERE flushed_at IS NULL").fetchone()[0]
+
+    def last_flushed(self) -> Optional[int]:
+        """Highest seq delivered to the backend (None: none yet)."""
+        with self._connect() as conn:
+            return conn.execute("SELECT MAX(seq) FROM spool WHERE flushed_at IS NOT NULL").fetchone()[0]
+
+    def rows_after(self, chosen: str, after_seq: Optional[int]) -> List[dict]:
+        """Rows of ``chosen`` not delivered yet, plus those with seq > ``after_seq``."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT payload FROM spool WHERE chosen = ? "
+                "AND (flushed_at IS NULL OR seq > ?) ORDER BY seq",
+                (str(chosen), after_seq if after_seq is not None else float("inf")),
+            ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def fetch_after(self, after_id, limit: int) -> List[dict]:
+        """All spooled rows with seq > after_id, as feedback rows with an ``id``."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, payload FROM spool WHERE seq > ? ORDER BY seq LIMIT ?",
+                (after_id if after_id is not None else 0, limit),
+            ).fetchall()
+        return [{ID_COLUMN: seq, **json.loads(payload)} for seq, payload in rows]
+
+
+def _chosen(row: dict) -> Optional[str]:
+    chosen = row.get("artigo_escolhido")
+    return None if chosen is None else str(chosen)
+
+
+class LocalBackend:
+    """Keeps the feedback in the spool only (nothing is sent anywhere)."""
+
+    def __init__(self, spool: FeedbackSpool):
+        self.spool = spool
+
+    def insert_many(self, rows: List[dict]):
+        pass
+
+    def fetch_after(self, after_id, limit: int) -> List[dict]:
+        return self.spool.fetch_after(after_id, limit)
+
+
+# -------------------------------------------------
+# Write-behind queue
+# -------------------------------------------------
+class SpoolWorker(threading.Thread):
+    """Background thread that delivers the spooled rows in batches."""
+
+    def __init__(
+        self,
+        spool: FeedbackSpool,
+        backend,
+        batch_size: int = BATCH_SIZE,
+        interval: float = FLUSH_INTERVAL,
+        max_backoff: float = MAX_BACKOFF,
+    ):
+        super().__init__(name="feedback-spool-worker", daemon=True)
+        self.spool = spool
+        self.backend = backend
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+
+        self.wake = threading.Event()
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_latency: Optional[float] = None  # submit -> delivered, seconds
+        self.last_batch_seconds: Optional[float] = None
+        self.delivered = 0
+        # Called with the seqs of every delivered batch (see FeedbackQueue.on_delivered)
+        self.listeners: List[Callable[[List[int]], None]] = []
+
+    def flush_once(self) -> int:
+        """Deliver one batch; returns the number of rows sent (raises on failure)."""
+        batch = self.spool.pending(self.batch_size)
+        if not batch:
+            return 0
+        start = time.time()
+        self.backend.insert_many([row for _, _, row in batch])
+        seqs = [seq for seq, _, _ in batch]
+        self.spool.mark_flushed(seqs)
+        for listener in self.listeners:
+            try:
+                listener(seqs)
+            except Exception:
+                pass  # a listener never holds up delivery
+
+        now = time.time()
+        self.last_batch_seconds = now - start
+        self.last_flush_latency = now - batch[0][1]
+        self.delivered += len(batch)
+        return len(batch)
+
+    def run(self):
+        while True:
+            try:
+                sent = self.flush_once()
+                self.failures = 0
+                self.last_error = None
+                if sent == self.batch_size:
+                    continue  # more rows are probably waiting
+                delay = self.interval
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                # Backing off: new submissions must not trigger an early retry
+                time.sleep(min(self.max_backoff, self.interval * 2 ** self.failures))
+                continue
+            self.wake.wait(delay)
+            self.wake.clear()
+
+
+class FeedbackQueue:
+    """Front door for writes: spool the row now, deliver it in the background."""
+
+    def __init__(self, spool: FeedbackSpool, backend, **worker_options):
+        self.spool = spool
+        self.backend = backend
+        self.worker = SpoolWorker(spool, backend, **worker_options)
+        self.worker.start()
+
+    def submit(self, row: dict) -> int:
+        seq = self.spool.put(row)
+        self.worker.wake.set()
+        return seq
+
+    def on_delivered(self, listener: Callable[[List[int]], None]):
+        """Call ``listener(seqs)`` from the worker after every delivered batch."""
+        self.worker.listeners.append(listener)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.spool.depth(),
+            "delivered": self.worker.delivered,
+            "last_flush_latency": self.worker.last_flush_latency,
+            "last_batch_seconds": self.worker.last_batch_seconds,
+            "failures": self.worker.failures,
+            "last_error": self.worker.last_error,
+        }
+
+
+# -------------------------------------------------
+# Reads
+# -------------------------------------------------
+class FeedbackCache:
+    """
+    Incrementally refreshed, process-wide copy of the feedback table.
+
+    The rows are kept in a SQLite file keyed by ``id`` (not in memory), so
+    the copy also survives a restart. It has the ``fetch_after`` interface
+    of a backend, so ``export_csv`` can read it page by page.
+    """
+
+    def __init__(
+        self,
+        backend,
+        path: Path = CACHE_PATH,
+        ttl: float = FEEDBACK_TTL,
+        page_size: int = PAGE_SIZE,
+    ):
+        self.backend = backend
+        self.path = Path(path)
+        self.ttl = ttl
+        self.page_size = page_size
+
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._background: Optional[threading.Thread] = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS feedback_rows (id PRIMARY KEY, payload TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def last_id(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT MAX(id) FROM feedback_rows").fetchone()[0]
+
+    def columns(self) -> List[str]:
+        """Every column of the cached rows, in order of first appearance."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key FROM feedback_rows, json_each(feedback_rows.payload) "
+                "GROUP BY key ORDER BY MIN(feedback_rows.id), MIN(json_each.id)"
+            ).fetchall()
+        return [key for key, in rows]
+
+    def refresh_if_stale(self, wait: bool = True) -> int:
+        """
+        Fetch the new rows if the copy is older than ``ttl``; returns how
+        many. A failed refresh raises, but also counts, so an unreachable
+        backend is not retried on every call; the copy stays as it was.
+
+        With ``wait=False`` the refresh runs in a background thread (errors
+        are dropped) and 0 is returned.
+        """
+        if not wait:
+            if self._background is None or not self._background.is_alive():
+                self._background = threading.Thread(
+                    target=self._refresh_quietly, name="feedback-cache-refresh", daemon=True
+                )
+                self._background.start()
+            return 0
+        with self._lock:
+            if self._fetched_at is not None and time.monotonic() - self._fetched_at <= self.ttl:
+                return 0
+            try:
+                return self._refresh()
+            finally:
+                self._fetched_at = time.monotonic()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh_if_stale()
+        except Exception:
+            pass  # retried after the ttl
+
+    def invalidate(self):
+        """Make the next ``refresh_if_stale`` fetch the new rows (e.g. after a delivery)."""
+        self._fetched_at = None
+
+    def _refresh(self) -> int:
+        total = 0
+        after_id = self.last_id()
+        while True:
+            page = self.backend.fetch_after(after_id, self.page_size)
+            if page:
+                with self._connect() as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO feedback_rows (id, payload) VALUES (?, ?)",
+                        [(row[ID_COLUMN], json.dumps(row, ensure_ascii=False)) for row in page],
+                    )
+                after_id = page[-1][ID_COLUMN]
+                total += len(page)
+            if len(page) < self.page_size:
+                return total
+
+    def fetch_after(self, after_id, limit: int) -> List[dict]:
+        """Cached rows with id > after_id, in id order."""
+        with self._connect() as conn:
+            if after_id is None:
+                rows = conn.execute(
+                    "SELECT payload FROM feedback_rows ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT payload FROM feedback_rows WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, limit),
+                ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def get(self) -> pd.DataFrame:
+        """The whole cached table, refreshed first if older than ``ttl``."""
+        self.refresh_if_stale()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload FROM feedback_rows ORDER BY id").fetchall()
+        return pd.DataFrame([json.loads(payload) for payload, in rows])
+
+
+# -------------------------------------------------
+# Export
+# -------------------------------------------------
+def export_csv(
+    backend,
+    out: BinaryIO,
+    page_size: int = PAGE_SIZE,
+    sep: str = CSV_SEPARATOR,
+    columns: Optional[Sequence[str]] = None,
+) -> int:
+    """
+    Write the whole feedback table of ``backend`` (or of a
+    ``FeedbackCache``) to the binary file ``out`` as CSV (UTF-8 with BOM,
+    so Excel opens it correctly).
+
+    Rows are read in pages of ``page_size`` ordered by ``id`` (``id > last``
+    range queries) and every page is written before the next one is read,
+    so memory does not depend on the size of the table. The header is
+    ``FEEDBACK_COLUMNS`` followed by any other column of ``columns``
+    (default: ``backend.columns()`` when the backend has it), so a column
+    that only appears in later pages is not dropped. Returns the number of
+    rows.
+    """
+    if columns is None:
+        columns = backend.columns() if hasattr(backend, "columns") else []
+    header = FEEDBACK_COLUMNS + [c for c in columns if c not in FEEDBACK_COLUMNS]
+
+    out.write(codecs.BOM_UTF8)
+    out.write(pd.DataFrame(columns=header).to_csv(index=False, sep=sep).encode("utf-8"))
+    after_id = None
+    total = 0
+    while True:
+        page = backend.fetch_after(after_id, page_size)
+        if page:
+            chunk = pd.DataFrame(page).reindex(columns=header).to_csv(index=False, header=False, sep=sep)
+            out.write(chunk.encode("utf-8"))
+            total += len(page)
+            after_id = page[-1][ID_COLUMN]
+        if len(page) < page_size:
+            return total
+
+
+class ReadOnceFile(io.RawIOBase):
+    """
+    Binary reader over an (already unlinked) temporary file that closes,
+    and so frees, the file once it has been read to the end.
+    """
+
+    def __init__(self, file):
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def readinto(self, buffer) -> int:
+        n = self._file.readinto(buffer)
+        if not n:
+            self.close()
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def export_csv_file(backend, **options) -> ReadOnceFile:
+    """``export_csv`` into a temporary file, returned rewound (see ``ReadOnceFile``)."""
+    out = tempfile.TemporaryFile(buffering=0)
+    try:
+        export_csv(backend, out, **options)
+        out.seek(0)
+    except BaseException:
+        out.close()
+        raise
+    return ReadOnceFile(out)
+
+
+# -------------------------------------------------
+# Rating counters per (chosen, recommended) pair
+# -------------------------------------------------
+class PairRatings:
+    """
+    Bad / Medium / Good counts per (artigo_escolhido, artigo_j), kept in a
+    local SQLite table keyed by the pair.
+
+    ``sync`` reads only the feedback rows after the last counted ``id`` and
+    adds them to the counters; the new counts and the new last ``id`` are
+    committed together, so a row is never counted twice.
+
+    With a ``spool``, the reads also count the spooled rows the counters do
+    not include yet (not delivered, or delivered after the last sync), so a
+    saved rating shows at once without waiting for the backend. A sync
+    deletes the delivered rows it counted from the spool, unless the spool
+    is the backend's storage (``LocalBackend``), so the spool stays small.
+    """
+
+    def __init__(self, path: Path = RATINGS_PATH, spool: Optional[FeedbackSpool] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.spool = spool
+        self._lock = threading.Lock()
+        self._synced_at: Optional[float] = None
+        self._background: Optional[threading.Thread] = None
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pair_ratings (
+                    chosen      TEXT NOT NULL,
+                    recommended TEXT NOT NULL,
+                    bad         INTEGER NOT NULL DEFAULT 0,
+                    medium      INTEGER NOT NULL DEFAULT 0,
+                    good        INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (chosen, recommended)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _state(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def last_id(self):
+        return self._state("last_id")
+
+    def sync(self, backend, page_size: int = PAGE_SIZE) -> int:
+        """Count the feedback rows added since the last sync; returns how many."""
+        with self._lock:
+            # Spool rows delivered before the first fetch are in the backend,
+            # so this sync counts them: from then on the reads skip them.
+            # (Never below the last watermark: purged rows leave no trace.)
+            delivered = None
+            if self.spool is not None:
+                delivered = max(self.spool.last_flushed() or 0, self._state("spool_seq") or 0)
+            total = 0
+            after_id = self.last_id()
+            while True:
+                page = backend.fetch_after(after_id, page_size)
+                last_page = len(page) < page_size
+                if page:
+                    after_id = page[-1][ID_COLUMN]
+                if page or (last_page and delivered is not None):
+                    self._add(_count_pairs(page), after_id, delivered if last_page else None)
+                total += len(page)
+                if last_page:
+                    break
+            # The counters hold the delivered rows now; the spool only needs
+            # them when it is the store itself (LocalBackend)
+            if delivered and not isinstance(backend, LocalBackend):
+                self.spool.purge_delivered(delivered)
+            self._synced_at = time.monotonic()
+            return total
+
+    def sync_if_stale(self, backend, ttl: float = RATINGS_TTL, wait: bool = True) -> int:
+        """
+        ``sync`` at most once every ``ttl`` seconds. A failed sync also
+        counts, so an unreachable backend is not retried on every call.
+
+        With ``wait=False`` the sync runs in a background thread and 0 is
+        returned (a user's own ratings are counted from the spool).
+        """
+        if self._synced_at is not None and time.monotonic() - self._synced_at <= ttl:
+            return 0
+        if wait:
+            return self._sync_or_mark(backend)
+        if self._background is None or not self._background.is_alive():
+            self._background = threading.Thread(
+                target=self._sync_quietly, args=(backend,), name="pair-ratings-sync", daemon=True
+            )
+            self._background.start()
+        return 0
+
+    def _sync_or_mark(self, backend) -> int:
+        try:
+            return self.sync(backend)
+        except Exception:
+            self._synced_at = time.monotonic()
+            raise
+
+    def _sync_quietly(self, backend):
+        try:
+            self._sync_or_mark(backend)
+        except Exception:
+            pass  # retried after the ttl
+
+    def _add(self, counts: Dict[Tuple[str, str], Counter], last_id, spool_seq=None):
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO pair_ratings (chosen, recommended, bad, medium, good)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (chosen, recommended) DO UPDATE SET
+                    bad = bad + excluded.bad,
+                    medium = medium + excluded.medium,
+                    good = good + excluded.good
+                """,
+                [
+                    (chosen, recommended, c["bad"], c["medium"], c["good"])
+                    for (chosen, recommended), c in counts.items()
+                ],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('last_id', ?)",
+                (last_id,),
+            )
+            if spool_seq is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('spool_seq', ?)",
+                    (spool_seq,),
+                )
+
+    def _spooled_counts(self, chosen: str) -> Dict[str, Counter]:
+        """Counts of ``chosen``'s pairs in the spooled rows the counters do not include yet."""
+        if self.spool is None:
+            return {}
+        # Never synced: the counters include none of the spooled rows
+        rows = self.spool.rows_after(chosen, self._state("spool_seq") or 0)
+        return {recommended: c for (_, recommended), c in _count_pairs(rows).items()}
+
+    def get(self, chosen: str, recommended: str) -> Tuple[int, int, int]:
+        """(bad, medium, good) of one pair."""
+        return self.get_many(chosen, [recommended]).get(str(recommended), (0, 0, 0))
+
+    def get_many(self, chosen: str, recommended: Sequence[str]) -> Dict[str, Tuple[int, int, int]]:
+        """(bad, medium, good) of every rated pair (chosen, r) for r in ``recommended``."""
+        recommended = [str(r) for r in recommended]
+        if not recommended:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT recommended, bad, medium, good FROM pair_ratings "
+                f"WHERE chosen = ? AND recommended IN ({', '.join('?' * len(recommended))})",
+                (str(chosen), *recommended),
+            ).fetchall()
+        counts = {r: (bad, medium, good) for r, bad, medium, good in rows}
+        for r, c in self._spooled_counts(str(chosen)).items():
+            if r in recommended:
+                bad, medium, good = counts.get(r, (0, 0, 0))
+                counts[r] = (bad + c["bad"], medium + c["medium"], good + c["good"])
+        return counts
+
+
+def _count_pairs(rows: List[dict]) -> Dict[Tuple[str, str], Counter]:
+    """Rating counts per (artigo_escolhido, artigo_j) in a page of feedback rows."""
+    counts: Dict[Tuple[str, str], Counter] = {}
+    for row in rows:
+        chosen = row.get("artigo_escolhido")
+        if chosen is None:
+            continue
+        for j in range(1, N_RATED + 1):
+            recommended = row.get(f"artigo_{j}")
+            column = RATING_COLUMNS.get(row.get(f"avaliacao_{j}"))
+            if recommended is None or column is None:
+                continue
+            counts.setdefault((str(chosen), str(recommended)), Counter())[column] += 1
+    return counts
@@ -0,0 +1,94 @@
+"""
+Manifest of the product images under ``Files/file1..3``.
+
+One directory scan maps every image stem (the ``image_name``) to its file,
+so a lookup is a dict access instead of up to 18 ``Path.exists()`` calls.
+When a stem has several files the one ``find_image_path`` used to return
+wins: first directory in ``IMAGE_DIRS`` order, then first extension in
+``IMAGE_EXTENSIONS`` order.
+
+Usage
+-----
+    python image_manifest.py          # summary + duplicated stems
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+FILES_DIR = BASE_DIR / "Files"
+IMAGE_DIRS = [FILES_DIR / "file1", FILES_DIR / "file2", FILES_DIR / "file3"]
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp", ".JPG", ".PNG"]
+
+
+def dirs_signature(dirs: Sequence[Path] = IMAGE_DIRS) -> Tuple:
+    """
+    (directory, mtime) pairs; adding, removing or renaming a file changes
+    the mtime of its directory, so this works as a cache key.
+    """
+    signature = []
+    for folder in dirs:
+        try:
+            signature.append((str(folder), os.stat(folder).st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((str(folder), None))
+    return tuple(signature)
+
+
+class ImageManifest:
+    """stem -> image path, plus every candidate file of the duplicated stems."""
+
+    def __init__(self, paths: Dict[str, Path], duplicates: Dict[str, List[Path]]):
+        self.paths = paths
+        self.duplicates = duplicates
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get(self, image_name: str) -> Optional[Path]:
+        return self.paths.get(image_name)
+
+
+def build_manifest(
+    dirs: Sequence[Path] = IMAGE_DIRS,
+    extensions: Sequence[str] = IMAGE_EXTENSIONS,
+) -> ImageManifest:
+    """Scan ``dirs`` once and keep the preferred file of every stem."""
+    ext_rank = {ext: i for i, ext in enumerate(extensions)}
+    candidates: Dict[str, List[Tuple[int, int, Path]]] = {}
+
+    for dir_rank, folder in enumerate(dirs):
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                if ext not in ext_rank:
+                    continue
+                candidates.setdefault(stem, []).append(
+                    (dir_rank, ext_rank[ext], Path(entry.path))
+                )
+
+    paths = {}
+    duplicates = {}
+    for stem, files in candidates.items():
+        files.sort(key=lambda f: (f[0], f[1]))
+        paths[stem] = files[0][2]
+        if len(files) > 1:
+            duplicates[stem] = [f[2] for f in files]
+    return ImageManifest(paths, duplicates)
+
+
+def main():
+    manifest = build_manifest()
+    print(f"{len(manifest)} images in {', '.join(str(d.relative_to(BASE_DIR)) for d in IMAGE_DIRS)}")
+    print(f"{len(manifest.duplicates)} stems with more than one file (first one is used):")
+    for stem, files in sorted(manifest.duplicates.items()):
+        print(f"  {stem}: {', '.join(str(f.relative_to(BASE_DIR)) for f in files)}")
+
+
+if __name__ == "__main__":
+    main()
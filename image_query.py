@@ -0,0 +1,267 @@
+"""
+Query by image: embed an arbitrary photo and search the catalogue.
+
+An encoder turns a decoded PIL image into an L2-normalised vector in the
+space of the catalogue embeddings. It runs in two stages, so their
+latencies can be measured separately: ``preprocess`` (resize / crop /
+normalise) and ``encode`` (the model). Encoders:
+
+- ``clip``     – OpenAI CLIP (torch), the model that produced the catalogue
+  embeddings (see ``clip_embeddings.py``);
+- ``onnx``     – the same image tower exported to ONNX (``--export-onnx``)
+  and run with onnxruntime, with NumPy preprocessing;
+- ``stand-in`` – a small deterministic projection of the pixels (no
+  model, no extra dependency). Its vectors are not CLIP vectors: it only
+  exercises the pipeline, e.g. in tests or without torch.
+
+An encoder is loaded once per process and warmed up with one dummy
+image, so the first real query does not pay for lazy initialisation.
+The app does this in a background thread when the photo search is opened.
+
+Usage
+-----
+    python image_query.py photo.jpg --encoder stand-in --k 4 --repeat 20
+    python image_query.py --export-onnx data/clip_visual.onnx
+"""
+import argparse
+import io
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ann_index import exact_search
+from clip_embeddings import CLIP_MODEL, load_clip
+from embedding_store import EMBEDDINGS_NPY, open_embeddings
+
+BASE_DIR = Path(__file__).resolve().parent
+ONNX_PATH = BASE_DIR / "data" / "clip_visual.onnx"
+
+# CLIP input resolution and normalisation
+INPUT_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+# Per-stage latency targets (ms) on one CPU query
+LATENCY_TARGETS_MS = {"decode": 20, "preprocess": 15, "encode": 150, "search": 10}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-9, None)
+
+
+def clip_preprocess(image: Image.Image, size: int = INPUT_SIZE) -> np.ndarray:
+    """CLIP's preprocessing in NumPy: (3, size, size) float32."""
+    image = image.convert("RGB")
+    scale = size / min(image.size)
+    image = image.resize(
+        (max(size, round(image.width * scale)), max(size, round(image.height * scale))),
+        Image.BICUBIC,
+    )
+    left, top = (image.width - size) // 2, (image.height - size) // 2
+    image = image.crop((left, top, left + size, top + size))
+    pixels = np.asarray(image, dtype=np.float32) / 255.0
+    return ((pixels - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1)
+
+
+# -------------------------------------------------
+# Encoders
+# -------------------------------------------------
+class ClipEncoder:
+    """CLIP image tower on the CPU (torch)."""
+
+    name = "clip"
+
+    def __init__(self, model_name: str = CLIP_MODEL, threads: Optional[int] = None):
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model, self._preprocess = load_clip(model_name)
+        self.dim = self.model.visual.output_dim
+
+    def preprocess(self, image: Image.Image):
+        return self._preprocess(image.convert("RGB")).unsqueeze(0)
+
+    def encode(self, batch) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            return _normalize(self.model.encode_image(batch).float().numpy()[0])
+
+
+class OnnxClipEncoder:
+    """CLIP image tower exported to ONNX (see ``export_onnx``), run with onnxruntime."""
+
+    name = "onnx"
+
+    def __init__(self, onnx_path: Path = ONNX_PATH, threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def preprocess(self, image: Image.Image) -> np.ndarray:
+        return clip_preprocess(image)[None]
+
+    def encode(self, batch: np.ndarray) -> np.ndarray:
+        return _normalize(self.session.run(None, {self.input_name: batch})[0][0])
+
+
+class StandInEncoder:
+    """
+    Deterministic stand-in: a 16x16 RGB thumbnail times a fixed random
+    projection. Fast and dependency-free, but not a CLIP embedding.
+    """
+
+    name = "stand-in"
+
+    def __init__(self, dim: int = 512, side: int = 16, seed: int = 0):
+        self.dim = dim
+        self.side = side
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((3 * side * side, dim)).astype(np.float32)
+
+    def preprocess(self, image: Image.Image) -> np.ndarray:
+        thumb = image.convert("RGB").resize((self.side, self.side), Image.BILINEAR)
+        pixels = np.asarray(thumb, dtype=np.float32).reshape(-1) / 255.0
+        return pixels - pixels.mean()
+
+    def encode(self, batch: np.ndarray) -> np.ndarray:
+        return _normalize(batch @ self.projection)
+
+
+ENCODERS = {"clip": ClipEncoder, "onnx": OnnxClipEncoder, "stand-in": StandInEncoder}
+
+
+def load_encoder(name: str = "clip", warm_up: bool = True, **options):
+    """Create the encoder ``name`` (see ``ENCODERS``) and run one dummy image through it."""
+    if name not in ENCODERS:
+        raise ValueError(f"encoder must be one of {sorted(ENCODERS)}, got {name!r}")
+    encoder = ENCODERS[name](**options)
+    if warm_up:
+        encoder.encode(encoder.preprocess(Image.new("RGB", (INPUT_SIZE, INPUT_SIZE), "white")))
+    return encoder
+
+
+def export_onnx(onnx_path: Path = ONNX_PATH, model_name: str = CLIP_MODEL, opset: int = 17) -> Path:
+    """Export CLIP's image tower to ONNX (needs torch and clip)."""
+    import torch
+
+    model, _ = load_clip(model_name)
+    visual = model.visual.float()
+    onnx_path = Path(onnx_path)
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+    dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    torch.onnx.export(
+        visual, dummy, str(onnx_path), input_names=["image"], output_names=["embedding"],
+        dynamic_axes={"image": {0: "batch"}, "embedding": {0: "batch"}}, opset_version=opset,
+    )
+    return onnx_path
+
+
+# -------------------------------------------------
+# Query
+# -------------------------------------------------
+def search_by_image(
+    encoder,
+    image_bytes: bytes,
+    vectors,
+    k: int = 4,
+    allowed: Optional[np.ndarray] = None,
+    index=None,
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+    """
+    Top-``k`` catalogue rows for a photo.
+
+    ``vectors`` are the catalogue embeddings (rows of the result table);
+    with an ``IVFIndex`` as ``index`` its approximate search is used
+    instead of the exact one. Returns (rows, scores, timings), timings in
+    ms per stage: decode, preprocess, encode, search.
+    """
+    timings = {}
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    timings["decode"] = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    batch = encoder.preprocess(image)
+    timings["preprocess"] = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    query = encoder.encode(batch)
+    timings["encode"] = 1000 * (time.perf_counter() - start)
+    if len(query) != vectors.shape[1]:
+        raise ValueError(
+            f"the {encoder.name} encoder gives {len(query)}-d vectors, "
+            f"the catalogue has {vectors.shape[1]}-d embeddings"
+        )
+
+    start = time.perf_counter()
+    if index is not None:
+        rows, scores = index.search(query, k=k, allowed=allowed)
+    else:
+        rows, scores = exact_search(vectors, query, k=k, allowed=allowed)
+    timings["search"] = 1000 * (time.perf_counter() - start)
+    return rows, scores, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the catalogue with a photo and time every stage.")
+    parser.add_argument("images", type=Path, nargs="*")
+    parser.add_argument("--embeddings", type=Path, default=EMBEDDINGS_NPY)
+    parser.add_argument("--encoder", choices=sorted(ENCODERS), default="clip")
+    parser.add_argument("--onnx", type=Path, default=ONNX_PATH, help="Model of the onnx encoder.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads of the model (default: the library's).")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=10, help="Queries per image, for latency.")
+    parser.add_argument("--export-onnx", type=Path, default=None, metavar="PATH",
+                        help="Only export CLIP's image tower to ONNX.")
+    args = parser.parse_args(argv)
+
+    if args.export_onnx:
+        print(f"Exported {export_onnx(args.export_onnx)}")
+        return
+
+    store = open_embeddings(args.embeddings)
+    vectors = np.asarray(store.vectors, dtype=np.float32)
+    options = {"dim": vectors.shape[1]} if args.encoder == "stand-in" else {"threads": args.threads}
+    if args.encoder == "onnx":
+        options["onnx_path"] = args.onnx
+
+    start = time.perf_counter()
+    encoder = load_encoder(args.encoder, **options)
+    print(f"Loaded and warmed up the {args.encoder} encoder in {time.perf_counter() - start:.2f}s")
+
+    stages = {stage: [] for stage in LATENCY_TARGETS_MS}
+    for path in args.images:
+        image_bytes = path.read_bytes()
+        for _ in range(args.repeat):
+            rows, scores, timings = search_by_image(encoder, image_bytes, vectors, k=args.k)
+            for stage, ms in timings.items():
+                stages[stage].append(ms)
+        matches = ", ".join(f"{store.names[r]} ({s:.3f})" for r, s in zip(rows, scores))
+        print(f"{path.name}: {matches}")
+
+    if args.images:
+        for stage, values in stages.items():
+            target = LATENCY_TARGETS_MS[stage]
+            p50, p95 = np.percentile(values, [50, 95])
+            print(f"  {stage:<10} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  "
+                  f"target {target} ms {'ok' if p95 <= target else 'OVER'}")
+
+
+if __name__ == "__main__":
+    main()
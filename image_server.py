@@ -0,0 +1,120 @@
+"""
+Small static server for the card images, with long-lived cache headers.
+
+Streamlit's static route (``app/static/``) serves ``static/thumbs/`` too,
+but without a ``Cache-Control`` header, so browsers revalidate the
+images. The variant names contain the SHA-1 of the original image (see
+``thumbnails.py``), so a URL never changes content: this server sends
+them as ``public, max-age=31536000, immutable``, and a repeat view costs
+no request at all. It only serves files that already exist (no
+rendering) and answers ``If-None-Match`` with 304.
+
+The app starts it in a background thread when ``IMAGE_SERVER_PORT`` is
+set; ``IMAGE_BASE_URL`` is the URL the browser uses to reach it
+(default ``http://localhost:<port>``, e.g. a path of the reverse proxy).
+It listens on 127.0.0.1 only (``IMAGE_SERVER_HOST`` / ``--host`` to
+change that). If the port cannot be bound, the app falls back to
+Streamlit's static route.
+
+Usage
+-----
+    python image_server.py --port 8502
+    IMAGE_SERVER_PORT=8502 streamlit run Parfois_Similar.py
+"""
+import argparse
+import os
+import posixpath
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from thumbnails import STATIC_THUMBNAIL_DIR
+
+DEFAULT_HOST = os.environ.get("IMAGE_SERVER_HOST", "127.0.0.1")
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_TYPES = {".jpg": "image/jpeg", ".webp": "image/webp"}
+
+
+def make_handler(root: Path = STATIC_THUMBNAIL_DIR):
+    """Request handler class serving the variants under ``root``."""
+    root = Path(root).resolve()
+
+    class ImageHandler(BaseHTTPRequestHandler):
+        def _resolve(self):
+            path = posixpath.normpath(unquote(urlsplit(self.path).path)).lstrip("/")
+            file_path = (root / path).resolve()
+            # Content-hashed image files only, nothing outside root
+            if root not in file_path.parents or file_path.suffix not in CONTENT_TYPES:
+                return None
+            return file_path if file_path.is_file() else None
+
+        def _send_head(self):
+            file_path = self._resolve()
+            if file_path is None:
+                self.send_error(404)
+                return None
+            # The name is the content hash: the ETag is the name
+            etag = f'"{file_path.stem}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", CACHE_CONTROL)
+                self.end_headers()
+                return None
+            stat = file_path.stat()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPES[file_path.suffix])
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            return file_path
+
+        def do_HEAD(self):
+            self._send_head()
+
+        def do_GET(self):
+            file_path = self._send_head()
+            if file_path is not None:
+                self.wfile.write(file_path.read_bytes())
+
+        def log_message(self, format, *args):
+            pass
+
+    return ImageHandler
+
+
+def start_server(port: int, host: str = DEFAULT_HOST, root: Path = STATIC_THUMBNAIL_DIR) -> ThreadingHTTPServer:
+    """
+    Serve ``root`` on (host, port) from a daemon thread; returns the server.
+    Raises ``OSError`` if the address cannot be bound (e.g. port in use).
+    """
+    Path(root).mkdir(parents=True, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), make_handler(root))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="image-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the card images with immutable cache headers.")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("IMAGE_SERVER_PORT", 8502)))
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Use 0.0.0.0 to listen on every interface.")
+    parser.add_argument("--root", type=Path, default=STATIC_THUMBNAIL_DIR)
+    args = parser.parse_args(argv)
+
+    args.root.mkdir(parents=True, exist_ok=True)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.root))
+    print(f"Serving {args.root} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Time and peak memory of the neighbour stage on synthetic catalogues.
+
+Every catalogue is one ``DES_CONC`` group of ``n`` random unit vectors
+(the worst case: all-pairs inside the group), with two images per
+``PROD_REF``. Every size runs in a fresh process, which reports:
+
+- parent peak: the largest amount of memory allocated by that process
+  during ``compute_neighbours`` (``tracemalloc``; NumPy reports its arrays
+  to it). With ``--workers 1`` this is the whole neighbour stage;
+- worker RSS: with ``--workers N`` the in-group stage runs in worker
+  processes, which ``tracemalloc`` does not see; this is the peak resident
+  set size of the largest worker (``getrusage(RUSAGE_CHILDREN)``, so it
+  includes the interpreter and NumPy, and the memory-mapped matrix pages
+  it touched). Not available on Windows.
+
+Both are shown next to the matrix itself and what one dense n x n float64
+similarity matrix, as built by the notebook's ``cosine_similarity``, would
+take.
+
+Usage
+-----
+    python knn_benchmark.py                          # 10k .. 500k items
+    python knn_benchmark.py --sizes 10000 50000 --memory-budget-mb 128
+    python knn_benchmark.py --sizes 50000 --workers 4
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional, Tuple
+
+import numpy as np
+
+from similarity_engine import GRAPH_K, MEMORY_BUDGET_MB, compute_neighbours
+
+SIZES = [10_000, 50_000, 100_000, 200_000, 500_000]
+DIM = 512
+
+
+def synthetic_catalogue(n: int, dim: int = DIM, n_clusters: int = 200, seed: int = 0):
+    """Unit vectors around ``n_clusters`` centres, so the catalogue has real near neighbours."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n)] + 0.8 * rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    groups = np.full(n, "Synthetic_Group", dtype=object)
+    prod_refs = np.arange(n) // 2
+    image_names = np.array([f"img_{i}" for i in range(n)], dtype=object)
+    return vectors, groups, prod_refs, image_names
+
+
+def _peak_child_rss() -> Optional[int]:
+    """Peak RSS in bytes of the largest waited-for child process (None on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(n: int, graph_k: int, memory_budget_mb: float, workers: int) -> Tuple[float, int, Optional[int], int]:
+    """
+    Run the neighbour stage on a catalogue of ``n`` items; returns (seconds,
+    parent peak bytes, worker peak RSS bytes or None, matrix bytes). Meant
+    to run in a fresh process, so the worker RSS belongs to this run only.
+    """
+    vectors, groups, prod_refs, image_names = synthetic_catalogue(n)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    compute_neighbours(
+        vectors, groups, prod_refs, image_names,
+        top_k=graph_k, max_neighbours=graph_k,
+        workers=workers, memory_budget_mb=memory_budget_mb,
+    )
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, _peak_child_rss() if workers > 1 else None, vectors.nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tiled neighbour stage on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--graph-k", type=int, default=GRAPH_K)
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{args.workers} worker(s)")
+    print(f"{'items':>9} {'time':>9} {'parent peak MB':>15} {'worker RSS MB':>14} "
+          f"{'matrix MB':>10} {'dense float64 GB':>17}")
+    for n in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            elapsed, peak, worker_rss, matrix_bytes = pool.submit(
+                measure, n, args.graph_k, args.memory_budget_mb, args.workers
+            ).result()
+
+        worker = f"{worker_rss / 1e6:.0f}" if worker_rss is not None else "-"
+        print(f"{n:>9} {elapsed:>8.1f}s {peak / 1e6:>15.0f} {worker:>14} "
+              f"{matrix_bytes / 1e6:>10.0f} {n * n * 8 / 1e9:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
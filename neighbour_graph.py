@@ -0,0 +1,78 @@
+"""
+Compact neighbour graph written by ``similarity_engine.py``.
+
+``data/neighbours.npz`` holds, for every row of ``result_df.csv``:
+
+- ``indices`` – (n, K) int32 row positions of its neighbours, best first
+  (-1 = no neighbour);
+- ``scores``  – (n, K) float16 cosine similarities (NaN = no neighbour);
+- ``image_names`` – the ``image_name`` of every row, to check that the
+  graph matches the CSV it is loaded with.
+
+The first 4 neighbours of a row are the ``similar_image_1..4`` of the CSV;
+the rest continue the same ranking up to K (at most ``MAX_GRAPH_K``).
+"""
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent
+NEIGHBOURS_NPZ = BASE_DIR / "data" / "neighbours.npz"
+
+MAX_GRAPH_K = 50
+
+
+class NeighbourGraph:
+    """Neighbour rows and scores of every catalogue row, read with O(1) indexing."""
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray, image_names: np.ndarray):
+        if indices.shape != scores.shape or len(indices) != len(image_names):
+            raise ValueError("Neighbour graph arrays have inconsistent shapes")
+        self.indices = indices
+        self.scores = scores
+        self.image_names = image_names
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+
+    def matches(self, image_names) -> bool:
+        """True if the graph rows are the given image names, in the same order."""
+        image_names = np.asarray(image_names, dtype=str)
+        return len(image_names) == len(self) and bool((image_names == self.image_names).all())
+
+    def neighbours(self, row: int, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions and scores of the first ``k`` neighbours of ``row``."""
+        idx = self.indices[row, :k]
+        valid = idx >= 0
+        return idx[valid], self.scores[row, :k][valid].astype(np.float32)
+
+
+def save_graph(
+    npz_path: Path,
+    image_names,
+    indices: np.ndarray,
+    scores: np.ndarray,
+    k: Optional[int] = None,
+) -> Path:
+    """Save the first ``k`` columns of the neighbour arrays as int32 / float16."""
+    k = min(k or indices.shape[1], MAX_GRAPH_K)
+
+    npz_path = Path(npz_path)
+    npz_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(
+        npz_path,
+        indices=indices[:, :k].astype(np.int32),
+        scores=scores[:, :k].astype(np.float16),
+        image_names=np.asarray(image_names, dtype=str),
+    )
+    return npz_path
+
+
+def load_graph(npz_path: Path = NEIGHBOURS_NPZ) -> NeighbourGraph:
+    with np.load(npz_path) as data:
+        return NeighbourGraph(data["indices"], data["scores"], data["image_names"])
@@ -1,16 +1,46 @@
-import streamlit as st
+import time
 from pathlib import Path
 
+import pandas as pd
+import streamlit as st
+
+from eda_cubes import ALL_GROUPS, CUBES, EDA_DIR, cube_path, read_cubes
+from result_table import data_version
+
 # -------------------------------------------------
 # Paths
 # -------------------------------------------------
 BASE_DIR = Path(__file__).resolve().parent.parent
 LOGO_PATH = BASE_DIR / "parfois.png"
 
+# Bars shown per chart; the remaining groups are summed into one bar
+MAX_GROUPS = 25
+
 # -------------------------------------------------
 # Page config
 # -------------------------------------------------
 st.set_page_config(page_title="PARFOIS – EDA", layout="wide")
+render_start = time.perf_counter()
+
+
+# -------------------------------------------------
+# Data: precomputed cubes (see eda_cubes.py)
+# -------------------------------------------------
+@st.cache_data
+def load_cubes(cube_dir: Path, version: tuple) -> dict:
+    # Small tables, cached per version (file mtimes) of the cubes
+    return read_cubes(cube_dir)
+
+
+def top_groups(cube: pd.DataFrame, value: str, n: int = MAX_GROUPS) -> pd.DataFrame:
+    """The ``n`` largest groups by ``value``, the rest summed as "Other groups"."""
+    cube = cube.sort_values(value, ascending=False)
+    head, tail = cube.head(n), cube.iloc[n:]
+    if len(tail):
+        rest = tail.select_dtypes("number").sum().to_frame().T
+        rest["DES_CONC"] = f"Other groups ({len(tail)})"
+        head = pd.concat([head, rest], ignore_index=True)
+    return head
 
 # -------------------------------------------------
 # Header (same style as main page)
@@ -54,4 +84,39 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-st.info("This section is **in development**. Future work will include EDA for products, sales and similarity scores.")
+cubes = load_cubes(EDA_DIR, data_version(*(cube_path(name) for name in CUBES)))
+if not cubes:
+    st.info("No EDA tables found. Run `python eda_cubes.py` to precompute them from the result table and the sales.")
+    st.stop()
+
+if "sales_by_group" in cubes:
+    st.markdown("### Sales by DES_CONC")
+    sales = top_groups(cubes["sales_by_group"], "sales_amount")
+    col_amount, col_price = st.columns(2)
+    with col_amount:
+        st.caption("Sales amount")
+        st.bar_chart(sales, x="DES_CONC", y="sales_amount", horizontal=True, sort="-sales_amount")
+    with col_price:
+        st.caption("Mean unit price")
+        st.bar_chart(sales, x="DES_CONC", y="mean_price", horizontal=True, sort="-mean_price")
+
+if "group_sizes" in cubes:
+    st.markdown("### Group sizes")
+    sizes = top_groups(cubes["group_sizes"], "n_images")
+    st.bar_chart(sizes, x="DES_CONC", y=["n_images", "n_prod_refs"], horizontal=True, stack=False)
+
+if "price_hist" in cubes:
+    st.markdown("### Price distribution")
+    price_hist = cubes["price_hist"]
+    groups = [ALL_GROUPS] + sorted(g for g in price_hist["DES_CONC"].unique() if g != ALL_GROUPS)
+    group = st.selectbox("DES_CONC", groups, key="eda_price_group")
+    hist = price_hist[price_hist["DES_CONC"] == group]
+    st.bar_chart(hist.assign(price=hist["price_from"].round(2)), x="price", y="count")
+
+if "similarity_hist" in cubes:
+    st.markdown("### Similarity scores by rank")
+    sim = cubes["similarity_hist"].pivot(index="score_from", columns="rank", values="count")
+    sim.columns = [f"rank {rank}" for rank in sim.columns]
+    st.line_chart(sim[sim.sum(axis=1) > 0])
+
+st.caption(f"Rendered in {1000 * (time.perf_counter() - render_start):.0f} ms")
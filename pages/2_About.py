@@ -121,6 +121,12 @@ st.write(
     3. This price is mapped back to each `image_name`, giving a `Price` column.
     4. Optionally, the notebook also computes an `Avg_Similar_Price` per product,
        based on the prices of its neighbours.
+
+    The offline engine (`similarity_engine.py`) averages the same neighbours as
+    the notebook: all neighbours of the same group with similarity ≥ 0.90, or
+    the first 4 when there are fewer. It only knows the neighbours kept in `neighbours.npz`
+    (12 by default, `--graph-k`), so a product with more neighbours ≥ 0.90 is
+    averaged over its first 12.
     """
 )
 
@@ -156,7 +162,9 @@ st.write(
       - `similarity_score_k`.
 
     This table is exported as **`result_df.csv`**, which is the main data source
-    used by this Streamlit app.
+    used by this Streamlit app. Alongside it, `neighbours.npz` keeps a longer
+    ranked list of neighbours per product (e.g. the top 12), so the app can
+    show more than 4 similar products without recomputing anything.
     """
 )
 
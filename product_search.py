@@ -0,0 +1,133 @@
+"""
+Server-side product search for the app's product picker.
+
+Instead of sending every ``display_label`` to the browser as selectbox
+options, the app keeps an inverted index over the tokens of
+``image_name``, ``PROD_REF_STR`` and ``DES_CONC`` and sends only the best
+matches of what was typed.
+
+The index is three arrays (CSR layout): the sorted distinct tokens, and
+for every token the rows that contain it. Because the tokens are sorted,
+all tokens starting with a prefix are one contiguous range (found with
+two binary searches) and their rows one contiguous slice of
+``postings``. Every query term is a prefix; a row matches when it
+matches all the terms. Rows where more terms match a whole token come
+first, then rows in label order.
+
+Usage
+-----
+    python product_search.py "140486 bags"
+"""
+import argparse
+import re
+import time
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from result_table import RESULT_CSV, RESULT_PARQUET, read_result_table
+
+SEARCH_COLUMNS = ["image_name", "PROD_REF_STR", "DES_CONC"]
+SEARCH_LIMIT = 50
+
+_TOKEN_SPLIT = re.compile(r"[^0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case alphanumeric tokens ("140486_BM_1" -> 140486, bm, 1)."""
+    return [token for token in _TOKEN_SPLIT.split(str(text).lower()) if token]
+
+
+class ProductSearchIndex:
+    """Prefix search over the tokens of the search columns of the result table."""
+
+    def __init__(self, df: pd.DataFrame, columns=SEARCH_COLUMNS):
+        self.labels = df["display_label"].astype(str).to_numpy()
+        # Rank of every row in label order (ties: first row first)
+        order = np.argsort(self.labels, kind="stable")
+        self.label_rank = np.empty(len(order), dtype=np.int64)
+        self.label_rank[order] = np.arange(len(order))
+        self._by_label = order
+
+        parts = []
+        for col in columns:
+            if col not in df.columns:
+                continue
+            tokens = (
+                df[col].astype(str).str.lower()
+                .str.split(_TOKEN_SPLIT.pattern, regex=True)
+                .explode()
+            )
+            parts.append(pd.DataFrame({"token": tokens.to_numpy(), "row": tokens.index.to_numpy()}))
+        pairs = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame({"token": [], "row": []})
+        pairs = pairs[pairs["token"].fillna("") != ""].drop_duplicates()
+        pairs = pairs.sort_values(["token", "row"], kind="stable")
+
+        # Row positions, not index labels, in case df has a custom index
+        positions = pd.Series(np.arange(len(df)), index=df.index)
+        tokens = pairs["token"].to_numpy(dtype=str)
+        self.tokens, starts = np.unique(tokens, return_index=True)
+        self.offsets = np.append(starts, len(tokens)).astype(np.int64)
+        self.postings = positions.loc[pairs["row"]].to_numpy(dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def _prefix_range(self, term: str) -> Tuple[int, int]:
+        lo = int(np.searchsorted(self.tokens, term, side="left"))
+        hi = int(np.searchsorted(self.tokens, term + "\U0010ffff", side="left"))
+        return lo, hi
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> Tuple[np.ndarray, int]:
+        """
+        Best ``limit`` rows for ``query`` and the number of matching rows.
+
+        An empty query returns the first rows in label order (all rows match).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return self._by_label[:limit], len(self)
+
+        matched = np.ones(len(self), dtype=bool)
+        exact = np.zeros(len(self), dtype=np.int64)
+        for term in terms:
+            lo, hi = self._prefix_range(term)
+            # Rows of all tokens with this prefix: one slice, no sort needed
+            term_rows = np.zeros(len(self), dtype=bool)
+            term_rows[self.postings[self.offsets[lo]:self.offsets[hi]]] = True
+            matched &= term_rows
+            if lo < hi and self.tokens[lo] == term:
+                exact[self.postings[self.offsets[lo]:self.offsets[lo + 1]]] += 1
+
+        rows = np.flatnonzero(matched)
+        # More whole-token matches first, then label order, as one sort key
+        key = (len(terms) - exact[rows]) * len(self) + self.label_rank[rows]
+        if len(rows) > limit:
+            top = np.argpartition(key, limit)[:limit]
+            rows, key = rows[top], key[top]
+        return rows[np.argsort(key, kind="stable")], int(matched.sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the product search index and time it.")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    args = parser.parse_args(argv)
+
+    df = read_result_table(RESULT_PARQUET, RESULT_CSV)
+    start = time.perf_counter()
+    index = ProductSearchIndex(df)
+    print(f"Indexed {len(index)} rows, {len(index.tokens)} tokens in {time.perf_counter() - start:.2f}s")
+
+    for query in args.queries:
+        start = time.perf_counter()
+        rows, n_matches = index.search(query, args.limit)
+        elapsed = time.perf_counter() - start
+        print(f"{query!r}: {n_matches} matches in {1000 * elapsed:.2f} ms")
+        for row in rows[:5]:
+            print(f"  {index.labels[row]}")
+
+
+if __name__ == "__main__":
+    main()
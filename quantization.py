@@ -0,0 +1,359 @@
+"""
+Quantized embedding matrices (opt-in) and their recall / drift report.
+
+Modes, for L2-normalised 512-d CLIP vectors:
+
+- ``float32`` – exact (2048 bytes per vector);
+- ``float16`` – half precision (1024 bytes);
+- ``int8``    – one int8 per dimension with a per-dimension scale (512 bytes);
+- ``pq``      – product quantization: ``m`` sub-vectors, each replaced by
+  the id of its closest of 256 centroids (``m`` bytes, 64 by default).
+
+A ``QuantizedMatrix`` keeps only the codes and stands in for the float32
+matrix where the engine and the ANN index use it:
+
+- ``matrix[rows]`` with integer rows decodes those rows to float32
+  (the engine's tiles);
+- ``matrix[lo:hi]`` is a quantized view and ``view @ query`` scores it
+  without decoding (the ANN lists; asymmetric distance tables for PQ).
+
+Usage
+-----
+    python quantization.py --embeddings data/embeddings.npy --products data/df_product.csv
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from embedding_store import EMBEDDINGS_NPY, open_embeddings
+
+QUANTIZATION_MODES = ("float32", "float16", "int8", "pq")
+PQ_SUBSPACES = 64
+PQ_CENTROIDS = 256
+SCORE_BLOCK = 4096  # rows decoded at once when scoring a whole matrix
+
+
+# -------------------------------------------------
+# Codecs
+# -------------------------------------------------
+class Float16Codec:
+    bits = 16
+
+    def fit(self, vectors: np.ndarray) -> "Float16Codec":
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float16)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return _blocked_scores(self, codes, query)
+
+    @property
+    def nbytes(self) -> int:
+        return 0
+
+
+class Int8Codec:
+    """x ~ code * scale, with one scale per dimension (max |x| / 127)."""
+
+    def __init__(self):
+        self.scale: Optional[np.ndarray] = None
+
+    def fit(self, vectors: np.ndarray) -> "Int8Codec":
+        self.scale = np.abs(vectors).max(axis=0).astype(np.float32) / 127
+        self.scale[self.scale == 0] = 1.0
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # (code * scale) . q == code . (scale * q)
+        scaled = np.asarray(query, dtype=np.float32) * self.scale
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK):
+            out[start:start + SCORE_BLOCK] = codes[start:start + SCORE_BLOCK].astype(np.float32) @ scaled
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return self.scale.nbytes
+
+
+class PQCodec:
+    """
+    Product quantization: the vector is cut into ``m`` sub-vectors and each
+    one is stored as the id of its nearest k-means centroid (uint8).
+    ``m`` defaults to ``PQ_SUBSPACES``, or to the dimension if smaller.
+    """
+
+    def __init__(self, m: Optional[int] = None, n_centroids: int = PQ_CENTROIDS,
+                 n_iter: int = 15, train_size: int = 20_000, seed: int = 0):
+        self.m = m
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (m, n_centroids, d / m)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, d = vectors.shape
+        if d % self.m:
+            raise ValueError(f"dimension {d} is not a multiple of m={self.m}")
+        return np.asarray(vectors, dtype=np.float32).reshape(n, self.m, d // self.m)
+
+    def fit(self, vectors: np.ndarray) -> "PQCodec":
+        if self.m is None:
+            self.m = min(PQ_SUBSPACES, vectors.shape[1])
+        rng = np.random.default_rng(self.seed)
+        train = vectors
+        if len(vectors) > self.train_size:
+            train = vectors[rng.choice(len(vectors), self.train_size, replace=False)]
+        subs = self._split(train)
+        k = min(self.n_centroids, len(train))
+        self.codebooks = np.stack([
+            _kmeans(subs[:, j], k, self.n_iter, rng) for j in range(self.m)
+        ])
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for start in range(0, len(vectors), SCORE_BLOCK):
+            subs = self._split(vectors[start:start + SCORE_BLOCK])
+            for j in range(self.m):
+                codes[start:start + SCORE_BLOCK, j] = _nearest(subs[:, j], self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.m), codes]  # (n, m, d / m)
+        return parts.reshape(len(codes), -1)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Asymmetric distance: table of <query sub-vector, centroid> per subspace
+        table = np.einsum("mkd,md->mk", self.codebooks, self._split(query[None, :])[0])
+        return table[np.arange(self.m), codes].sum(axis=1, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes
+
+
+def _kmeans(x: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    """Euclidean k-means centroids of the rows of ``x``."""
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids = np.where(empty[:, None], centroids, sums / np.maximum(counts, 1)[:, None])
+    return centroids
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest centroid (Euclidean) of every row of ``x``."""
+    distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * x @ centroids.T
+    return np.argmin(distances, axis=1)
+
+
+def _blocked_scores(codec, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+    query = np.asarray(query, dtype=np.float32)
+    out = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK):
+        out[start:start + SCORE_BLOCK] = codec.decode(codes[start:start + SCORE_BLOCK]) @ query
+    return out
+
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+# -------------------------------------------------
+# Matrix
+# -------------------------------------------------
+class QuantizedMatrix:
+    """
+    Read-only (n, d) matrix stored as codes.
+
+    Integer / array indexing decodes rows to float32; slicing returns a
+    quantized view; ``matrix @ query`` scores every row against a float32
+    query vector.
+    """
+
+    def __init__(self, codec, codes: np.ndarray, dim: int):
+        self.codec = codec
+        self.codes = codes
+        self.dim = dim
+
+    @property
+    def mode(self) -> str:
+        return next(name for name, cls in CODECS.items() if isinstance(self.codec, cls))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return len(self.codes), self.dim
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codec.nbytes
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            return QuantizedMatrix(self.codec, self.codes[rows], self.dim)
+        if np.ndim(rows) == 0:
+            return self.codec.decode(self.codes[[rows]])[0]
+        return self.codec.decode(self.codes[rows])
+
+    def take(self, rows: np.ndarray) -> "QuantizedMatrix":
+        """The given rows, still quantized."""
+        return QuantizedMatrix(self.codec, self.codes[rows], self.dim)
+
+    def __matmul__(self, query: np.ndarray) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32)
+        if query.ndim == 1:
+            return self.codec.scores(self.codes, query)
+        return np.stack([self.codec.scores(self.codes, q) for q in query.T], axis=1)
+
+    def __array__(self, dtype=None, copy=None):
+        vectors = self.codec.decode(self.codes)
+        return vectors if dtype is None else vectors.astype(dtype)
+
+
+def quantize(
+    vectors: np.ndarray,
+    mode: str = "float32",
+    train_rows: Optional[np.ndarray] = None,
+    **codec_options,
+):
+    """
+    ``vectors`` in the given mode: the float32 array itself for
+    ``float32``, else a ``QuantizedMatrix`` (the codec is trained on them,
+    or only on ``train_rows``, e.g. the rows that have an embedding).
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"mode must be one of {QUANTIZATION_MODES}, got {mode!r}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float32":
+        return vectors
+    codec = CODECS[mode](**codec_options).fit(vectors if train_rows is None else vectors[train_rows])
+    return QuantizedMatrix(codec, codec.encode(vectors), vectors.shape[1])
+
+
+# -------------------------------------------------
+# Evaluation
+# -------------------------------------------------
+def _top_k_excluding(scores: np.ndarray, row: int, k: int) -> np.ndarray:
+    scores = scores.copy()
+    scores[row] = -np.inf
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def evaluate_search(
+    vectors: np.ndarray,
+    matrix,
+    k: int = 4,
+    n_queries: int = 500,
+    seed: int = 0,
+) -> dict:
+    """
+    Brute-force search on ``matrix`` against exact float32 search, using
+    random catalogue vectors as (float32) queries.
+
+    Returns recall@k, score drift (mean / max |approximate - exact score|
+    of the returned items) and mean latency per query in ms.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    hits, drift, elapsed = 0, [], 0.0
+    for row in queries:
+        query = vectors[row]
+        exact = _top_k_excluding(vectors @ query, row, k)
+
+        start = time.perf_counter()
+        approx_scores = matrix @ query
+        approx = _top_k_excluding(approx_scores, row, k)
+        elapsed += time.perf_counter() - start
+
+        hits += len(np.intersect1d(approx, exact))
+        drift.append(np.abs(approx_scores[approx] - vectors[approx] @ query))
+    drift = np.concatenate(drift)
+    return {
+        "recall": hits / (k * len(queries)),
+        "drift_mean": float(drift.mean()),
+        "drift_max": float(drift.max()),
+        "search_ms": 1000 * elapsed / len(queries),
+    }
+
+
+def evaluate_engine(vectors: np.ndarray, matrix, products_csv: Path, image_names, top_k: int = 4) -> dict:
+    """recall@top_k of the engine's neighbour lists (all rules) against float32."""
+    import pandas as pd
+
+    from similarity_engine import build_catalogue, compute_neighbours
+
+    catalogue = build_catalogue(np.asarray(image_names), pd.read_csv(products_csv))
+    rows = catalogue["emb_row"].to_numpy()
+    args = (catalogue["DES_CONC"], catalogue["PROD_REF"], catalogue["image_name"])
+    options = dict(top_k=top_k, max_neighbours=top_k)
+
+    exact_idx, _ = compute_neighbours(vectors[rows], *args, **options)
+    start = time.perf_counter()
+    approx_idx, _ = compute_neighbours(
+        matrix[rows] if isinstance(matrix, np.ndarray) else matrix.take(rows), *args, **options
+    )
+    elapsed = time.perf_counter() - start
+
+    hits = sum(
+        len(np.intersect1d(a[a >= 0], e[e >= 0])) for a, e in zip(approx_idx, exact_idx)
+    )
+    return {"recall": hits / max(1, (exact_idx >= 0).sum()), "seconds": elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall, score drift, memory and latency of each quantization mode.")
+    parser.add_argument("--embeddings", type=Path, default=EMBEDDINGS_NPY, help="Embedding store (.npy).")
+    parser.add_argument("--products", type=Path, default=None,
+                        help="df_product.csv: also compare the engine's neighbour lists.")
+    parser.add_argument("--modes", nargs="+", choices=QUANTIZATION_MODES, default=list(QUANTIZATION_MODES))
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--pq-m", type=int, default=None,
+                        help=f"PQ sub-vectors, i.e. bytes per vector (default: {PQ_SUBSPACES} or the dimension).")
+    args = parser.parse_args(argv)
+
+    store = open_embeddings(args.embeddings)
+    vectors = np.asarray(store.vectors, dtype=np.float32)
+    print(f"{len(vectors)} vectors, {vectors.shape[1]} dims")
+
+    for mode in args.modes:
+        start = time.perf_counter()
+        matrix = quantize(vectors, mode, **({"m": args.pq_m} if mode == "pq" else {}))
+        encode_s = time.perf_counter() - start
+
+        search = evaluate_search(vectors, matrix, k=args.k, n_queries=args.queries)
+        line = (
+            f"{mode:<8} {matrix.nbytes / 1e6:7.1f} MB  encode {encode_s:5.1f}s  "
+            f"recall@{args.k}={search['recall']:.3f}  drift mean {search['drift_mean']:.4f} "
+            f"max {search['drift_max']:.4f}  search {search['search_ms']:.2f} ms"
+        )
+        if args.products is not None:
+            engine = evaluate_engine(vectors, matrix, args.products, store.names, top_k=args.k)
+            line += f"  engine recall@{args.k}={engine['recall']:.3f} ({engine['seconds']:.1f}s)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
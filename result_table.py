@@ -0,0 +1,202 @@
+"""
+Reading and writing the result table used by the app.
+
+``similarity_engine.py`` writes ``result_df.csv`` and a typed
+``result_df.parquet`` with the display columns (``PROD_REF_STR``,
+``display_label``) already computed and ``DES_CONC`` / ``Color`` / ``Sizes``
+stored as categoricals. The app reads only the columns it shows from the
+Parquet file and falls back to the CSV when the Parquet file is missing
+or older than the CSV; it never writes the Parquet file itself, so after
+the notebook rewrites the CSV run this module (or ``similarity_engine.py``)
+to regenerate it.
+
+Usage
+-----
+    python result_table.py            # CSV -> Parquet, then compare load times
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+RESULT_CSV = DATA_DIR / "result_df.csv"
+RESULT_PARQUET = DATA_DIR / "result_df.parquet"
+
+CATEGORICAL_COLUMNS = ["DES_CONC", "Color", "Sizes"]
+
+# Columns read by the app (column projection)
+APP_COLUMNS = [
+    "image_name", "PROD_REF", "PROD_REF_STR", "DES_CONC", "Color", "Sizes", "Price",
+    "display_label",
+    "similar_image_1", "similarity_score_1",
+    "similar_image_2", "similarity_score_2",
+    "similar_image_3", "similarity_score_3",
+    "similar_image_4", "similarity_score_4",
+]
+
+
+def format_prod_ref(prod_ref: pd.Series) -> pd.Series:
+    """
+    PROD_REF as a clean string: no ``.0`` for integers, "" for missing
+    values, other values unchanged.
+    """
+    numeric = pd.to_numeric(prod_ref, errors="coerce")
+    is_number = numeric.notna()
+    is_integer = is_number & np.isfinite(numeric) & (numeric % 1 == 0)
+
+    out = prod_ref.astype(str)
+    out[is_number & ~is_integer] = numeric[is_number & ~is_integer].astype(str)
+    out[is_integer] = numeric[is_integer].astype("int64").astype(str)
+    out[prod_ref.isna()] = ""
+    return out
+
+
+def add_display_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Add ``PROD_REF_STR`` and ``display_label`` ("image | PROD_REF | DES_CONC")."""
+    df["PROD_REF_STR"] = format_prod_ref(df["PROD_REF"])
+
+    label = df["image_name"].astype(str)
+    ref = df["PROD_REF_STR"]
+    label = label.where(ref == "", label + " | " + ref)
+    if "DES_CONC" in df.columns:
+        # str() of every value, as the notebook did (astype(str) keeps NaN of a categorical)
+        desc = df["DES_CONC"].astype(object).map(str)
+        label = label.where(desc == "", label + " | " + desc)
+    df["display_label"] = label
+    return df
+
+
+def write_result_parquet(df: pd.DataFrame, parquet_path: Path = RESULT_PARQUET) -> Path:
+    """
+    Write the result table with display columns and categorical dtypes.
+
+    The file is written next to ``parquet_path`` and then renamed over
+    it, so a concurrent reader never sees half a file.
+    """
+    df = add_display_columns(df.copy())
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    parquet_path = Path(parquet_path)
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = parquet_path.with_name(f"{parquet_path.name}.{os.getpid()}.tmp")
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return parquet_path
+
+
+def _is_current(parquet_path: Optional[Path], csv_path: Path) -> bool:
+    """The Parquet file exists and is not older than the CSV it was made from."""
+    if parquet_path is None or not Path(parquet_path).exists():
+        return False
+    return not Path(csv_path).exists() or (
+        Path(parquet_path).stat().st_mtime_ns >= Path(csv_path).stat().st_mtime_ns
+    )
+
+
+def read_result_table(
+    parquet_path: Optional[Path] = RESULT_PARQUET,
+    csv_path: Path = RESULT_CSV,
+    columns=APP_COLUMNS,
+) -> pd.DataFrame:
+    """
+    Read the app columns from the Parquet artifact, or from the CSV when the
+    Parquet file is missing or older than the CSV (e.g. the notebook
+    rewrote it). Nothing is written: regenerating the Parquet file is left
+    to the command line (``python result_table.py``).
+    """
+    if _is_current(parquet_path, csv_path):
+        try:
+            import pyarrow.parquet as pq
+
+            available = set(pq.read_schema(parquet_path).names)
+            return pd.read_parquet(parquet_path, columns=[c for c in columns if c in available])
+        except ImportError:
+            pass
+
+    df = pd.read_csv(csv_path, dtype={"image_name": str})
+    df = df.drop(columns=["Unnamed: 0"], errors="ignore")
+    df = df[[c for c in columns if c in df.columns]]
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    # Same column order as a Parquet read
+    df = add_display_columns(df)
+    return df[[c for c in columns if c in df.columns]]
+
+
+def data_version(*paths: Path) -> Tuple:
+    """(path, mtime, size) of the data files; changes whenever one is rewritten."""
+    version = []
+    for p in paths:
+        if Path(p).exists():
+            stat = Path(p).stat()
+            version.append((str(p), stat.st_mtime_ns, stat.st_size))
+        else:
+            version.append((str(p), None, None))
+    return tuple(version)
+
+
+class ResultLookup:
+    """
+    Positional indexes over the result table, built once per data version.
+
+    - ``row_of_label`` / ``row_of_image``: label / image_name -> first row;
+    - ``name_codes``, ``prod_codes``, ``group_codes``: integer codes of
+      image_name, PROD_REF and DES_CONC (-1 = missing) for row masks;
+    - ``prices``: float Price of every row (NaN = missing).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        labels = df["display_label"].astype(str).to_numpy()
+        self.row_of_label: Dict[str, int] = _first_rows(labels)
+        self.row_of_image: Dict[str, int] = _first_rows(df["image_name"].astype(str).to_numpy())
+
+        self.name_codes, _ = pd.factorize(df["image_name"])
+        self.prod_codes, _ = pd.factorize(df["PROD_REF"])
+        self.group_codes = (
+            pd.factorize(df["DES_CONC"])[0] if "DES_CONC" in df.columns
+            else np.full(len(df), -1)
+        )
+        self.prices = (
+            pd.to_numeric(df["Price"], errors="coerce").to_numpy(dtype=float)
+            if "Price" in df.columns else np.full(len(df), np.nan)
+        )
+
+
+def _first_rows(values: np.ndarray) -> Dict[str, int]:
+    """value -> position of its first occurrence."""
+    rows = {}
+    for i, value in enumerate(values):
+        rows.setdefault(value, i)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert result_df.csv to Parquet and compare load times.")
+    parser.add_argument("--csv", type=Path, default=RESULT_CSV)
+    parser.add_argument("--out", type=Path, default=RESULT_PARQUET)
+    args = parser.parse_args(argv)
+
+    write_result_parquet(pd.read_csv(args.csv, dtype={"image_name": str}), args.out)
+
+    for name, parquet_path in [("CSV", None), ("Parquet", args.out)]:
+        start = time.perf_counter()
+        df = read_result_table(parquet_path, args.csv)
+        elapsed = time.perf_counter() - start
+        memory_mb = df.memory_usage(deep=True).sum() / 1e6
+        print(f"{name:<8} load {1000 * elapsed:7.1f} ms   memory {memory_mb:6.1f} MB   ({len(df)} rows)")
+
+
+if __name__ == "__main__":
+    main()
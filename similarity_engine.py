@@ -0,0 +1,798 @@
+"""
+Offline similarity engine for the PARFOIS similarity app.
+
+Rebuilds ``data/result_df.csv`` (plus its typed Parquet copy) and the
+neighbour graph ``data/neighbours.npz`` from the CLIP embeddings, the product catalogue and
+the sales table. The neighbour rules are the ones of the
+"Similarity" cell in ``Parfois Similarity.ipynb``:
+
+1. Inside the item's ``DES_CONC`` group, take every item with cosine
+   similarity >= 0.90 (never the item itself nor items with the same
+   ``PROD_REF``).
+2. If fewer than 4 were found, fill up to 4 with the most similar items
+   of the group.
+3. If the group is too small for that, search the whole catalogue: first
+   the items >= 0.90, then the global top 4.
+
+Usage
+-----
+    python similarity_engine.py --embeddings data/embeddings.npy \\
+        --products df_product.csv --sales data/df_sales.csv
+    python similarity_engine.py --workers 4              # in-group stage on 4 processes
+    python similarity_engine.py --scaling 1 2 4 8        # time the neighbour stage only
+    python similarity_engine.py --quantize int8          # score int8-quantized embeddings
+
+``--embeddings`` takes an embedding store (see ``embedding_store.py``) or
+the CSV written by the notebook's CLIP cell.
+
+The rules above are applied with K = ``--graph-k`` instead of 4. The first
+4 neighbours are the same either way; they go to the ``similar_image_1..4``
+columns of the CSV, and all K go to the neighbour graph (see
+``neighbour_graph.py``). ``Avg_Similar_Price`` averages the same neighbours
+as the notebook (all in-group matches >= 0.90, or the first 4), up to K.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from embedding_store import EMBEDDINGS_NPY, open_embeddings, read_embeddings_csv
+from neighbour_graph import MAX_GRAPH_K, NEIGHBOURS_NPZ, save_graph
+from quantization import QUANTIZATION_MODES, QuantizedMatrix, quantize
+from result_table import RESULT_PARQUET, write_result_parquet
+
+# -------------------------------------------------
+# Paths and defaults
+# -------------------------------------------------
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+
+PRODUCTS_CSV = DATA_DIR / "df_product.csv"
+SALES_CSV = DATA_DIR / "df_sales.csv"
+RESULT_CSV = DATA_DIR / "result_df.csv"
+
+SIMILARITY_THRESHOLD = 0.90
+TOP_K = 4
+GRAPH_K = 12
+BLOCK_SIZE = 1024
+FALLBACK_BLOCK_SIZE = 256
+
+# Peak memory of one similarity tile; bytes per (row, column) pair of a
+# tile: float32 score + int64 argpartition indices + two boolean masks
+# (see _running_top_k), and per column the gathered float32 vector plus
+# one decoding temporary
+MEMORY_BUDGET_MB = 256
+BYTES_PER_PAIR = 4 + 8 + 1 + 1
+BYTES_PER_COLUMN_DIM = 2 * 4
+
+# Sales lines read per chunk, and the columns (with their types) used
+SALES_CHUNK_ROWS = 500_000
+SALES_DTYPES = {"PROD_CLR_EQUIV": str, "SALES_QTY": "float64", "SALES_AMT_FX_RATE": "float64"}
+
+
+# -------------------------------------------------
+# Loading helpers
+# -------------------------------------------------
+def load_embeddings(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """Image names and embedding matrix from an embedding store (.npy) or a CSV."""
+    path = Path(path)
+    if path.suffix == ".npy":
+        store = open_embeddings(path)
+        return store.names, store.vectors
+    return read_embeddings_csv(path)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalise every row so that a dot product is a cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-9, None)
+
+
+def build_catalogue(image_names: np.ndarray, df_product: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge the embedded images with the product catalogue.
+
+    Same as the notebook's "Image Grouping" cell, but instead of carrying
+    the 512 embedding columns the frame keeps ``emb_row``, the row of the
+    image in the embedding matrix.
+    """
+    products = df_product[["PROG_IMAGE", "L3_DES", "L4_DES", "PROD_REF"]].copy()
+    products["product_id"] = products["PROG_IMAGE"].str.split("/").str[-1]
+
+    result_df = pd.DataFrame({
+        "image_name": image_names,
+        "emb_row": np.arange(len(image_names)),
+    })
+    result_df = result_df.merge(
+        products[["product_id", "L3_DES", "L4_DES", "PROD_REF"]],
+        left_on="image_name",
+        right_on="product_id",
+        how="left",
+    )
+    result_df["DES_CONC"] = (
+        result_df["L3_DES"].fillna("Other").astype(str) + "_"
+        + result_df["L4_DES"].fillna("Other").astype(str)
+    )
+
+    result_df = result_df.drop(columns=["product_id", "L3_DES", "L4_DES"]).drop_duplicates()
+    return result_df.reset_index(drop=True)
+
+
+# -------------------------------------------------
+# Neighbour selection
+# -------------------------------------------------
+def _top_k_sorted(sims: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the ``k`` largest values of every row, best first."""
+    n_cols = sims.shape[1]
+    if k >= n_cols:
+        top = np.tile(np.arange(n_cols), (sims.shape[0], 1))
+    else:
+        # Partition sims itself (no negated copy): the k largest are last
+        top = np.argpartition(sims, kth=n_cols - k, axis=1)[:, n_cols - k:]
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _exclusion_mask(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    name_codes: np.ndarray,
+    prod_codes: np.ndarray,
+    out: Optional[np.ndarray] = None,
+    scratch: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Boolean (len(rows), len(cols)) mask of pairs that can never be neighbours:
+    the same image, or two images with the same (known) PROD_REF.
+
+    ``out`` and ``scratch`` are optional boolean buffers of that shape;
+    with them no (rows, cols) array is allocated.
+    """
+    shape = (len(rows), len(cols))
+    out = np.empty(shape, dtype=bool) if out is None else out
+    scratch = np.empty(shape, dtype=bool) if scratch is None else scratch
+    np.equal(name_codes[rows, None], name_codes[None, cols], out=out)
+    row_prod = prod_codes[rows, None]
+    np.equal(row_prod, prod_codes[None, cols], out=scratch)
+    scratch &= row_prod >= 0
+    out |= scratch
+    return out
+
+
+def _column_tile(n_rows: int, dim: int, memory_budget_mb: float) -> int:
+    """
+    Columns scored at once against ``n_rows`` query rows so that the tile
+    (similarities, masks, partition indices and the gathered vectors) fits
+    in ``memory_budget_mb``.
+    """
+    per_column = n_rows * BYTES_PER_PAIR + dim * BYTES_PER_COLUMN_DIM
+    return max(1, int(memory_budget_mb * 1e6) // per_column)
+
+
+def _running_top_k(
+    embeddings: np.ndarray,
+    block: np.ndarray,
+    cols: np.ndarray,
+    name_codes: np.ndarray,
+    prod_codes: np.ndarray,
+    k: int,
+    threshold: float,
+    memory_budget_mb: float,
+    taken_codes: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Best ``k`` valid columns of every ``block`` row among ``cols``.
+
+    The columns are scored in float32 tiles sized by ``memory_budget_mb``
+    and only a running top ``k`` per row is kept, so memory does not grow
+    with ``len(cols)``. ``taken_codes`` (rows x j, -1 = none) are image
+    names excluded per row.
+
+    Returns (cols, scores) of shape (len(block), k), best first (-1 / -inf
+    = none; ties broken by column), and the number of columns >= threshold.
+    """
+    queries = np.asarray(embeddings[block], dtype=np.float32)
+    best_cols = np.full((len(block), k), -1, dtype=np.int64)
+    best = np.full((len(block), k), -np.inf, dtype=np.float32)
+    above = np.zeros(len(block), dtype=np.int64)
+
+    tile_size = min(_column_tile(len(block), queries.shape[1], memory_budget_mb), max(len(cols), 1))
+    # One set of buffers for every tile, so tiles never overlap in memory;
+    # flat, so the shorter last tile is still a contiguous view
+    sims_buffer = np.empty(len(block) * tile_size, dtype=np.float32)
+    excluded_buffer = np.empty(len(block) * tile_size, dtype=bool)
+    scratch_buffer = np.empty(len(block) * tile_size, dtype=bool)
+    for start in range(0, len(cols), tile_size):
+        tile = cols[start:start + tile_size]
+        shape = (len(block), len(tile))
+        sims = sims_buffer[:len(block) * len(tile)].reshape(shape)
+        excluded = excluded_buffer[:sims.size].reshape(shape)
+        scratch = scratch_buffer[:sims.size].reshape(shape)
+
+        np.matmul(queries, np.asarray(embeddings[tile], dtype=np.float32).T, out=sims)
+        _exclusion_mask(block, tile, name_codes, prod_codes, out=excluded, scratch=scratch)
+        if taken_codes is not None:
+            for j in range(taken_codes.shape[1]):
+                np.equal(name_codes[None, tile], taken_codes[:, [j]], out=scratch)
+                scratch &= taken_codes[:, [j]] >= 0
+                excluded |= scratch
+        np.copyto(sims, -np.inf, where=excluded)
+        above += np.greater_equal(sims, threshold, out=scratch).sum(axis=1)
+
+        top = _top_k_sorted(sims, min(k, len(tile)))
+        cand_cols = np.concatenate([best_cols, tile[top]], axis=1)
+        cand = np.concatenate([best, np.take_along_axis(sims, top, axis=1)], axis=1)
+        # Best first, ties by column: the same result for any tiling
+        order = np.lexsort((cand_cols, -cand), axis=1)[:, :k]
+        best_cols = np.take_along_axis(cand_cols, order, axis=1)
+        best = np.take_along_axis(cand, order, axis=1)
+    return best_cols, best, above
+
+
+def _in_group_block(
+    embeddings: np.ndarray,
+    members: np.ndarray,
+    block: np.ndarray,
+    name_codes: np.ndarray,
+    prod_codes: np.ndarray,
+    threshold: float,
+    top_k: int,
+    max_neighbours: Optional[int],
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+) -> list:
+    """
+    Steps 1-3 for the ``block`` rows of a group: one (cols, scores) pair per
+    row, best first.
+
+    Rows with at least ``top_k`` items above the threshold keep all of them
+    (capped by ``max_neighbours``); the others get the group top ``top_k``,
+    which always starts with their above-threshold items. Both come from
+    the running top ``max(top_k, max_neighbours)``; without a cap every
+    member is kept, which is only practical for small groups.
+    """
+    width = max(top_k, max_neighbours or len(members))
+    best_cols, best, above = _running_top_k(
+        embeddings, block, members, name_codes, prod_codes,
+        width, threshold, memory_budget_mb,
+    )
+    picked = []
+    for r in range(len(block)):
+        if above[r] >= top_k:
+            keep = best[r] >= threshold
+            if max_neighbours is not None:
+                keep[max_neighbours:] = False
+        else:
+            keep = best[r] > -1
+            keep[top_k:] = False
+        picked.append((best_cols[r, keep], best[r, keep]))
+    return picked
+
+
+# State of a group worker process, set once by _init_group_worker
+_worker = {}
+
+
+def _init_group_worker(matrix_path: str, codec, order_path: str, name_codes, prod_codes, options: dict):
+    # Quantized matrices are shared as their codes and decoded tile by tile
+    matrix = np.load(matrix_path, mmap_mode="r")
+    if codec is not None:
+        matrix = QuantizedMatrix(codec, matrix, options.pop("dim"))
+    _worker["embeddings"] = matrix
+    _worker["order"] = np.load(order_path, mmap_mode="r")
+    _worker["name_codes"] = name_codes
+    _worker["prod_codes"] = prod_codes
+    _worker["options"] = options
+
+
+def _group_task(task: Tuple[int, int, np.ndarray]) -> list:
+    start, stop, block = task
+    return _in_group_block(
+        _worker["embeddings"], np.asarray(_worker["order"][start:stop]), block,
+        _worker["name_codes"], _worker["prod_codes"], **_worker["options"],
+    )
+
+
+def _global_fallback(
+    rows: np.ndarray,
+    taken: list,
+    embeddings: np.ndarray,
+    name_codes: np.ndarray,
+    prod_codes: np.ndarray,
+    top_k: int,
+    block_size: int,
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+) -> list:
+    """
+    Steps 4-5 for the under-filled items: search the whole catalogue.
+
+    The queries are scored in blocks of ``block_size`` rows against column
+    tiles of the whole matrix (see ``_running_top_k``). The items >=
+    threshold are the head of the global ranking, so taking the best
+    ``top_k - len(taken)`` valid items covers both steps.
+
+    Returns one ``(cols, scores)`` pair per row, best first.
+    """
+    all_rows = np.arange(len(embeddings))
+    results = []
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        block_taken = taken[start:start + block_size]
+
+        # Names already picked in the group, padded with -1
+        taken_codes = np.full((len(block), top_k), -1, dtype=np.int64)
+        for r, cols in enumerate(block_taken):
+            taken_codes[r, :len(cols)] = name_codes[cols]
+
+        best_cols, best, _ = _running_top_k(
+            embeddings, block, all_rows, name_codes, prod_codes,
+            top_k, np.inf, memory_budget_mb, taken_codes,
+        )
+        for r in range(len(block)):
+            keep = np.flatnonzero(best[r] > -1)[:top_k - len(block_taken[r])]
+            results.append((best_cols[r, keep], best[r, keep]))
+    return results
+
+
+def compute_neighbours(
+    embeddings: np.ndarray,
+    groups,
+    prod_refs,
+    image_names,
+    threshold: float = SIMILARITY_THRESHOLD,
+    top_k: int = TOP_K,
+    block_size: int = BLOCK_SIZE,
+    max_neighbours: Optional[int] = None,
+    fallback_block_size: int = FALLBACK_BLOCK_SIZE,
+    rows: Optional[np.ndarray] = None,
+    workers: int = 1,
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the neighbours of every row of the catalogue (or only of ``rows``).
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        (n, d) L2-normalised embeddings, one row per catalogue row, or a
+        ``QuantizedMatrix`` of them (rows are decoded tile by tile).
+    groups, prod_refs, image_names : array-like
+        ``DES_CONC``, ``PROD_REF`` and ``image_name`` of every row.
+    block_size : int
+        Number of rows scored per matrix product.
+    max_neighbours : int, optional
+        Cap on the number of above-threshold neighbours kept per row
+        (the notebook keeps all of them).
+    fallback_block_size : int
+        Number of under-filled rows scored at once against the whole
+        catalogue; bounds the memory of the global fallback.
+    rows : np.ndarray, optional
+        Catalogue rows to compute (default: all). Their neighbours are
+        still searched in the whole catalogue.
+    workers : int
+        Processes for the in-group stage. The workers read the matrix (the
+        codes, for a ``QuantizedMatrix``) and the group order from
+        memory-mapped temporary copies; a task only carries its group's
+        bounds and query rows. Results are placed by row, so the output is
+        the same for any number of workers.
+    memory_budget_mb : float
+        Peak memory of one similarity tile (per worker). Large groups are
+        scored in column tiles with a running top-K, so a group of any
+        size fits in the budget.
+
+    Returns
+    -------
+    (neighbour_idx, neighbour_scores)
+        (len(rows), width) arrays with catalogue row indices (-1 = none) and
+        cosine similarities (NaN = none), best first.
+    """
+    n = len(embeddings)
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    is_query = np.zeros(n, dtype=bool)
+    is_query[rows] = True
+    group_codes, _ = pd.factorize(pd.Series(groups))
+    prod_codes, _ = pd.factorize(pd.Series(prod_refs))
+    name_codes, _ = pd.factorize(pd.Series(image_names))
+
+    neighbours = [np.empty(0, dtype=np.int64)] * n
+    scores = [np.empty(0, dtype=np.float32)] * n
+
+    # Rows grouped by DES_CONC (rows without a group are skipped, like groupby)
+    order = np.argsort(group_codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(group_codes[order])) + 1
+
+    # A task is (start, stop) of its group in ``order`` and a block of queries
+    tasks = []
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, n]):
+        members = order[start:stop]
+        if len(members) == 0 or group_codes[members[0]] < 0:
+            continue
+        queries = members[is_query[members]]
+        for q in range(0, len(queries), block_size):
+            tasks.append((int(start), int(stop), queries[q:q + block_size]))
+
+    options = dict(
+        threshold=threshold, top_k=top_k, max_neighbours=max_neighbours,
+        memory_budget_mb=memory_budget_mb,
+    )
+    if workers > 1 and len(tasks) > 1:
+        with tempfile.TemporaryDirectory() as tmp:
+            matrix_path = os.path.join(tmp, "embeddings.npy")
+            order_path = os.path.join(tmp, "order.npy")
+            if isinstance(embeddings, QuantizedMatrix):
+                np.save(matrix_path, embeddings.codes)
+                codec, worker_options = embeddings.codec, dict(options, dim=embeddings.dim)
+            else:
+                np.save(matrix_path, np.asarray(embeddings, dtype=np.float32))
+                codec, worker_options = None, options
+            np.save(order_path, order)
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_group_worker,
+                initargs=(matrix_path, codec, order_path, name_codes, prod_codes, worker_options),
+            ) as pool:
+                results = list(pool.map(_group_task, tasks))
+    else:
+        results = [
+            _in_group_block(embeddings, order[start:stop], block, name_codes, prod_codes, **options)
+            for start, stop, block in tasks
+        ]
+
+    for (_, _, block), picked in zip(tasks, results):
+        for row, (cols, sims) in zip(block, picked):
+            neighbours[row] = cols
+            scores[row] = sims
+
+    # Steps 4-5: items whose group could not provide top_k neighbours
+    fallback_rows = np.array([
+        row for row in rows
+        if group_codes[row] >= 0 and len(neighbours[row]) < top_k
+    ], dtype=np.int64)
+    fallback = _global_fallback(
+        fallback_rows,
+        [neighbours[row] for row in fallback_rows],
+        embeddings,
+        name_codes,
+        prod_codes,
+        top_k,
+        fallback_block_size,
+        memory_budget_mb,
+    )
+    for row, (cols, extra) in zip(fallback_rows, fallback):
+        neighbours[row] = np.concatenate([neighbours[row], cols])
+        scores[row] = np.concatenate([scores[row], extra])
+
+    width = max((len(neighbours[row]) for row in rows), default=0)
+    neighbour_idx = np.full((len(rows), width), -1, dtype=np.int64)
+    neighbour_scores = np.full((len(rows), width), np.nan, dtype=np.float32)
+    for i, row in enumerate(rows):
+        neighbour_idx[i, :len(neighbours[row])] = neighbours[row]
+        neighbour_scores[i, :len(scores[row])] = scores[row]
+    return neighbour_idx, neighbour_scores
+
+
+def neighbours_to_columns(
+    image_names: np.ndarray,
+    neighbour_idx: np.ndarray,
+    neighbour_scores: np.ndarray,
+) -> pd.DataFrame:
+    """Wide ``similar_image_k`` / ``similarity_score_k`` columns used by the app."""
+    names = np.asarray(image_names, dtype=object)
+    columns = {}
+    for k in range(neighbour_idx.shape[1]):
+        idx = neighbour_idx[:, k]
+        columns[f"similar_image_{k + 1}"] = np.where(idx >= 0, names[idx], None)
+        columns[f"similarity_score_{k + 1}"] = neighbour_scores[:, k]
+    return pd.DataFrame(columns)
+
+
+# -------------------------------------------------
+# Size, colour and price attributes
+# -------------------------------------------------
+def _joined_values(df_product: pd.DataFrame, column: str) -> pd.Series:
+    """Sorted distinct values of ``column`` per PROD_REF, comma separated."""
+    pairs = (
+        df_product[["PROD_REF", column]]
+        .dropna()
+        .astype({column: str})
+        .drop_duplicates()
+        .sort_values(["PROD_REF", column])
+    )
+    values = pd.Series(dtype=object)
+    if len(pairs):
+        refs = pairs["PROD_REF"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, refs[1:] != refs[:-1]])
+        # Object-array add is string concatenation: one C loop for all groups
+        joined = np.add.reduceat((pairs[column] + ", ").to_numpy(dtype=object), starts)
+        values = pd.Series([v[:-2] for v in joined], index=refs[starts], dtype=object)
+    # PROD_REFs whose values are all missing get "" (like joining an empty set)
+    all_refs = df_product["PROD_REF"].dropna().unique()
+    return values.reindex(all_refs, fill_value="")
+
+
+def add_product_attributes(result_df: pd.DataFrame, df_product: pd.DataFrame) -> pd.DataFrame:
+    """Attach ``Sizes`` and ``Color`` (all values of the PROD_REF, comma separated)."""
+    product_agg = pd.DataFrame({
+        "Sizes": _joined_values(df_product, "SZ_DES"),
+        "Color": _joined_values(df_product, "CLR_DES"),
+    })
+    product_agg.index.name = "PROD_REF"
+    return result_df.merge(product_agg.reset_index(), on="PROD_REF", how="left")
+
+
+def read_unit_prices(sales_csv: Path, chunk_rows: int = SALES_CHUNK_ROWS) -> pd.Series:
+    """
+    Mean unit price (``SALES_AMT_FX_RATE / SALES_QTY``) per ``PROD_CLR_EQUIV``.
+
+    The sales table is read ``chunk_rows`` rows at a time with typed columns
+    and only per-chunk sums and counts are kept, so memory does not grow
+    with the number of sales lines.
+    """
+    sums, counts = [], []
+    for chunk in pd.read_csv(sales_csv, usecols=list(SALES_DTYPES), dtype=SALES_DTYPES, chunksize=chunk_rows):
+        price = chunk["SALES_AMT_FX_RATE"] / chunk["SALES_QTY"]
+        grouped = price.groupby(chunk["PROD_CLR_EQUIV"])
+        sums.append(grouped.sum())
+        counts.append(grouped.count())
+    if not sums:
+        return pd.Series(dtype="float64", name="price")
+    total = pd.concat(sums).groupby(level=0).sum()
+    count = pd.concat(counts).groupby(level=0).sum()
+    # Codes with only missing prices have no mean (like groupby.mean)
+    return (total / count.where(count > 0)).rename("price")
+
+
+def price_neighbours(
+    neighbour_idx: np.ndarray,
+    neighbour_scores: np.ndarray,
+    groups: pd.Series,
+    threshold: float = SIMILARITY_THRESHOLD,
+    top_k: int = TOP_K,
+) -> np.ndarray:
+    """
+    The neighbours the notebook averaged for ``Avg_Similar_Price``: every
+    neighbour of the same ``groups`` (DES_CONC) value >= ``threshold`` when
+    there are at least ``top_k`` of them, otherwise the first ``top_k``
+    (the global fallback never adds more). Other entries are set to -1.
+
+    Those in-group matches come first in the graph, but only its K
+    neighbours are known: an item with more than K of them is averaged
+    over its first K.
+    """
+    codes, _ = pd.factorize(groups)
+    valid = neighbour_idx >= 0
+    same_group = valid & (codes[np.where(valid, neighbour_idx, 0)] == codes[:, None])
+    above = same_group & (np.nan_to_num(neighbour_scores, nan=-np.inf) >= threshold)
+    n_used = np.maximum(top_k, above.sum(axis=1))
+    used = np.arange(neighbour_idx.shape[1])[None, :] < n_used[:, None]
+    return np.where(used, neighbour_idx, -1)
+
+
+def add_prices(
+    result_df: pd.DataFrame,
+    df_product: pd.DataFrame,
+    unit_prices: pd.Series,
+    neighbour_idx: np.ndarray,
+) -> pd.DataFrame:
+    """
+    Attach ``Price`` (mean unit price of the PROD_CLR_EQUIV, see
+    ``read_unit_prices``) and ``Avg_Similar_Price``, the mean price of the
+    neighbours in ``neighbour_idx`` (catalogue rows, -1 = none; see
+    ``price_neighbours``).
+    """
+    product_ids = df_product["PROG_IMAGE"].str.split("/").str[-1]
+    # The last product row of an image wins, as with the notebook's dict
+    prod_to_clr = (
+        pd.Series(df_product["PROD_CLR_EQUIV"].to_numpy(), index=product_ids.to_numpy())
+        .loc[lambda s: ~s.index.duplicated(keep="last")]
+    )
+    clr = result_df["image_name"].map(prod_to_clr)
+    price = clr.map(unit_prices).to_numpy(dtype=np.float64)
+    result_df["Price"] = price
+
+    # Gather the neighbours' prices; mean over the ones that have a price
+    gathered = np.where(neighbour_idx >= 0, price[np.maximum(neighbour_idx, 0)], np.nan)
+    valid = ~np.isnan(gathered)
+    count = valid.sum(axis=1)
+    total = np.where(valid, gathered, 0.0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result_df["Avg_Similar_Price"] = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    return result_df
+
+
+# -------------------------------------------------
+# Pipeline
+# -------------------------------------------------
+def build_result_df(
+    embeddings_path: Path,
+    products_csv: Path,
+    sales_csv: Path,
+    threshold: float = SIMILARITY_THRESHOLD,
+    top_k: int = TOP_K,
+    graph_k: int = GRAPH_K,
+    block_size: int = BLOCK_SIZE,
+    fallback_block_size: int = FALLBACK_BLOCK_SIZE,
+    workers: int = 1,
+    memory_budget_mb: float = MEMORY_BUDGET_MB,
+    quantization: str = "float32",
+) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Run the whole offline pipeline.
+
+    ``quantization`` (see ``quantization.py``) keeps the embeddings as
+    float16 / int8 / PQ codes; every similarity tile decodes only the rows
+    it scores. Returns the frame saved as result_df.csv (with ``top_k``
+    wide neighbour columns) and the (n, graph_k) neighbour index and score
+    arrays.
+    """
+    graph_k = min(max(graph_k, top_k), MAX_GRAPH_K)
+
+    image_names, matrix = load_embeddings(embeddings_path)
+    df_product = pd.read_csv(products_csv)
+    unit_prices = read_unit_prices(sales_csv)
+
+    result_df = build_catalogue(image_names, df_product)
+    embeddings = quantize(normalize_rows(matrix)[result_df["emb_row"].to_numpy()], quantization)
+    del matrix
+
+    neighbour_idx, neighbour_scores = compute_neighbours(
+        embeddings,
+        result_df["DES_CONC"],
+        result_df["PROD_REF"],
+        result_df["image_name"],
+        threshold=threshold,
+        top_k=graph_k,
+        block_size=block_size,
+        max_neighbours=graph_k,
+        fallback_block_size=fallback_block_size,
+        workers=workers,
+        memory_budget_mb=memory_budget_mb,
+    )
+    result_df = assemble_result_df(
+        result_df, neighbour_idx, neighbour_scores, df_product, unit_prices, top_k, threshold
+    )
+    return result_df, neighbour_idx, neighbour_scores
+
+
+def assemble_result_df(
+    catalogue: pd.DataFrame,
+    neighbour_idx: np.ndarray,
+    neighbour_scores: np.ndarray,
+    df_product: pd.DataFrame,
+    unit_prices: pd.Series,
+    top_k: int = TOP_K,
+    threshold: float = SIMILARITY_THRESHOLD,
+) -> pd.DataFrame:
+    """
+    Catalogue + first ``top_k`` neighbour columns + size, colour and price
+    attributes (``unit_prices`` from ``read_unit_prices``).
+    ``Avg_Similar_Price`` uses all the graph neighbours the notebook would
+    have listed (see ``price_neighbours``), not only the first ``top_k``.
+    """
+    neighbour_cols = neighbours_to_columns(
+        catalogue["image_name"].to_numpy(),
+        neighbour_idx[:, :top_k],
+        neighbour_scores[:, :top_k],
+    )
+    result_df = pd.concat([catalogue.drop(columns=["emb_row"]), neighbour_cols], axis=1)
+    result_df = add_product_attributes(result_df, df_product)
+    return add_prices(
+        result_df, df_product, unit_prices,
+        price_neighbours(neighbour_idx, neighbour_scores, catalogue["DES_CONC"], threshold, top_k),
+    )
+
+
+def write_outputs(
+    result_df: pd.DataFrame,
+    neighbour_idx: np.ndarray,
+    neighbour_scores: np.ndarray,
+    csv_path: Path = RESULT_CSV,
+    parquet_path: Path = RESULT_PARQUET,
+    graph_path: Path = NEIGHBOURS_NPZ,
+):
+    """Write result_df.csv, its Parquet copy and the neighbour graph."""
+    Path(csv_path).parent.mkdir(parents=True, exist_ok=True)
+    result_df.to_csv(csv_path, index=False)
+    try:
+        write_result_parquet(result_df, parquet_path)
+    except ImportError as e:
+        print(f"Warning: {parquet_path} not written ({e}); the app will read the CSV")
+    save_graph(graph_path, result_df["image_name"], neighbour_idx, neighbour_scores)
+
+
+def measure_scaling(
+    embeddings_path: Path,
+    products_csv: Path,
+    worker_counts,
+    threshold: float = SIMILARITY_THRESHOLD,
+    graph_k: int = GRAPH_K,
+    block_size: int = BLOCK_SIZE,
+    fallback_block_size: int = FALLBACK_BLOCK_SIZE,
+):
+    """Time ``compute_neighbours`` with every worker count and check the outputs are identical."""
+    image_names, matrix = load_embeddings(embeddings_path)
+    result_df = build_catalogue(image_names, pd.read_csv(products_csv))
+    embeddings = normalize_rows(matrix)[result_df["emb_row"].to_numpy()]
+    graph_k = min(graph_k, MAX_GRAPH_K)
+
+    print(f"{len(result_df)} rows, {os.cpu_count()} cores")
+    reference = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        idx, scores = compute_neighbours(
+            embeddings, result_df["DES_CONC"], result_df["PROD_REF"], result_df["image_name"],
+            threshold=threshold, top_k=graph_k, block_size=block_size, max_neighbours=graph_k,
+            fallback_block_size=fallback_block_size, workers=workers,
+        )
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = idx, scores, elapsed
+        same = np.array_equal(idx, reference[0]) and np.array_equal(scores, reference[1], equal_nan=True)
+        print(f"  {workers} workers: {elapsed:6.2f}s  speed-up {reference[2] / elapsed:4.2f}x  "
+              f"{'identical' if same else 'DIFFERENT'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild result_df.csv for the PARFOIS similarity app.")
+    parser.add_argument("--embeddings", type=Path, default=EMBEDDINGS_NPY,
+                        help="Embedding store (.npy) or CLIP embeddings CSV (image_name + 0..511).")
+    parser.add_argument("--products", type=Path, default=PRODUCTS_CSV, help="df_product.csv")
+    parser.add_argument("--sales", type=Path, default=SALES_CSV, help="df_sales.csv")
+    parser.add_argument("--out", type=Path, default=RESULT_CSV, help="Output CSV.")
+    parser.add_argument("--parquet-out", type=Path, default=RESULT_PARQUET,
+                        help="Typed Parquet copy of the output read by the app.")
+    parser.add_argument("--graph-out", type=Path, default=NEIGHBOURS_NPZ, help="Output neighbour graph.")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--top-k", type=int, default=TOP_K,
+                        help="Neighbours written as similar_image_k columns.")
+    parser.add_argument("--graph-k", type=int, default=GRAPH_K,
+                        help=f"Neighbours kept in the neighbour graph (max {MAX_GRAPH_K}).")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="Rows scored per matrix product.")
+    parser.add_argument("--fallback-block-size", type=int, default=FALLBACK_BLOCK_SIZE,
+                        help="Under-filled items scored at once against the whole catalogue.")
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help="Peak memory of one similarity tile.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for the in-group stage (same output for any value).")
+    parser.add_argument("--scaling", type=int, nargs="+", metavar="WORKERS",
+                        help="Only time the neighbour stage with each number of workers, e.g. 1 2 4 8.")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="float32",
+                        help="Embedding representation for scoring (see quantization.py).")
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        measure_scaling(args.embeddings, args.products, args.scaling, args.threshold,
+                        args.graph_k, args.block_size, args.fallback_block_size)
+        return
+
+    start = time.perf_counter()
+    result_df, neighbour_idx, neighbour_scores = build_result_df(
+        args.embeddings,
+        args.products,
+        args.sales,
+        threshold=args.threshold,
+        top_k=args.top_k,
+        graph_k=args.graph_k,
+        block_size=args.block_size,
+        fallback_block_size=args.fallback_block_size,
+        workers=args.workers,
+        memory_budget_mb=args.memory_budget_mb,
+        quantization=args.quantize,
+    )
+    write_outputs(
+        result_df, neighbour_idx, neighbour_scores, args.out, args.parquet_out, args.graph_out
+    )
+    print(f"Saved {len(result_df)} rows to {args.out} and {args.graph_out} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
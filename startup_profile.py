@@ -0,0 +1,112 @@
+"""
+Cold-start profile of the Streamlit app: import time and first-render time.
+
+Every measurement runs in a fresh Python process, so nothing is warm:
+
+- import time of the modules the app imports at the top (``python -X
+  importtime``), per top-level package;
+- the first render of ``Parfois_Similar.py`` (Streamlit's ``AppTest``),
+  then a rerun in the same process (caches warm), and whether the
+  ``supabase`` package was loaded by the end of the first render (only
+  background threads should load it; the render does not wait for it).
+
+The exit code is 1 when import + first render exceed ``--budget-ms``, so
+the script can guard cold start in CI.
+
+Usage
+-----
+    python startup_profile.py
+    python startup_profile.py --budget-ms 3000 --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+BASE_DIR = Path(__file__).resolve().parent
+APP_PATH = BASE_DIR / "Parfois_Similar.py"
+
+# Imported at the top of Parfois_Similar.py
+APP_IMPORTS = [
+    "numpy", "pandas", "streamlit",
+    "ann_index", "embedding_store", "feedback_store", "image_manifest", "image_query",
+    "image_server", "neighbour_graph", "product_search", "result_table", "thumbnails",
+]
+BUDGET_MS = 5000
+
+_RENDER_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=float(sys.argv[2]))
+at.secrets["SUPABASE_URL"] = "https://example.supabase.co"
+at.secrets["SUPABASE_KEY"] = "x" * 40
+start = time.perf_counter(); at.run(); first = time.perf_counter() - start
+supabase_imported = "supabase" in sys.modules
+start = time.perf_counter(); at.run(); rerun = time.perf_counter() - start
+print(json.dumps({
+    "first_ms": 1000 * first,
+    "rerun_ms": 1000 * rerun,
+    "exceptions": [str(e.value) for e in at.exception],
+    "supabase_imported": supabase_imported,
+}))
+"""
+
+
+def import_times(modules=APP_IMPORTS) -> Dict[str, float]:
+    """Cumulative import time (ms) of each top-level package, in a fresh interpreter."""
+    code = "".join(f"import {module}\n" for module in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  ") and name.strip() in modules:  # imported at top level
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def render_times(app_path: Path = APP_PATH, timeout: float = 120) -> dict:
+    """First render and rerun of the app (ms), in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-c", _RENDER_SCRIPT, str(app_path), str(timeout)],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True, env=dict(os.environ),
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the app's cold start.")
+    parser.add_argument("--app", type=Path, default=APP_PATH)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="Budget for import + first render.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list.")
+    args = parser.parse_args(argv)
+
+    times = import_times()
+    import_ms = sum(times.values())
+    print(f"Imports: {import_ms:.0f} ms")
+    for name, ms in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<30} {ms:8.1f} ms")
+
+    render = render_times(args.app)
+    if render["exceptions"]:
+        print(f"Render raised: {render['exceptions'][0]}")
+    print(f"First render: {render['first_ms']:.0f} ms   rerun: {render['rerun_ms']:.0f} ms   "
+          f"supabase imported: {'yes' if render['supabase_imported'] else 'no'}")
+
+    total = import_ms + render["first_ms"]
+    print(f"Cold start: {total:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if total > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
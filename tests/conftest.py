@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from embedding_store import save_embeddings  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int = 16, n_clusters: int = 8, noise: float = 0.08, seed: int = 0):
+    """
+    Unit vectors around a few centres (pairs of a cluster score around
+    0.90) and the cluster of every vector.
+    """
+    rng = np.random.default_rng(seed)
+    centres = np.random.default_rng(0).standard_normal((n_clusters, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    clusters = rng.integers(0, n_clusters, n)
+    vectors = centres[clusters] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), clusters
+
+
+def synthetic_products(image_names, groups) -> pd.DataFrame:
+    """
+    df_product rows: two sizes per image and the given groups; images
+    ``<prefix><2n>_1`` and ``<prefix><2n + 1>_1`` share a PROD_REF.
+    """
+    rows = []
+    for i, (name, group) in enumerate(zip(image_names, groups)):
+        for size in ("S", "M"):
+            rows.append({
+                "PROG_IMAGE": f"x/{name}",
+                "L3_DES": f"L3_{group % 2}",
+                "L4_DES": f"L4_{group}",
+                "PROD_REF": f"{name[:3]}{int(name[3:7]) // 2}",
+                "SZ_DES": size,
+                "CLR_DES": "Red" if i % 3 else "Blue",
+                "PROD_CLR_EQUIV": name,
+            })
+    return pd.DataFrame(rows)
+
+
+def synthetic_sales(image_names, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    codes = np.repeat(np.asarray(image_names, dtype=object), 3)
+    qty = rng.integers(1, 20, len(codes)).astype(np.float64)
+    return pd.DataFrame({
+        "PROD_CLR_EQUIV": codes,
+        "SALES_QTY": qty,
+        "SALES_AMT_FX_RATE": qty * rng.uniform(5, 60, len(codes)),
+    })
+
+
+@pytest.fixture
+def catalogue_files(tmp_path):
+    """
+    Write a synthetic catalogue (embedding store, df_product.csv,
+    df_sales.csv) under ``tmp_path``; returns a function of (names,
+    vectors, groups) that (re)writes the store and returns the three paths.
+    """
+    def write(names, vectors, groups):
+        npy_path = save_embeddings(tmp_path / "embeddings.npy", names, vectors)
+        products_csv = tmp_path / "df_product.csv"
+        sales_csv = tmp_path / "df_sales.csv"
+        synthetic_products(names, groups).to_csv(products_csv, index=False)
+        synthetic_sales(names).to_csv(sales_csv, index=False)
+        return npy_path, products_csv, sales_csv
+
+    return write
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from ann_index import IVFIndex, catalogue_vectors, exact_search, index_signature, load_or_build
+from conftest import synthetic_vectors
+from embedding_store import open_embeddings, save_embeddings
+
+
+def test_rows_without_embedding_are_not_indexed(tmp_path):
+    vectors, _ = synthetic_vectors(300)
+    names = [f"IMG{i:04d}_1" for i in range(300)]
+    npy_path = save_embeddings(tmp_path / "embeddings.npy", names[:250], vectors[:250])
+    store = open_embeddings(npy_path)
+
+    catalogue, has_vector = catalogue_vectors(store, names)
+    assert has_vector.sum() == 250
+    signature = index_signature(npy_path, names)
+    index_path = tmp_path / "ann_index.npz"
+
+    for quantization in ("float32", "int8", "pq"):
+        index, rebuilt = load_or_build(catalogue, has_vector, signature, index_path, quantization, save=False)
+        assert rebuilt
+        assert sorted(index.list_rows) == list(range(250))
+        for row in range(0, 250, 25):
+            rows, _ = index.search(catalogue[row], k=10, n_probe=index.n_lists)
+            assert has_vector[rows].all()
+
+    # Exact and approximate search agree when every list is probed
+    index, _ = load_or_build(catalogue, has_vector, signature, index_path)
+    allowed = has_vector.copy()
+    allowed[7] = False
+    approx, _ = index.search(catalogue[7], k=4, n_probe=index.n_lists, allowed=allowed)
+    exact, _ = exact_search(catalogue, catalogue[7], k=4, allowed=allowed)
+    assert set(approx) == set(exact)
+
+
+def test_saved_index_follows_the_store_and_rows(tmp_path):
+    vectors, _ = synthetic_vectors(200)
+    names = [f"IMG{i:04d}_1" for i in range(200)]
+    npy_path = save_embeddings(tmp_path / "embeddings.npy", names, vectors)
+    index_path = tmp_path / "ann_index.npz"
+
+    def load(rows):
+        catalogue, has_vector = catalogue_vectors(open_embeddings(npy_path), rows)
+        return load_or_build(catalogue, has_vector, index_signature(npy_path, rows), index_path)[1]
+
+    assert load(names)
+    assert not load(names)
+    # Same row count, other order
+    assert load(names[::-1])
+    assert not load(names[::-1])
+
+    stat = os.stat(npy_path)
+    os.utime(npy_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load(names[::-1])
+
+
+def test_index_without_vectors_returns_nothing():
+    index = IVFIndex.build(np.zeros((5, 8), dtype=np.float32), has_vector=np.zeros(5, dtype=bool))
+    rows, scores = index.search(np.ones(8, dtype=np.float32) / np.sqrt(8), k=4)
+    assert len(rows) == 0 and len(scores) == 0
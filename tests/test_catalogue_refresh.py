@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from catalogue_refresh import refresh_neighbours
+from conftest import synthetic_vectors
+from similarity_engine import build_result_df, write_outputs
+
+
+def test_incremental_refresh_matches_full_rebuild(tmp_path, catalogue_files):
+    names = [f"IMG{i:04d}_1" for i in range(400)]
+    vectors, clusters = synthetic_vectors(403)
+    # Two clusters per DES_CONC group
+    groups = clusters // 2
+    npy_path, products_csv, sales_csv = catalogue_files(names, vectors[:400], groups[:400])
+
+    result_csv, result_parquet, graph_path = tmp_path / "r.csv", tmp_path / "r.parquet", tmp_path / "g.npz"
+    result_df, idx, scores = build_result_df(npy_path, products_csv, sales_csv)
+    write_outputs(result_df, idx, scores, result_csv, result_parquet, graph_path)
+
+    # Re-embed two images (same cluster), drop two, add three
+    new_vectors = vectors[:400].copy()
+    changed = [i for i in range(400) if clusters[i] == clusters[0]][1:3]
+    new_vectors[changed] = synthetic_vectors(403, seed=1)[0][changed]
+    keep = [i for i in range(400) if i not in (50, 51)]
+    added = [f"NEW{i:04d}_1" for i in range(3)]
+    npy_path, products_csv, sales_csv = catalogue_files(
+        [names[i] for i in keep] + added,
+        np.concatenate([new_vectors[keep], vectors[400:]]),
+        np.concatenate([groups[keep], groups[400:]]),
+    )
+
+    refreshed, _, _, recomputed = refresh_neighbours(
+        npy_path, products_csv, sales_csv, {names[i] for i in changed} | set(added),
+        graph_path=graph_path, result_csv=result_csv, result_parquet=result_parquet,
+    )
+    expected, _, _ = build_result_df(npy_path, products_csv, sales_csv)
+
+    assert recomputed < len(expected)
+    pd.testing.assert_frame_equal(refreshed, expected, check_exact=False, rtol=1e-5, atol=1e-6)
+
+    # The CSV the app reads is the same too
+    refreshed.to_csv(tmp_path / "refreshed.csv", index=False)
+    expected.to_csv(tmp_path / "expected.csv", index=False)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "refreshed.csv"), pd.read_csv(tmp_path / "expected.csv"),
+        check_exact=False, rtol=1e-5, atol=1e-6,
+    )
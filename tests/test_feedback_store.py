@@ -0,0 +1,143 @@
+import codecs
+import io
+import json
+import sqlite3
+import time
+
+import pandas as pd
+
+from feedback_store import (
+    FEEDBACK_COLUMNS,
+    FeedbackCache,
+    FeedbackSpool,
+    LocalBackend,
+    PairRatings,
+    SpoolWorker,
+    export_csv,
+    export_csv_file,
+)
+
+
+class ListBackend:
+    """A remote table in memory: delivered rows get increasing ids."""
+
+    def __init__(self):
+        self.rows = []
+
+    def insert_many(self, rows):
+        for row in rows:
+            self.rows.append({"id": len(self.rows) + 1, **row})
+
+    def fetch_after(self, after_id, limit):
+        return [row for row in self.rows if after_id is None or row["id"] > after_id][:limit]
+
+
+def rating(chosen, recommended, value="Good"):
+    return {"artigo_escolhido": chosen, "artigo_1": recommended, "avaliacao_1": value}
+
+
+def test_spooled_ratings_count_once(tmp_path):
+    spool = FeedbackSpool(tmp_path / "spool.sqlite")
+    backend = ListBackend()
+    worker = SpoolWorker(spool, backend)
+    ratings = PairRatings(tmp_path / "ratings.sqlite", spool=spool)
+
+    spool.put(rating("A", "B"))
+    spool.put(rating("C", "B", "Bad"))
+    # Not delivered yet: counted from the spool
+    assert ratings.get("A", "B") == (0, 0, 1)
+
+    worker.flush_once()
+    spool.put(rating("A", "B", "Medium"))
+    assert ratings.get("A", "B") == (0, 1, 1)
+
+    # Delivered rows now come from the counters, the pending one from the spool
+    ratings.sync(backend)
+    assert ratings.get("A", "B") == (0, 1, 1)
+    assert ratings.get("C", "B") == (1, 0, 0)
+
+    worker.flush_once()
+    ratings.sync(backend)
+    assert ratings.get_many("A", ["B", "X"]) == {"B": (0, 1, 1)}
+
+
+def test_local_backend_reads_the_spool(tmp_path):
+    spool = FeedbackSpool(tmp_path / "spool.sqlite")
+    backend = LocalBackend(spool)
+    ratings = PairRatings(tmp_path / "ratings.sqlite", spool=spool)
+
+    spool.put(rating("A", "B"))
+    SpoolWorker(spool, backend).flush_once()
+    ratings.sync(backend)
+    assert ratings.get("A", "B") == (0, 0, 1)
+    assert len(backend.fetch_after(None, 10)) == 1
+
+
+def test_old_spool_gets_the_chosen_column(tmp_path):
+    path = tmp_path / "spool.sqlite"
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE spool (seq INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+            "created_at REAL NOT NULL, flushed_at REAL)"
+        )
+        conn.execute(
+            "INSERT INTO spool (payload, created_at) VALUES (?, ?)",
+            (json.dumps(rating("A", "B")), time.time()),
+        )
+    spool = FeedbackSpool(path)
+    assert spool.rows_after("A", None) == [rating("A", "B")]
+    assert spool.rows_after("B", None) == []
+
+
+def test_sync_purges_delivered_rows(tmp_path):
+    spool = FeedbackSpool(tmp_path / "spool.sqlite")
+    backend = ListBackend()
+    worker = SpoolWorker(spool, backend)
+    ratings = PairRatings(tmp_path / "ratings.sqlite", spool=spool)
+
+    for _ in range(3):
+        spool.put(rating("A", "B"))
+    worker.flush_once()
+    spool.put(rating("A", "B", "Bad"))
+    ratings.sync(backend)
+
+    # Only the pending row is left, and nothing is lost or counted twice
+    assert spool.depth() == 1
+    assert spool.fetch_after(None, 10)[0]["avaliacao_1"] == "Bad"
+    assert ratings.get("A", "B") == (1, 0, 3)
+
+    ratings.sync(backend)
+    worker.flush_once()
+    assert ratings.get("A", "B") == (1, 0, 3)
+    ratings.sync(backend)
+    assert ratings.get("A", "B") == (1, 0, 3)
+    assert spool.fetch_after(None, 10) == []
+
+
+def test_local_backend_keeps_its_rows(tmp_path):
+    spool = FeedbackSpool(tmp_path / "spool.sqlite")
+    backend = LocalBackend(spool)
+    spool.put(rating("A", "B"))
+    SpoolWorker(spool, backend).flush_once()
+    PairRatings(tmp_path / "ratings.sqlite", spool=spool).sync(backend)
+    assert len(spool.fetch_after(None, 10)) == 1
+
+
+def test_export_header_comes_from_the_schema(tmp_path):
+    backend = ListBackend()
+    out = io.BytesIO()
+    assert export_csv(backend, out) == 0
+    assert out.getvalue() == codecs.BOM_UTF8 + (";".join(FEEDBACK_COLUMNS) + "\n").encode("utf-8")
+
+    # A column that only shows up after the first page is kept
+    backend.insert_many([rating("A", "B"), rating("A", "C"), {**rating("D", "E"), "origem": "app"}])
+    cache = FeedbackCache(backend, tmp_path / "cache.sqlite")
+    cache.refresh_if_stale()
+    exported = export_csv_file(cache, page_size=2)
+    # Read the way st.download_button does: rewind, then read everything
+    exported.seek(0)
+    df = pd.read_csv(io.BytesIO(exported.read()), sep=";", encoding="utf-8-sig")
+    assert exported.closed
+    assert list(df.columns) == FEEDBACK_COLUMNS + ["origem"]
+    assert df["id"].tolist() == [1, 2, 3]
+    assert df["origem"].isna().tolist() == [True, True, False]
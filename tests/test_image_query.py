@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import synthetic_vectors
+from image_query import export_onnx, load_encoder, search_by_image
+
+
+def photo_bytes(colour="red") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), colour).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def check_encoder(encoder):
+    query = encoder.encode(encoder.preprocess(Image.open(io.BytesIO(photo_bytes()))))
+    assert query.shape == (encoder.dim,)
+    assert np.isclose(np.linalg.norm(query), 1.0, atol=1e-4)
+
+    vectors, _ = synthetic_vectors(50, dim=encoder.dim)
+    rows, scores, timings = search_by_image(encoder, photo_bytes(), vectors, k=4)
+    assert len(rows) == 4 and np.all(np.diff(scores) <= 0)
+    assert set(timings) == {"decode", "preprocess", "encode", "search"}
+
+
+def test_stand_in_encoder():
+    check_encoder(load_encoder("stand-in", dim=32))
+
+
+def test_clip_encoder():
+    pytest.importorskip("torch")
+    pytest.importorskip("clip")
+    check_encoder(load_encoder("clip"))
+
+
+def test_onnx_encoder(tmp_path):
+    pytest.importorskip("torch")
+    pytest.importorskip("clip")
+    pytest.importorskip("onnxruntime")
+    onnx_path = export_onnx(tmp_path / "clip_visual.onnx")
+    check_encoder(load_encoder("onnx", onnx_path=onnx_path))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from conftest import synthetic_vectors
+from quantization import QUANTIZATION_MODES, QuantizedMatrix, evaluate_search, quantize
+
+
+@pytest.mark.parametrize("mode, max_error, min_recall", [
+    ("float16", 1e-3, 0.99), ("int8", 0.02, 0.9), ("pq", 0.25, 0.5),
+])
+def test_codecs_round_trip_and_score_like_their_decoded_vectors(mode, max_error, min_recall):
+    vectors, _ = synthetic_vectors(500, dim=64, noise=0.2)
+    matrix = quantize(vectors, mode, **({"m": 16} if mode == "pq" else {}))
+    assert isinstance(matrix, QuantizedMatrix) and matrix.shape == vectors.shape
+    assert matrix.codes.nbytes < vectors.nbytes
+
+    decoded = np.asarray(matrix)
+    assert np.abs(decoded - vectors).max() <= max_error
+    np.testing.assert_allclose(matrix[3], decoded[3])
+    np.testing.assert_allclose(matrix[10:20] @ vectors[0], decoded[10:20] @ vectors[0], atol=1e-5)
+    np.testing.assert_allclose(matrix.take(np.array([4, 2])) @ vectors[1], decoded[[4, 2]] @ vectors[1], atol=1e-5)
+
+    assert evaluate_search(vectors, matrix, n_queries=100)["recall"] >= min_recall
+
+
+def test_float32_is_the_array_itself():
+    vectors, _ = synthetic_vectors(10)
+    assert quantize(vectors, "float32") is vectors
+    with pytest.raises(ValueError):
+        quantize(vectors, "int4")
+    assert "int4" not in QUANTIZATION_MODES
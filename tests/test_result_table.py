@@ -0,0 +1,31 @@
+import os
+
+import pandas as pd
+
+from result_table import read_result_table, write_result_parquet
+
+
+def result_rows(price):
+    return pd.DataFrame({
+        "image_name": ["A_1", "B_1"], "PROD_REF": [10.0, None], "DES_CONC": ["Bags", ""],
+        "Color": ["Red", "Blue"], "Sizes": ["S", "M"], "Price": [price, price],
+        "similar_image_1": ["B_1", "A_1"], "similarity_score_1": [0.9, 0.9],
+    })
+
+
+def test_stale_parquet_falls_back_to_the_csv_without_rewriting(tmp_path):
+    csv_path, parquet_path = tmp_path / "result_df.csv", tmp_path / "result_df.parquet"
+    write_result_parquet(result_rows(1.0), parquet_path)
+    assert [p.name for p in tmp_path.iterdir()] == ["result_df.parquet"]
+
+    result_rows(2.0).to_csv(csv_path, index=False)
+    written = parquet_path.stat().st_mtime_ns
+    os.utime(csv_path, ns=(written + 10**9, written + 10**9))
+
+    df = read_result_table(parquet_path, csv_path)
+    assert df["Price"].tolist() == [2.0, 2.0]
+    assert df["display_label"].tolist() == ["A_1 | 10 | Bags", "B_1 | nan"]
+    assert parquet_path.stat().st_mtime_ns == written
+
+    write_result_parquet(pd.read_csv(csv_path), parquet_path)
+    pd.testing.assert_frame_equal(read_result_table(parquet_path, csv_path), df)
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+from conftest import synthetic_products, synthetic_sales, synthetic_vectors
+from embedding_store import save_embeddings
+from quantization import quantize
+from similarity_engine import GRAPH_K, build_result_df, compute_neighbours, normalize_rows
+
+N_SIMILAR = 4
+
+
+def cosine_similarity(a, b=None):
+    """sklearn.metrics.pairwise.cosine_similarity for dense float32 arrays."""
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = a if b is None else b / np.linalg.norm(b, axis=1, keepdims=True)
+    return a @ b.T
+
+
+def notebook_result_df(emb_df: pd.DataFrame, df_product: pd.DataFrame, df_sales: pd.DataFrame) -> pd.DataFrame:
+    """
+    The "Image Grouping", "Similarity", size/colour and price cells of
+    ``Parfois Similarity.ipynb``, kept as written (brute force, one item
+    at a time) as the reference for ``build_result_df``.
+    """
+    df_product = df_product.copy()
+    df_sales = df_sales.copy()
+    df_product["product_id"] = df_product["PROG_IMAGE"].str.split("/").str[-1]
+
+    result_df = emb_df.merge(
+        df_product[["product_id", "L3_DES", "L4_DES", "PROD_REF"]],
+        left_on="image_name", right_on="product_id", how="left",
+    )
+    result_df["DES_CONC"] = (
+        result_df["L3_DES"].fillna("Other").astype(str) + "_"
+        + result_df["L4_DES"].fillna("Other").astype(str)
+    )
+    result_df = result_df.drop(columns=["product_id", "L3_DES", "L4_DES"]).drop_duplicates()
+
+    embedding_cols = [c for c in emb_df.columns if c != "image_name"]
+    emb_dict = {row["image_name"]: row[embedding_cols].values.astype(np.float32) for _, row in emb_df.iterrows()}
+    prod_ref_dict = dict(zip(result_df["image_name"], result_df["PROD_REF"]))
+
+    result_image_names = [name for name in result_df["image_name"] if name in emb_dict]
+    all_embeddings = np.array([emb_dict[name] for name in result_image_names])
+
+    similarity_results = []
+    for des_conc, group in result_df.groupby("DES_CONC"):
+        group_image_names = [name for name in group["image_name"] if name in emb_dict]
+        group_embeddings = np.array([emb_dict[name] for name in group_image_names], dtype=np.float32)
+        group_prod_refs = {name: prod_ref_dict[name] for name in group_image_names}
+        group_sim_matrix = cosine_similarity(group_embeddings)
+
+        for original_idx, row in group.iterrows():
+            img_name = row["image_name"]
+            current_prod_ref = row["PROD_REF"]
+            img_group_idx = group_image_names.index(img_name)
+
+            group_similarities = group_sim_matrix[img_group_idx].copy()
+            for group_idx, group_img_name in enumerate(group_image_names):
+                if group_img_name == img_name or group_prod_refs[group_img_name] == current_prod_ref:
+                    group_similarities[group_idx] = -1
+
+            above_90_group = np.where(group_similarities >= 0.90)[0]
+            if len(above_90_group) > 0:
+                above_90_group = above_90_group[np.argsort(-group_similarities[above_90_group])]
+
+            selected_indices, selected_scores = [], []
+            for sim_idx in above_90_group:
+                selected_indices.append(group_image_names[sim_idx])
+                selected_scores.append(group_similarities[sim_idx])
+
+            if len(above_90_group) < 4:
+                valid_indices = np.where(group_similarities > -1)[0]
+                sorted_valid = valid_indices[np.argsort(-group_similarities[valid_indices])]
+                for sim_idx in sorted_valid:
+                    if len(selected_indices) >= 4:
+                        break
+                    if sim_idx not in above_90_group:
+                        selected_indices.append(group_image_names[sim_idx])
+                        selected_scores.append(group_similarities[sim_idx])
+
+                if len(selected_indices) < 4:
+                    global_similarities = cosine_similarity(emb_dict[img_name].reshape(1, -1), all_embeddings)[0]
+                    selected_set = set(selected_indices) | {img_name}
+                    for i, name in enumerate(result_image_names):
+                        if name in selected_set or prod_ref_dict.get(name) == current_prod_ref:
+                            global_similarities[i] = -1
+
+                    above_90_global = np.where(global_similarities >= 0.90)[0]
+                    above_90_global = above_90_global[np.argsort(-global_similarities[above_90_global])]
+                    for global_idx in above_90_global:
+                        selected_indices.append(result_image_names[global_idx])
+                        selected_scores.append(global_similarities[global_idx])
+                        if len(selected_indices) >= 4:
+                            break
+
+                    if len(selected_indices) < 4:
+                        valid_global = np.where(global_similarities > -1)[0]
+                        sorted_global = valid_global[np.argsort(-global_similarities[valid_global])]
+                        for global_idx in sorted_global:
+                            selected_indices.append(result_image_names[global_idx])
+                            selected_scores.append(global_similarities[global_idx])
+                            if len(selected_indices) >= 4:
+                                break
+
+            result_row = {"original_idx": original_idx}
+            for rank, (similar_name, score) in enumerate(zip(selected_indices, selected_scores), 1):
+                result_row[f"similar_image_{rank}"] = similar_name
+                result_row[f"similarity_score_{rank}"] = score
+            similarity_results.append(result_row)
+
+    similarity_df = pd.DataFrame(similarity_results)
+    result_df = result_df.merge(similarity_df, left_index=True, right_on="original_idx", how="left")
+    result_df = result_df.drop(columns=["original_idx"])
+
+    product_agg = df_product.groupby("PROD_REF").agg({
+        "SZ_DES": lambda x: ", ".join(sorted(set(x.dropna()))),
+        "CLR_DES": lambda x: ", ".join(sorted(set(x.dropna()))),
+    }).reset_index()
+    product_agg.rename(columns={"SZ_DES": "Sizes", "CLR_DES": "Color"}, inplace=True)
+    result_df = result_df.merge(product_agg, left_on="PROD_REF", right_on="PROD_REF", how="left")
+
+    df_sales["price"] = df_sales["SALES_AMT_FX_RATE"] / df_sales["SALES_QTY"]
+    price_map = df_sales.groupby("PROD_CLR_EQUIV")["price"].mean().to_dict()
+    prod_to_clr = dict(zip(df_product["product_id"], df_product["PROD_CLR_EQUIV"]))
+    image_to_price = {}
+    for img_name in result_df["image_name"]:
+        prod_clr = prod_to_clr.get(img_name)
+        if prod_clr:
+            image_to_price[img_name] = price_map.get(prod_clr)
+    result_df["Price"] = result_df["image_name"].map(image_to_price)
+
+    similar_cols = [col for col in result_df.columns if col.startswith("similar_image_")]
+
+    def avg_similar_price(row):
+        prices = [image_to_price.get(row[col]) for col in similar_cols if pd.notna(row[col])]
+        prices = [p for p in prices if pd.notna(p)]
+        return np.mean(prices) if prices else np.nan
+
+    result_df["Avg_Similar_Price"] = result_df.apply(avg_similar_price, axis=1)
+    return result_df.reset_index(drop=True)
+
+
+def test_engine_matches_the_notebook(tmp_path):
+    # Four DES_CONC groups of two clusters each
+    vectors, clusters = synthetic_vectors(160, noise=0.11)
+    names = [f"IMG{i:04d}_1" for i in range(160)]
+    groups = clusters // 2
+    # A group of three far from everything (global fallback) and an image
+    # with no product row ("Other_Other", no PROD_REF)
+    rng = np.random.default_rng(7)
+    extra = rng.standard_normal((4, vectors.shape[1])).astype(np.float32)
+    extra[:3] = extra[0] + 0.3 * extra[:3]
+    extra /= np.linalg.norm(extra, axis=1, keepdims=True)
+    small = [f"SML{i:04d}_1" for i in range(3)]
+
+    all_names = names + small + ["LONE0000_1"]
+    all_vectors = np.concatenate([vectors, extra])
+    npy_path = save_embeddings(tmp_path / "embeddings.npy", all_names, all_vectors)
+    df_product = synthetic_products(names + small, np.r_[groups, [99, 99, 99]])
+    df_sales = synthetic_sales(all_names)
+    # Some images have no sales, so no price
+    df_sales = df_sales[~df_sales["PROD_CLR_EQUIV"].isin(names[::9])]
+    df_product.to_csv(tmp_path / "df_product.csv", index=False)
+    df_sales.to_csv(tmp_path / "df_sales.csv", index=False)
+
+    emb_df = pd.DataFrame(all_vectors, columns=[str(i) for i in range(all_vectors.shape[1])])
+    emb_df.insert(0, "image_name", all_names)
+    expected = notebook_result_df(emb_df, df_product, df_sales)
+    result_df, _, _ = build_result_df(npy_path, tmp_path / "df_product.csv", tmp_path / "df_sales.csv")
+
+    # The data covers every rule, within what the engine keeps (GRAPH_K)
+    listed = expected.filter(like="similar_image_").notna().sum(axis=1)
+    assert (listed > N_SIMILAR).any() and listed.max() <= GRAPH_K
+    assert (expected["similarity_score_1"] < 0.90).any()
+    assert expected["Price"].isna().any()
+    # The notebook can list an item twice after a global >= 0.90 match; the data avoids it
+    assert not expected.filter(like="similar_image_").T.apply(lambda c: c.dropna().duplicated().any()).any()
+
+    columns = ["image_name", "PROD_REF", "DES_CONC", "Sizes", "Color", "Price", "Avg_Similar_Price"]
+    for rank in range(1, N_SIMILAR + 1):
+        columns += [f"similar_image_{rank}", f"similarity_score_{rank}"]
+    pd.testing.assert_frame_equal(
+        result_df[columns], expected[columns],
+        check_dtype=False, check_exact=False, rtol=1e-5, atol=1e-6,
+    )
+
+
+def test_neighbours_do_not_depend_on_workers_or_tiling():
+    vectors, clusters = synthetic_vectors(600, dim=32, noise=0.2)
+    groups = clusters % 3
+    prod_refs = np.arange(600) // 2
+    names = np.array([f"IMG{i:04d}_1" for i in range(600)], dtype=object)
+    embeddings = normalize_rows(vectors)
+
+    reference = compute_neighbours(embeddings, groups, prod_refs, names, top_k=GRAPH_K, max_neighbours=GRAPH_K)
+    for options in (
+        dict(workers=2),
+        dict(block_size=37, fallback_block_size=5),
+        # A budget this small forces column tiles with a running top-K
+        dict(memory_budget_mb=0.05),
+        dict(workers=2, block_size=64, memory_budget_mb=0.05),
+    ):
+        idx, scores = compute_neighbours(
+            embeddings, groups, prod_refs, names, top_k=GRAPH_K, max_neighbours=GRAPH_K, **options
+        )
+        np.testing.assert_array_equal(idx, reference[0])
+        np.testing.assert_allclose(scores, reference[1], rtol=1e-6)
+
+    # Never the item itself nor an item with the same PROD_REF
+    idx = reference[0]
+    rows = np.repeat(np.arange(len(idx))[:, None], idx.shape[1], axis=1)
+    valid = idx >= 0
+    assert not (idx[valid] == rows[valid]).any()
+    assert not (prod_refs[idx[valid]] == prod_refs[rows[valid]]).any()
+
+
+def test_quantized_neighbours_stay_close():
+    vectors, clusters = synthetic_vectors(400, dim=64, noise=0.2)
+    embeddings = normalize_rows(vectors)
+    args = (clusters % 2, np.arange(400) // 2, np.array([f"IMG{i:04d}_1" for i in range(400)], dtype=object))
+    exact, _ = compute_neighbours(embeddings, *args)
+
+    for mode, min_overlap in (("float16", 0.99), ("int8", 0.95), ("pq", 0.6)):
+        codec_options = {"m": 16} if mode == "pq" else {}
+        approx, _ = compute_neighbours(quantize(embeddings, mode, **codec_options), *args, workers=2)
+        overlap = np.mean([len(np.intersect1d(a[a >= 0], e[e >= 0])) / N_SIMILAR for a, e in zip(approx, exact)])
+        assert overlap >= min_overlap, (mode, overlap)
@@ -0,0 +1,23 @@
+import shutil
+
+from PIL import Image
+
+from thumbnails import image_srcset
+
+
+def test_deleted_variants_are_rendered_again(tmp_path):
+    image_path = tmp_path / "A_1.png"
+    Image.new("RGBA", (400, 600), (255, 0, 0, 128)).save(image_path)
+    static_dir = tmp_path / "thumbs"
+
+    src, srcset, width = image_srcset(image_path, "/thumbs", static_dir=static_dir)
+    assert width == 400
+    # Widths above the original are capped at the original width
+    assert [part.rsplit(" ", 1)[1] for part in srcset.split(", ")] == ["160w", "320w", "400w"]
+    assert src == srcset.split(", ")[-1].rsplit(" ", 1)[0]
+    rendered = sorted(p.relative_to(static_dir) for p in static_dir.rglob("*.jpg"))
+    assert len(rendered) == 3
+
+    shutil.rmtree(static_dir)
+    assert image_srcset(image_path, "/thumbs", static_dir=static_dir) == (src, srcset, width)
+    assert sorted(p.relative_to(static_dir) for p in static_dir.rglob("*.jpg")) == rendered
@@ -0,0 +1,191 @@
+"""
+Pre-encoded thumbnails for the product cards.
+
+The cards do not send thumbnails over the websocket: they reference
+``srcset`` variants (fixed widths, never upscaled) by URL. The variants
+are files under ``static/thumbs/`` named after the SHA-1 of the original
+image and the width, so a URL never changes meaning and can be cached
+forever; an edited image simply gets new variants. They are served by
+Streamlit's static route (``app/static/``, ``server.enableStaticServing``
+in ``.streamlit/config.toml``) or by ``image_server.py``, which adds
+immutable cache headers.
+
+The app renders a missing variant on first view (also when it was
+deleted from ``static/thumbs/`` while the app was running); prewarming
+renders them all ahead of time.
+
+Older versions cached per-scale thumbnails under ``.thumbnails/``; the
+srcset widths replace them, so that directory can be deleted.
+
+Usage
+-----
+    python thumbnails.py --workers 4    # render the variants of every image of Files/
+"""
+import argparse
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from image_manifest import build_manifest
+
+BASE_DIR = Path(__file__).resolve().parent
+
+THUMBNAIL_FORMATS = {"jpeg": ".jpg", "webp": ".webp"}
+THUMBNAIL_QUALITY = 85
+
+# srcset variants, served as static files (see the module docstring)
+STATIC_THUMBNAIL_DIR = BASE_DIR / "static" / "thumbs"
+STATIC_URL = "app/static/thumbs"
+SRCSET_WIDTHS = (160, 320, 480)
+
+
+@lru_cache(maxsize=16384)
+def _file_hash(path: str, mtime_ns: int, size: int) -> str:
+    """SHA-1 of the file contents, remembered per (path, mtime, size)."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    stat = os.stat(path)
+    return _file_hash(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _flatten_rgb(image: Image.Image) -> Image.Image:
+    # JPEG has no alpha: flatten transparent PNGs on white
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _encode(image: Image.Image, size: Tuple[int, int], fmt: str) -> bytes:
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so concurrent readers never see half a file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+# -------------------------------------------------
+# Static srcset variants
+# -------------------------------------------------
+def variant_name(digest: str, width: int, fmt: str = "jpeg") -> str:
+    """Path of a variant relative to the static directory: <hash[:2]>/<hash>_<width>w<ext>."""
+    return f"{digest[:2]}/{digest}_{width}w{THUMBNAIL_FORMATS[fmt]}"
+
+
+def ensure_variants(
+    image_path: Path,
+    widths: Sequence[int] = SRCSET_WIDTHS,
+    fmt: str = "jpeg",
+    static_dir: Path = STATIC_THUMBNAIL_DIR,
+) -> Tuple[str, int, Tuple[Tuple[int, str], ...]]:
+    """
+    Render the missing srcset variants of an image.
+
+    Widths above the original width are replaced by the original width.
+    Returns (content hash, original width, ((width, relative name), ...)).
+    """
+    digest = file_hash(image_path)
+    with Image.open(image_path) as image:
+        # Only the header is read unless a variant is missing
+        width, height = image.size
+        variants = tuple(
+            (w, variant_name(digest, w, fmt)) for w in sorted({min(w, width) for w in widths})
+        )
+        missing = [(w, name) for w, name in variants if not (Path(static_dir) / name).exists()]
+        if missing:
+            image = _flatten_rgb(image)
+            for w, name in missing:
+                data = _encode(image, (w, max(1, round(height * w / width))), fmt)
+                _write_atomic(Path(static_dir) / name, data)
+    return digest, width, variants
+
+
+@lru_cache(maxsize=16384)
+def _cached_variants(path: str, mtime_ns: int, fmt: str, static_dir: str):
+    return ensure_variants(Path(path), fmt=fmt, static_dir=Path(static_dir))
+
+
+def image_srcset(
+    image_path: Path,
+    base_url: str = STATIC_URL,
+    fmt: str = "jpeg",
+    static_dir: Path = STATIC_THUMBNAIL_DIR,
+) -> Tuple[str, str, int]:
+    """
+    (src, srcset, original width) of an image's static variants; the
+    variants are rendered on the first call for a given file version, and
+    again if their files have been deleted since.
+    """
+    mtime_ns = os.stat(image_path).st_mtime_ns
+    _, width, variants = _cached_variants(str(image_path), mtime_ns, fmt, str(static_dir))
+    if not all((Path(static_dir) / name).exists() for _, name in variants):
+        _, width, variants = ensure_variants(Path(image_path), fmt=fmt, static_dir=Path(static_dir))
+    base_url = base_url.rstrip("/")
+    srcset = ", ".join(f"{base_url}/{name} {w}w" for w, name in variants)
+    return f"{base_url}/{variants[-1][1]}", srcset, width
+
+
+def _prewarm_one(job: Tuple[str, str]) -> bool:
+    path, fmt = job
+    try:
+        ensure_variants(Path(path), fmt=fmt)
+        return True
+    except Exception as e:
+        print(f"Error with image {path}: {e}")
+        return False
+
+
+def prewarm(
+    image_paths: Iterable[Path],
+    fmt: str = "jpeg",
+    workers: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Render the srcset variants of every image with a process pool. Returns (ok, failed)."""
+    jobs = [(str(p), fmt) for p in image_paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_prewarm_one, jobs, chunksize=32))
+    ok = sum(results)
+    return ok, len(results) - ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render the srcset variants of the product cards.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores).")
+    parser.add_argument("--format", choices=sorted(THUMBNAIL_FORMATS), default="jpeg")
+    args = parser.parse_args(argv)
+
+    manifest = build_manifest()
+    start = time.perf_counter()
+    ok, failed = prewarm(manifest.paths.values(), args.format, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"Rendered the variants of {ok} images ({failed} failed) into {STATIC_THUMBNAIL_DIR} "
+          f"in {elapsed:.1f}s – {ok / max(elapsed, 1e-9):.0f}/s")
+
+
+if __name__ == "__main__":
+    main()